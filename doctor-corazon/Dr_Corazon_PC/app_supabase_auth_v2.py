@@ -1,41 +1,84 @@
 # app_supabase_auth_v2.py - Servidor NO bloqueante con Frontend completo
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, send_file
+import os
+import concurrencia
+
+# eventlet (por defecto) debe parchear socket/threading antes de cualquier otro import.
+# DR_CORAZON_ASYNC=threading vuelve al servidor Werkzeug con un hilo del SO por conexión.
+MODO_ASYNC = concurrencia.preparar(os.environ.get('DR_CORAZON_ASYNC', 'eventlet'))
+
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, session, flash, send_file,
+                   Response, stream_with_context)
 from flask_socketio import SocketIO, emit
-import threading
-import numpy as np
 import time
 import json
 import io
-from holter_ai import HolterAnalyzer
-import receiver_udp  # Tu receptor EASI
-from hr_hrv_analyzer import HRVAnalyzer, interpretar_hrv
-from supabase_config import supabase, crear_paciente, guardar_diagnostico
+from functools import wraps
+from supabase_config import (supabase, repositorio, repositorio_servicio, pool, verificador_jwt,
+                             al_guardar_diagnosticos, obtener_estadisticas_paciente, obtener_tendencia_paciente)
 from auth_manager import AuthManager
+from onda_viva import sala_onda_viva, tasa_permitida
+from registro_dispositivos import crear_registro, DispositivoOcupado
+from estado_compartido import crear_estado, url_estado
+from bus_eventos import BusLocal
+from nodo_captura import NodoCaptura, sala_paciente
+from metricas import metricas
+from perfilador import perfilar, PerfilEnCurso
+from paginacion import proyeccion, etag, CursorInvalido
+from pool_supabase import fijar_token
+from exportacion import (registros_usuario, ndjson_gzip, zip_usuario, ExportacionesAdmin, ExportacionEnCurso,
+                         ExportacionNoDisponible)
+
+# Despliegue: sin DR_CORAZON_COLA todo corre en este proceso (captura incluida).
+# Con una cola (ej. redis://localhost:6379/0) varios workers web reparten los
+# eventos del nodo de captura (python nodo_captura.py) y comparten el estado.
+URL_COLA = os.environ.get('DR_CORAZON_COLA')
+URL_ESTADO = url_estado(URL_COLA)
+CAPTURA_LOCAL = os.environ.get('DR_CORAZON_CAPTURA', 'remota' if URL_COLA else 'local') == 'local'
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dr_corazon_secure_key_2024_change_this'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=MODO_ASYNC, message_queue=URL_COLA)
 
 # Inicializar gestor de autenticación
-auth = AuthManager(supabase)
-
-# Configuración
-RUTA_MODELO = "vcg_model_optimized_4classes.h5"
-motor_ia = None
-analizador_hrv = None
-
-# Estado global del sistema
-estado_sistema = {
-    'conectado': False,
-    'capturando': False,
-    'ultimo_diagnostico': None,
-    'modo_captura': 'auto',  # 'auto', 'manual', 'pausado'
-    'paciente_activo': {}  # {user_id: paciente_id}
-}
-
-# Lock para thread-safety
-import threading
-estado_lock = threading.Lock()
+auth = AuthManager(supabase, repositorio, verificador_jwt)
+al_guardar_diagnosticos(auth.diagnosticos_guardados)  # Estadísticas del dashboard al día
+
+# Estado del sistema (modo de captura, paciente activo por usuario, último
+# diagnóstico por paciente, suscripciones en vivo): en memoria o en Redis
+estado_sistema = crear_estado(URL_ESTADO)
+
+# Enrutamiento dispositivo (IP del ESP32) → paciente: cada ventana se analiza,
+# guarda y emite una sola vez, para el paciente vinculado a su dispositivo
+registro = crear_registro(URL_ESTADO)
+
+# Captura + inferencia + persistencia en este proceso (por defecto) o en un nodo aparte
+nodo = NodoCaptura(BusLocal(socketio), estado_sistema, registro) if CAPTURA_LOCAL else None
+
+# Exportaciones masivas del admin (hilo de fondo, sin token de usuario: clave de servicio;
+# el progreso vive en este proceso)
+exportaciones = ExportacionesAdmin(repositorio_servicio,
+                                   directorio=os.environ.get('DR_CORAZON_EXPORTACIONES', 'exportaciones'))
+
+@app.before_request
+def _token_bd():
+    """Las consultas de esta petición llevan el token de su usuario (pool_supabase.py)"""
+    auth.obtener_usuario_actual()  # Verifica la sesión (y refresca el token si expiró)
+    fijar_token(auth.token_sesion())
+
+@app.teardown_request
+def _soltar_token_bd(exc=None):
+    fijar_token(None)
+
+def _token_bd_socket(manejador):
+    """Los eventos de socket.io no pasan por before_request: mismo token por evento"""
+    @wraps(manejador)
+    def envoltorio(*args, **kwargs):
+        _token_bd()
+        try:
+            return manejador(*args, **kwargs)
+        finally:
+            fijar_token(None)
+    return envoltorio
 
 # ============================================================================
 # RUTAS DE AUTENTICACIÓN
@@ -59,7 +102,7 @@ def login():
         session_data = auth.login(email, password)
         
         if session_data and session_data.user:
-            auth.guardar_sesion_flask(session_data.user)
+            auth.guardar_sesion_flask(session_data)
             flash('¡Bienvenido!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -108,12 +151,38 @@ def dashboard():
     return render_template('dashboard.html', 
                          usuario=perfil,
                          estadisticas=stats,
-                         estado=estado_sistema)
+                         estado=estado_sistema.instantanea())
 
 # ============================================================================
 # API DE PACIENTES
 # ============================================================================
 
+# Columnas que los clientes pueden pedir con ?campos= (por defecto, todas estas)
+COLUMNAS_PACIENTE = ('id', 'nombre', 'identificacion', 'edad', 'genero', 'user_id', 'created_at')
+COLUMNAS_DIAGNOSTICO = (
+    'id', 'paciente_id', 'timestamp', 'diagnostico', 'probabilidad_normal', 'probabilidad_infarto',
+    'probabilidad_bradicardia', 'probabilidad_taquicardia', 'alerta_critica', 'tiempo_analisis',
+    'notas', 'hr_bpm', 'hrv_sdnn', 'hrv_rmssd', 'hrv_pnn50', 'num_picos_r'
+)
+
+def _columnas(orden, permitidas):
+    """Proyección pedida (?campos=) más las columnas de la clave del cursor"""
+    columnas = proyeccion(request.args.get('campos'), permitidas, permitidas)
+    return columnas + [c for c in orden if c not in columnas]
+
+def _respuesta_condicional(payload, version=None):
+    """
+    JSON con ETag (de la versión dada o del cuerpo): si coincide con
+    If-None-Match se responde 304 sin cuerpo
+    """
+    respuesta = jsonify(payload)
+    if version:
+        respuesta.set_etag(version)
+    else:
+        respuesta.add_etag()
+    respuesta.headers['Cache-Control'] = 'private, no-cache'  # Revalidar siempre con If-None-Match
+    return respuesta.make_conditional(request)
+
 @app.route('/api/pacientes', methods=['GET', 'POST'])
 @auth.login_required
 def api_pacientes():
@@ -122,13 +191,17 @@ def api_pacientes():
     es_admin = auth.es_administrador(user_id)
     
     if request.method == 'GET':
+        # Páginas por (created_at, id); ?cursor= de la respuesta anterior, ?limite=, ?campos=
+        orden = ('created_at', 'id')
+        columnas = _columnas(orden, COLUMNAS_PACIENTE)
         try:
-            if es_admin:
-                response = supabase.table("pacientes").select("*, user_profiles(email, nombre_completo)").execute()
-            else:
-                response = supabase.table("pacientes").select("*").eq('user_id', user_id).execute()
-            
-            return jsonify({"status": "ok", "data": response.data})
+            filas, siguiente = repositorio.listar_pacientes(
+                None if es_admin else user_id, request.args.get('cursor'),
+                request.args.get('limite', 100, type=int), columnas, con_usuario=es_admin
+            )
+            return _respuesta_condicional({"status": "ok", "data": filas, "siguiente": siguiente})
+        except CursorInvalido as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
     
@@ -136,35 +209,83 @@ def api_pacientes():
         try:
             data = request.json
             
-            paciente = supabase.table("pacientes").insert({
+            paciente = repositorio.crear_paciente({
                 'nombre': data.get('nombre'),
                 'edad': data.get('edad'),
                 'genero': data.get('genero'),
                 'identificacion': data.get('identificacion'),
                 'user_id': user_id
-            }).execute()
+            })
+            auth.registrar_paciente(paciente)
             
-            return jsonify({"status": "ok", "data": paciente.data[0]})
+            return jsonify({"status": "ok", "data": paciente})
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/paciente/<paciente_id>/diagnosticos', methods=['GET'])
 @auth.login_required
 def api_diagnosticos_paciente(paciente_id):
-    """Obtiene diagnósticos de un paciente"""
+    """
+    Diagnósticos de un paciente, más recientes primero, en páginas por
+    (timestamp, id). Query: limite=10, cursor, campos=hr_bpm,diagnostico,...
+    """
     user_id = auth.obtener_user_id_sesion()
-    es_admin = auth.es_administrador(user_id)
+    orden = ('timestamp', 'id')
+    columnas = _columnas(orden, COLUMNAS_DIAGNOSTICO)
+    cursor = request.args.get('cursor')
+    limite = request.args.get('limite', 10, type=int)
     
     try:
-        paciente = supabase.table('pacientes').select('user_id').eq('id', paciente_id).single().execute()
-        
-        if not es_admin and paciente.data['user_id'] != user_id:
+        if not auth.puede_acceder_paciente(user_id, paciente_id):
             return jsonify({"status": "error", "message": "No tienes permiso"}), 403
         
-        limite = request.args.get('limite', 10, type=int)
-        diagnosticos = supabase.table("diagnosticos").select("*").eq('paciente_id', paciente_id).order('timestamp', desc=True).limit(limite).execute()
+        # Versión = agregados del paciente (una fila por PK): los diagnósticos solo se
+        # agregan, así que mismo total y último timestamp = misma página. Si el cliente
+        # ya la tiene se responde 304 sin consultar los diagnósticos.
+        agregados = repositorio.estadisticas_paciente(paciente_id) or {}
+        version = [agregados.get('total'), agregados.get('ultimo_timestamp')]
+        etiqueta = etag(paciente_id, version, cursor, limite, columnas)
+        if request.if_none_match.contains(etiqueta):
+            respuesta = Response(status=304)
+            respuesta.set_etag(etiqueta)
+            return respuesta
         
-        return jsonify({"status": "ok", "data": diagnosticos.data})
+        filas, siguiente = repositorio.listar_diagnosticos(paciente_id, cursor, limite, columnas)
+        
+        return _respuesta_condicional({"status": "ok", "data": filas, "siguiente": siguiente}, etiqueta)
+    except CursorInvalido as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/paciente/<paciente_id>/estadisticas', methods=['GET'])
+@auth.login_required
+def api_estadisticas_paciente(paciente_id):
+    """Estadísticas agregadas de un paciente (sin recorrer sus diagnósticos)"""
+    user_id = auth.obtener_user_id_sesion()
+    
+    if not auth.puede_acceder_paciente(user_id, paciente_id):
+        return jsonify({"status": "error", "message": "No tienes permiso"}), 403
+    
+    horas = min(request.args.get('horas', 24, type=int), 24 * 7)
+    return jsonify({"status": "ok", "data": obtener_estadisticas_paciente(paciente_id, horas)})
+
+@app.route('/api/paciente/<paciente_id>/tendencia', methods=['GET'])
+@auth.login_required
+def api_tendencia_paciente(paciente_id):
+    """
+    Tendencia de HR/HRV en un número fijo de puntos (la resolución de los
+    rollups se elige según el rango). Query: horas=24, puntos=120
+    """
+    user_id = auth.obtener_user_id_sesion()
+    
+    if not auth.puede_acceder_paciente(user_id, paciente_id):
+        return jsonify({"status": "error", "message": "No tienes permiso"}), 403
+    
+    horas = min(max(request.args.get('horas', 24, type=float), 0.1), 24 * 30)
+    puntos = min(max(request.args.get('puntos', 120, type=int), 10), 500)
+    try:
+        return jsonify({"status": "ok", "data": obtener_tendencia_paciente(paciente_id, horas * 3600, puntos)})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -173,24 +294,48 @@ def api_diagnosticos_paciente(paciente_id):
 def api_seleccionar_paciente():
     """Selecciona paciente activo"""
     user_id = auth.obtener_user_id_sesion()
-    es_admin = auth.es_administrador(user_id)
     
     data = request.json
     paciente_id = data.get('paciente_id')
     
     try:
-        paciente = supabase.table('pacientes').select('user_id').eq('id', paciente_id).single().execute()
-        
-        if not es_admin and paciente.data['user_id'] != user_id:
+        if not auth.puede_acceder_paciente(user_id, paciente_id):
             return jsonify({"status": "error", "message": "No tienes permiso"}), 403
         
-        with estado_lock:
-            estado_sistema['paciente_activo'][user_id] = paciente_id
+        conflicto = None
+        try:
+            dispositivo = _vincular_dispositivo(user_id, paciente_id, data.get('dispositivo'))
+        except DispositivoOcupado as e:
+            # Dispositivo pedido explícitamente: no se selecciona nada
+            if data.get('dispositivo'):
+                return jsonify({"status": "error", "message": str(e), "dispositivo": e.dispositivo}), 409
+            dispositivo, conflicto = None, str(e)
+        
+        estado_sistema.fijar_paciente_activo(user_id, paciente_id)
         
-        return jsonify({"status": "ok", "paciente_id": paciente_id})
+        return jsonify({"status": "ok", "paciente_id": paciente_id, "dispositivo": dispositivo, "conflicto": conflicto})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _vincular_dispositivo(user_id, paciente_id, dispositivo=None):
+    """
+    Vincula al paciente el dispositivo elegido (o el automático). Si está
+    vinculado a otro paciente solo se reasigna cuando el usuario es
+    administrador o dueño de ese paciente.
+    
+    Returns:
+        str: Dispositivo vinculado o None si no se pudo decidir
+    
+    Raises:
+        DispositivoOcupado: El dispositivo es de un paciente ajeno al usuario
+    """
+    try:
+        return registro.vincular_seleccion(paciente_id, dispositivo)
+    except DispositivoOcupado as e:
+        if not auth.puede_acceder_paciente(user_id, e.paciente_id):
+            raise
+        return registro.vincular_seleccion(paciente_id, e.dispositivo, reemplazable=e.paciente_id)
+
 # ============================================================================
 # API DE CONTROL DE CAPTURA
 # ============================================================================
@@ -199,9 +344,7 @@ def api_seleccionar_paciente():
 @auth.login_required
 def api_iniciar_captura():
     """Inicia la captura de datos"""
-    with estado_lock:
-        estado_sistema['modo_captura'] = 'auto'
-        estado_sistema['capturando'] = True
+    estado_sistema.fijar(modo_captura='auto', capturando=True)
     
     return jsonify({"status": "ok", "message": "Captura iniciada"})
 
@@ -209,9 +352,7 @@ def api_iniciar_captura():
 @auth.login_required
 def api_pausar_captura():
     """Pausa la captura"""
-    with estado_lock:
-        estado_sistema['modo_captura'] = 'pausado'
-        estado_sistema['capturando'] = False
+    estado_sistema.fijar(modo_captura='pausado', capturando=False)
     
     return jsonify({"status": "ok", "message": "Captura pausada"})
 
@@ -219,8 +360,7 @@ def api_pausar_captura():
 @auth.login_required
 def api_captura_manual():
     """Captura un dato manualmente"""
-    with estado_lock:
-        estado_sistema['modo_captura'] = 'manual'
+    estado_sistema.fijar(modo_captura='manual')
     
     return jsonify({"status": "ok", "message": "Modo manual activado"})
 
@@ -228,36 +368,139 @@ def api_captura_manual():
 @auth.login_required
 def api_estado_sistema():
     """Obtiene el estado del sistema"""
-    with estado_lock:
-        estado = estado_sistema.copy()
+    estado = _estado_para_usuario(auth.obtener_user_id_sesion())
+    
+    # La forma de onda es binaria (solo para socket.io), no va en JSON
+    if estado['ultimo_diagnostico']:
+        estado['ultimo_diagnostico'] = {k: v for k, v in estado['ultimo_diagnostico'].items() if k != 'forma_onda'}
+    
+    estado.update(_metricas_captura())
+    _actualizar_gauges()
+    estado['metricas'] = metricas.instantanea()
+    estado['cache_autorizacion'] = auth.metricas_cache()
     
     return jsonify({"status": "ok", "estado": estado})
 
+def _estado_para_usuario(user_id):
+    """Copia del estado con solo el último diagnóstico del paciente que mira el usuario"""
+    estado = estado_sistema.instantanea()
+    estado.pop('captura', None)  # Métricas del nodo: van en persistencia/spool
+    paciente_activo = estado_sistema.paciente_activo(user_id)
+    estado['paciente_activo'] = paciente_activo
+    estado['ultimo_diagnostico'] = estado_sistema.ultimo_diagnostico(paciente_activo)
+    estado['dispositivo'] = registro.dispositivo_de(paciente_activo) if paciente_activo else None
+    return estado
+
+# ============================================================================
+# DISPOSITIVOS (vinculación ESP32 → paciente)
+# ============================================================================
+
+@app.route('/api/dispositivos')
+@auth.login_required
+def api_dispositivos():
+    """Lista los dispositivos vistos y su vinculación"""
+    user_id = auth.obtener_user_id_sesion()
+    es_admin = auth.es_administrador(user_id)
+    propio = estado_sistema.paciente_activo(user_id)
+    
+    dispositivos = registro.listar()
+    for d in dispositivos:
+        # Solo el admin ve a qué paciente ajeno está vinculado cada dispositivo
+        d['vinculado'] = d['paciente_id'] is not None
+        if not es_admin and d['paciente_id'] != propio:
+            d['paciente_id'] = None
+    
+    return jsonify({"status": "ok", "data": dispositivos})
+
+@app.route('/api/dispositivos/desvincular', methods=['POST'])
+@auth.login_required
+def api_desvincular_dispositivo():
+    """Deja de analizar un dispositivo (admin, o el usuario que mira su paciente)"""
+    user_id = auth.obtener_user_id_sesion()
+    dispositivo = (request.json or {}).get('dispositivo')
+    propio = estado_sistema.paciente_activo(user_id)
+    
+    if not auth.es_administrador(user_id) and registro.paciente_de(dispositivo) != propio:
+        return jsonify({"status": "error", "message": "No tienes permiso"}), 403
+    
+    registro.desvincular(dispositivo=dispositivo)
+    return jsonify({"status": "ok"})
+
+# ============================================================================
+# MÉTRICAS (formato Prometheus)
+# ============================================================================
+
+def _metricas_captura():
+    """
+    Persistencia y spool del nodo de captura: directas si corre en este
+    proceso, o las últimas que publicó el nodo en el estado compartido
+    """
+    if nodo is not None:
+        return nodo.metricas()
+    return estado_sistema.obtener('captura') or {'persistencia': None, 'spool': None}
+
+def _actualizar_gauges():
+    """Copia a gauges el estado que vive en otros componentes (se lee al consultar)"""
+    metricas.gauge('usuarios_activos', estado_sistema.usuarios_activos())
+    metricas.gauge('capturando', int(estado_sistema.obtener('modo_captura') != 'pausado'))
+    metricas.gauge('pacientes_activos', sum(1 for d in registro.listar() if d['paciente_id']))
+    if pool:
+        bd = pool.metricas()
+        metricas.gauge('bd_peticiones_en_curso', bd['en_curso'])
+        metricas.gauge('bd_peticiones_rechazadas', bd['rechazadas'])
+    
+    captura = _metricas_captura()
+    if not captura['persistencia']:
+        return
+    persistencia = captura['persistencia']
+    metricas.gauge('cola_persistencia', persistencia['profundidad_cola'])
+    metricas.gauge('persistencia_descartados', persistencia['descartados'])
+    metricas.gauge('persistencia_reintentos', persistencia['reintentos'])
+    
+    spool_estado = captura['spool']
+    metricas.gauge('spool_pendientes', spool_estado['pendientes'])
+    metricas.gauge('spool_descartados', spool_estado['descartados'])
+    metricas.gauge('spool_rechazados', spool_estado.get('rechazados', 0))  # Nodos anteriores no lo publican
+    metricas.gauge('spool_antiguedad_seg', spool_estado['antiguedad_max_seg'])
+    metricas.gauge('bd_fallos', spool_estado['fallos_remotos'])
+
+@app.route('/metrics')
+def metrics():
+    """Endpoint para Prometheus (sin login: solo contadores, sin datos de pacientes)"""
+    _actualizar_gauges()
+    return metricas.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # ============================================================================
 # EXPORTACIÓN DE DATOS
 # ============================================================================
 
+def _respuesta_exportacion(user_id, nombre):
+    """
+    Descarga por streaming de los datos de un usuario, página a página.
+    Query: formato=ndjson (gzip, por defecto) | zip (CSV + señales .npy), senales=1
+    """
+    formato = request.args.get('formato', 'ndjson')
+    incluir_senales = request.args.get('senales') == '1'
+    
+    if formato == 'zip':
+        trozos = zip_usuario(repositorio, user_id, incluir_senales)
+        mimetype, extension = 'application/zip', 'zip'
+    else:
+        trozos = ndjson_gzip(registros_usuario(repositorio, user_id, incluir_senales))
+        mimetype, extension = 'application/gzip', 'ndjson.gz'
+    
+    return Response(
+        stream_with_context(trozos),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{nombre}.{extension}"'}
+    )
+
 @app.route('/api/exportar-mis-datos')
 @auth.login_required
 def exportar_mis_datos():
-    """Exporta datos del usuario actual"""
+    """Exporta datos del usuario actual (streaming, ver exportacion.py)"""
     user_id = auth.obtener_user_id_sesion()
-    datos = auth.exportar_datos_usuario(user_id)
-    
-    if datos:
-        buffer = io.BytesIO()
-        buffer.write(json.dumps(datos, indent=2, ensure_ascii=False).encode('utf-8'))
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'datos_dr_corazon_{user_id}.json'
-        )
-    else:
-        flash('Error al exportar datos', 'danger')
-        return redirect(url_for('dashboard'))
+    return _respuesta_exportacion(user_id, f'datos_dr_corazon_{user_id}')
 
 # ============================================================================
 # PANEL DE ADMINISTRACIÓN
@@ -274,9 +517,7 @@ def admin_panel():
 def api_admin_usuarios():
     """Lista todos los usuarios"""
     try:
-        # Obtener todos los usuarios
-        response = supabase.table('user_profiles').select('*').execute()
-        return jsonify({"status": "ok", "data": response.data})
+        return jsonify({"status": "ok", "data": auth.listar_usuarios()})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -285,8 +526,7 @@ def api_admin_usuarios():
 def api_admin_estadisticas():
     """Obtiene estadísticas de todos los usuarios"""
     try:
-        response = supabase.table('vista_estadisticas_usuarios').select('*').execute()
-        return jsonify({"status": "ok", "data": response.data})
+        return jsonify({"status": "ok", "data": repositorio.estadisticas_usuarios()})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -311,22 +551,72 @@ def api_admin_desactivar_usuario(user_id):
 @app.route('/api/admin/exportar-usuario/<user_id>')
 @auth.admin_required
 def api_admin_exportar_usuario(user_id):
-    """Exporta datos de cualquier usuario"""
-    datos = auth.exportar_datos_usuario(user_id)
+    """Exporta datos de cualquier usuario (streaming)"""
+    return _respuesta_exportacion(user_id, f'datos_usuario_{user_id}')
+
+@app.route('/api/admin/exportaciones', methods=['POST'])
+@auth.admin_required
+def api_admin_iniciar_exportacion():
+    """
+    Exportación masiva en segundo plano a .ndjson.gz
+    Body JSON: {"user_ids": [...] (omitir = todos), "senales": false}
+    """
+    datos = request.get_json(silent=True) or {}
+    try:
+        trabajo_id = exportaciones.iniciar(datos.get('user_ids'), bool(datos.get('senales')))
+    except ExportacionEnCurso as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except ExportacionNoDisponible as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({"status": "ok", "data": exportaciones.estado(trabajo_id)}), 202
+
+@app.route('/api/admin/exportaciones/<trabajo_id>')
+@auth.admin_required
+def api_admin_estado_exportacion(trabajo_id):
+    """Progreso de una exportación masiva"""
+    trabajo = exportaciones.estado(trabajo_id)
+    if not trabajo:
+        return jsonify({"status": "error", "message": "Exportación no encontrada"}), 404
+    trabajo.pop('archivo', None)
+    return jsonify({"status": "ok", "data": trabajo})
+
+@app.route('/api/admin/exportaciones/<trabajo_id>/descarga')
+@auth.admin_required
+def api_admin_descargar_exportacion(trabajo_id):
+    """Descarga el archivo de una exportación masiva terminada"""
+    trabajo = exportaciones.estado(trabajo_id)
+    if not trabajo or trabajo['estado'] != 'terminado':
+        return jsonify({"status": "error", "message": "Exportación no disponible"}), 404
+    return send_file(
+        os.path.abspath(trabajo['archivo']),
+        mimetype='application/gzip',
+        as_attachment=True,
+        download_name=os.path.basename(trabajo['archivo'])
+    )
+
+@app.route('/api/admin/perfil')
+@auth.admin_required
+def api_admin_perfil():
+    """
+    Perfila por muestreo durante N segundos y descarga las pilas colapsadas
+    (flamegraph.pl / speedscope). Query: segundos=10, hilos=captura,Thread
+    """
+    segundos = request.args.get('segundos', 10, type=float)
+    hilos = request.args.get('hilos')
+    filtro_hilos = [h for h in hilos.split(',') if h] if hilos else None
     
-    if datos:
-        buffer = io.BytesIO()
-        buffer.write(json.dumps(datos, indent=2, ensure_ascii=False).encode('utf-8'))
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'datos_usuario_{user_id}.json'
-        )
-    else:
-        return jsonify({"status": "error"}), 500
+    try:
+        texto = perfilar(segundos=segundos, filtro_hilos=filtro_hilos)
+    except PerfilEnCurso as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    
+    buffer = io.BytesIO(texto.encode('utf-8'))
+    return send_file(
+        buffer,
+        mimetype='text/plain',
+        as_attachment=True,
+        download_name=f"perfil_{time.strftime('%Y%m%d_%H%M%S')}.collapsed"
+    )
 
 # ============================================================================
 # WEBSOCKETS
@@ -346,9 +636,12 @@ def handle_connect():
     print(f'✅ Cliente conectado: user_{user_id}')
     
     # Enviar estado inicial
-    with estado_lock:
-        estado = estado_sistema.copy()
-        paciente_activo = estado_sistema['paciente_activo'].get(user_id)
+    estado = _estado_para_usuario(user_id)
+    paciente_activo = estado['paciente_activo']
+    
+    # Los diagnósticos se emiten una vez por paciente a su sala
+    if paciente_activo:
+        join_room(sala_paciente(paciente_activo))
     
     emit('status', {
         'message': 'Conectado',
@@ -357,22 +650,53 @@ def handle_connect():
         'user_id': user_id
     })
     
-    # Enviar último diagnóstico si existe y es del usuario
-    with estado_lock:
-        ultimo = estado_sistema.get('ultimo_diagnostico')
-        if ultimo and paciente_activo:
-            emit('diagnostico', ultimo)
+    # Enviar último diagnóstico de su paciente si existe
+    if estado['ultimo_diagnostico']:
+        emit('diagnostico', estado['ultimo_diagnostico'])
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Cliente desconectado"""
     user_id = auth.obtener_user_id_sesion()
+    estado_sistema.desuscribir_onda(request.sid)
     if user_id:
         from flask_socketio import leave_room
         leave_room(f'user_{user_id}')
         print(f'❌ Cliente desconectado: user_{user_id}')
 
+@socketio.on('suscribir_onda_viva')
+def handle_suscribir_onda_viva(data=None):
+    """Suscribe el cliente al monitor en vivo a la tasa pedida (25, 10 o 5 envíos/s)"""
+    user_id = auth.obtener_user_id_sesion()
+    if not user_id:
+        emit('error', {'message': 'No autenticado'})
+        return
+    
+    paciente_id = estado_sistema.paciente_activo(user_id)
+    if not paciente_id:
+        emit('error', {'message': 'Selecciona un paciente primero'})
+        return
+    
+    from flask_socketio import join_room, leave_room
+    anterior = estado_sistema.desuscribir_onda(request.sid)
+    if anterior:
+        leave_room(sala_onda_viva(anterior[1], anterior[0]))
+    
+    hz = tasa_permitida((data or {}).get('hz', 25))
+    estado_sistema.suscribir_onda(request.sid, paciente_id, hz)
+    join_room(sala_onda_viva(hz, paciente_id))
+    emit('onda_viva_suscrito', {'hz': hz, 'paciente_id': paciente_id})
+
+@socketio.on('desuscribir_onda_viva')
+def handle_desuscribir_onda_viva():
+    """Deja de recibir el monitor en vivo"""
+    anterior = estado_sistema.desuscribir_onda(request.sid)
+    if anterior:
+        from flask_socketio import leave_room
+        leave_room(sala_onda_viva(anterior[1], anterior[0]))
+
 @socketio.on('seleccionar_paciente')
+@_token_bd_socket
 def handle_seleccionar_paciente(data):
     """Handle patient selection via WebSocket"""
     user_id = auth.obtener_user_id_sesion()
@@ -383,168 +707,46 @@ def handle_seleccionar_paciente(data):
     paciente_id = data.get('paciente_id')
     
     try:
-        # Verificar permisos
-        es_admin = auth.es_administrador(user_id)
-        paciente = supabase.table('pacientes').select('user_id, nombre').eq('id', paciente_id).single().execute()
-        
-        if not es_admin and paciente.data['user_id'] != user_id:
+        # Verificar permisos (rol y dueño del paciente en caché)
+        if not auth.puede_acceder_paciente(user_id, paciente_id):
             emit('error', {'message': 'No tienes permiso para este paciente'})
             return
+        paciente = auth.obtener_paciente(paciente_id)
+        
+        # Vinculación del dispositivo (cambio atómico de la tabla de enrutamiento:
+        # la siguiente ventana ya va al paciente nuevo) y paciente activo
+        conflicto = None
+        try:
+            dispositivo = _vincular_dispositivo(user_id, paciente_id, data.get('dispositivo'))
+        except DispositivoOcupado as e:
+            if data.get('dispositivo'):
+                emit('error', {'message': str(e), 'dispositivo': e.dispositivo})
+                return
+            dispositivo, conflicto = None, str(e)
+        estado_sistema.fijar_paciente_activo(user_id, paciente_id)
         
-        # Actualizar paciente activo
-        with estado_lock:
-            estado_sistema['paciente_activo'][user_id] = paciente_id
+        # Cambiar de sala de paciente (permiso ya verificado). Se sale de las
+        # salas de paciente de este socket, no de la del paciente activo del
+        # usuario: la API REST ya lo cambió y otra pestaña puede tener otro
+        from flask_socketio import join_room, leave_room, rooms
+        nueva = sala_paciente(paciente_id)
+        for sala in rooms():
+            if sala.startswith(sala_paciente('')) and sala != nueva:
+                leave_room(sala)
+        join_room(nueva)
         
         emit('paciente_seleccionado', {
             'paciente_id': paciente_id,
-            'nombre': paciente.data['nombre']
+            'nombre': paciente['nombre'],
+            'dispositivo': dispositivo,
+            'conflicto': conflicto
         })
         
-        print(f"✅ Usuario {user_id} seleccionó paciente: {paciente.data['nombre']}")
+        print(f"✅ Usuario {user_id} seleccionó paciente: {paciente['nombre']}")
         
     except Exception as e:
         emit('error', {'message': str(e)})
 
-# ============================================================================
-# HILO DE CAPTURA (NO BLOQUEANTE)
-# ============================================================================
-
-def ciclo_de_captura_background():
-    """Hilo separado para captura de datos ESP32 - NO bloquea el servidor"""
-    global motor_ia, analizador_hrv
-    
-    print("\n🚀 Iniciando hilo de captura en background...")
-    
-    # Inicializar IA y HRV
-    motor_ia = HolterAnalyzer(RUTA_MODELO)
-    analizador_hrv = HRVAnalyzer(frecuencia_muestreo=500)
-    print("✅ IA y HRV listos en background\n")
-    
-    # Marcar como conectado
-    with estado_lock:
-        estado_sistema['conectado'] = True
-    
-    socketio.emit('status', {
-        'message': 'Sistema inicializado',
-        'ia_ready': True,
-        'hrv_ready': True
-    })
-    
-    print("👂 Esperando datos ECG desde ESP32...")
-    print(f"   Puerto UDP: {receiver_udp.UDP_PORT}")
-    print(f"   Esperando ventanas de {receiver_udp.WINDOW_SEC}s ({receiver_udp.N_OUT} muestras)\n")
-    
-    # USAR TU RECEPTOR EASI
-    # enable_plot=False para NO bloquear con matplotlib
-    for datos_hardware in receiver_udp.receive_packets(enable_plot=False):
-        # Verificar si está pausado
-        with estado_lock:
-            if estado_sistema['modo_captura'] == 'pausado':
-                time.sleep(1)
-                continue
-            
-            pacientes_activos = estado_sistema['paciente_activo'].copy()
-        
-        if not pacientes_activos:
-            print("⚠️  No hay pacientes seleccionados")
-            time.sleep(1)
-            continue
-        
-        # Notificar procesamiento
-        socketio.emit('procesando', {
-            'message': 'Analizando señal EASI...',
-            'shape': datos_hardware.shape
-        })
-        
-        # Análisis
-        start_time = time.time()
-        resultado = motor_ia.diagnosticar(datos_hardware)
-        resultado_hrv = analizador_hrv.analizar(datos_hardware, usar_canal='mejor')
-        end_time = time.time()
-        
-        tiempo_analisis = end_time - start_time
-        
-        if resultado["status"] == "OK":
-            print(f"\n📊 Diagnóstico: {resultado['diagnostico_texto']} | HR: {resultado_hrv['hr_bpm']} BPM")
-            
-            # Guardar para cada usuario activo y emitir a su sala específica
-            for user_id, paciente_id in pacientes_activos.items():
-                try:
-                    # Guardar en base de datos
-                    diag_guardado = guardar_diagnostico(
-                        paciente_id=paciente_id,
-                        diagnostico=resultado['diagnostico_texto'],
-                        probabilidades=resultado['detalles'],
-                        tiempo_analisis=tiempo_analisis,
-                        alerta_critica=resultado.get('alerta_infarto', False),
-                        notas=f"User: {user_id} | EASI->XYZ",
-                        hr_bpm=resultado_hrv['hr_bpm'],
-                        hrv_sdnn=resultado_hrv['hrv_sdnn'],
-                        hrv_rmssd=resultado_hrv['hrv_rmssd'],
-                        hrv_pnn50=resultado_hrv['hrv_pnn50'],
-                        num_picos_r=resultado_hrv['num_picos']
-                    )
-                    
-                    if diag_guardado:
-                        print(f"  ✅ Guardado para usuario {user_id}, paciente {paciente_id}")
-                    
-                except Exception as e:
-                    print(f"❌ Error guardando para usuario {user_id}: {e}")
-            
-            # Preparar payload
-            interpretacion_hrv = interpretar_hrv(
-                resultado_hrv['hrv_sdnn'],
-                resultado_hrv['hrv_rmssd'],
-                resultado_hrv['hrv_pnn50']
-            )
-            
-            # Crear payload base
-            payload_base = {
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                'diagnostico': resultado['diagnostico_texto'],
-                'probabilidades': resultado['detalles'],
-                'tiempo_analisis': round(tiempo_analisis, 3),
-                'alerta': resultado.get('alerta_infarto', False),
-                'hr_bpm': resultado_hrv['hr_bpm'],
-                'hr_clasificacion': resultado_hrv['clasificacion_hr'],
-                'hrv_sdnn': resultado_hrv['hrv_sdnn'],
-                'hrv_rmssd': resultado_hrv['hrv_rmssd'],
-                'hrv_pnn50': resultado_hrv['hrv_pnn50'],
-                'num_picos': resultado_hrv['num_picos'],
-                'calidad_señal': resultado_hrv['calidad'],
-                'interpretacion_hrv': interpretacion_hrv,
-                'picos_indices': resultado_hrv['picos_indices'].tolist(),
-                # Submuestrear para enviar menos datos al frontend
-                'datos_x': datos_hardware[::10, 0].tolist(),
-                'datos_y': datos_hardware[::10, 1].tolist(),
-                'datos_z': datos_hardware[::10, 2].tolist(),
-            }
-            
-            # Enviar a cada usuario en su sala específica
-            for user_id, paciente_id in pacientes_activos.items():
-                # Agregar info del paciente al payload
-                payload = payload_base.copy()
-                payload['user_id'] = user_id
-                payload['paciente_id'] = paciente_id
-                
-                # Emitir solo a la sala de este usuario
-                socketio.emit('diagnostico', payload, room=f'user_{user_id}')
-                
-                # Si hay alerta, emitir alerta también
-                if resultado.get('alerta_infarto', False):
-                    socketio.emit('alerta_critica', {
-                        'tipo': 'infarto',
-                        'mensaje': 'ALERTA: Posible infarto',
-                        'hr_bpm': resultado_hrv['hr_bpm'],
-                        'user_id': user_id,
-                        'paciente_id': paciente_id
-                    }, room=f'user_{user_id}')
-            
-            with estado_lock:
-                estado_sistema['ultimo_diagnostico'] = payload_base
-        
-        time.sleep(0.5)
-
 # ============================================================================
 # INICIAR SERVIDOR
 # ============================================================================
@@ -555,7 +757,9 @@ if __name__ == '__main__':
     print("="*60)
     print("\n✅ Servidor Flask iniciado")
     print("✅ Frontend totalmente independiente")
-    print("✅ Backend NO bloqueante")
+    print(f"✅ Backend NO bloqueante (modo {MODO_ASYNC})")
+    print(f"✅ Captura: {'en este proceso' if CAPTURA_LOCAL else 'nodo separado'}"
+          f"{f' | cola {URL_COLA}' if URL_COLA else ''}")
     print("\n📍 URL: http://localhost:5000")
     print("\n⚙️  Características:")
     print("   - Panel Admin funcional")
@@ -565,9 +769,10 @@ if __name__ == '__main__':
     print("   - Consola solo para debugging")
     print("\n" + "="*60 + "\n")
     
-    # Iniciar hilo de captura EN BACKGROUND
-    captura_thread = threading.Thread(target=ciclo_de_captura_background, daemon=True)
-    captura_thread.start()
+    # Escritor de diagnósticos (write-behind), replicador del spool, monitor en vivo
+    # e hilo de captura EN BACKGROUND (con la captura en un nodo aparte, solo web)
+    if nodo is not None:
+        nodo.iniciar()
     
     # Iniciar servidor Flask (NO SE BLOQUEA)
     socketio.run(app, host='0.0.0.0', port=5000, debug=False, use_reloader=False)
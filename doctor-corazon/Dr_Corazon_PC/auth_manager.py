@@ -1,14 +1,40 @@
 # auth_manager.py - Sistema de Autenticación con Supabase
 from functools import wraps
-from flask import session, redirect, url_for, flash, request
+from flask import session, redirect, url_for, flash, request, g
 from supabase import Client
+import time
 import bcrypt
+from cache_ttl import CacheTTL
+from repositorio import RepositorioSupabase
+from pool_supabase import con_token
+from verificador_jwt import usuario_desde_claims, TokenExpirado, TokenInvalido, VerificacionNoDisponible
 
 class AuthManager:
     """Gestor de autenticación y autorización con Supabase"""
     
-    def __init__(self, supabase_client: Client):
+    def __init__(self, supabase_client: Client, repositorio=None, verificador=None,
+                 ttl_roles: float = 30.0, ttl_pacientes: float = 300.0,
+                 ttl_estadisticas: float = 60.0, ttl_perfiles: float = 60.0):
+        """
+        Args:
+            supabase_client: Cliente de Supabase (Auth)
+            repositorio: Acceso a tablas (repositorio.py); por defecto, el mismo Supabase
+            verificador: VerificadorJWT para validar la sesión sin llamar a Supabase
+                Auth; None = auth.get_user en cada petición
+            ttl_roles: Segundos que se reutiliza el rol/estado de un usuario
+            ttl_pacientes: Segundos que se reutiliza el dueño de un paciente
+            ttl_estadisticas: Segundos que se reutilizan las estadísticas del dashboard
+            ttl_perfiles: Segundos que se reutiliza el perfil de un usuario
+        """
         self.supabase = supabase_client
+        self.repositorio = repositorio or RepositorioSupabase(supabase_client)
+        self.verificador = verificador
+        # Autorización en caché por proceso: evita 2 consultas remotas por petición.
+        # Los cambios hechos aquí invalidan al instante; los de otro proceso, al expirar.
+        self._autorizacion = CacheTTL(ttl=ttl_roles)   # user_id -> {'rol', 'activo'}
+        self._pacientes = CacheTTL(ttl=ttl_pacientes)  # paciente_id -> {'user_id', 'nombre'}
+        self._estadisticas = CacheTTL(ttl=ttl_estadisticas)  # user_id -> conteos del dashboard
+        self._perfiles = CacheTTL(ttl=ttl_perfiles)  # user_id -> fila de user_profiles
     
     # ============================================================================
     # AUTENTICACIÓN
@@ -69,8 +95,9 @@ class AuthManager:
             })
             
             if response.user:
-                # Actualizar último acceso
-                self.supabase.rpc('update_user_last_access', {'user_id': response.user.id}).execute()
+                # Actualizar último acceso (aún no hay sesión de Flask: token del login)
+                with con_token(response.session.access_token if response.session else None):
+                    self.repositorio.registrar_acceso(response.user.id)
                 
                 print(f"✅ Login exitoso: {email}")
                 return response
@@ -83,9 +110,17 @@ class AuthManager:
             return None
     
     def logout(self):
-        """Cierra la sesión del usuario actual"""
+        """
+        Revoca en Supabase Auth la sesión de quien hace la petición, con su
+        propio access_token (el Client es compartido: su sesión en memoria
+        sería la del último usuario que inició sesión o refrescó)
+        """
+        self.obtener_usuario_actual()  # Refresca el token si expiró
+        token = session.get('access_token')
+        if not token or self.supabase is None:
+            return True
         try:
-            self.supabase.auth.sign_out()
+            self.supabase.auth.admin.sign_out(token, scope="local")
             print("✅ Sesión cerrada")
             return True
         except Exception as e:
@@ -94,17 +129,53 @@ class AuthManager:
     
     def obtener_usuario_actual(self):
         """
-        Obtiene el usuario actualmente autenticado
+        Obtiene el usuario actualmente autenticado. Verifica el access_token de
+        la sesión localmente (firma y expiración) y lo memoriza en la petición;
+        solo llama a Supabase Auth para refrescar un token expirado o si no se
+        puede verificar localmente.
         
         Returns:
-            dict: Datos del usuario o None
+            dict: Datos del usuario (id, email) o None
         """
+        if 'usuario_actual' not in g:
+            g.usuario_actual = self._usuario_de_sesion()
+        return g.usuario_actual
+    
+    def _usuario_de_sesion(self):
+        token = session.get('access_token')
+        if not token:
+            return None
+        if self.verificador:
+            try:
+                return usuario_desde_claims(self.verificador.verificar(token))
+            except TokenExpirado:
+                return self._refrescar_sesion()
+            except TokenInvalido as e:
+                print(f"⚠️  Token de sesión rechazado: {e}")
+                return None
+            except VerificacionNoDisponible:
+                pass  # Sin clave local: verificación remota
         try:
-            user = self.supabase.auth.get_user()
+            user = self.supabase.auth.get_user(token)  # Token de esta petición, no el último login
             return user.user if user else None
         except:
             return None
     
+    def _refrescar_sesion(self):
+        """Cambia el refresh_token de la sesión por un access_token nuevo"""
+        refresh_token = session.get('refresh_token')
+        if not refresh_token:
+            return None
+        try:
+            respuesta = self.supabase.auth.refresh_session(refresh_token)
+        except Exception as e:
+            print(f"⚠️  No se pudo refrescar la sesión: {e}")
+            return None
+        if not respuesta or not respuesta.user:
+            return None
+        self.guardar_sesion_flask(respuesta)
+        return respuesta.user
+    
     def obtener_perfil_usuario(self, user_id: str = None):
         """
         Obtiene el perfil completo del usuario desde user_profiles
@@ -122,15 +193,21 @@ class AuthManager:
                     return None
                 user_id = current_user.id
             
-            response = self.supabase.table('user_profiles').select('*').eq('id', user_id).single().execute()
-            return response.data
+            def cargar():
+                perfil = self.repositorio.obtener_perfil(user_id)
+                if perfil:
+                    # El perfil trae rol y activo: la comprobación de admin no consulta otra vez
+                    self._autorizacion.guardar(user_id, {'rol': perfil.get('rol'), 'activo': perfil.get('activo')})
+                return perfil
+            
+            return self._perfiles.obtener(user_id, cargar)
         except Exception as e:
             print(f"❌ Error obteniendo perfil: {e}")
             return None
     
     def es_administrador(self, user_id: str = None):
         """
-        Verifica si un usuario es administrador
+        Verifica si un usuario es administrador (activo). Usa la caché de roles.
         
         Args:
             user_id: ID del usuario (si es None, usa el usuario actual)
@@ -138,8 +215,93 @@ class AuthManager:
         Returns:
             bool: True si es administrador
         """
-        perfil = self.obtener_perfil_usuario(user_id)
-        return perfil and perfil.get('rol') == 'administrador'
+        if not user_id:
+            current_user = self.obtener_usuario_actual()
+            if not current_user:
+                return False
+            user_id = current_user.id
+        
+        datos = self._autorizacion.obtener(user_id, lambda: self._cargar_autorizacion(user_id))
+        return bool(datos) and datos['rol'] == 'administrador' and datos['activo'] is not False
+    
+    def _cargar_autorizacion(self, user_id: str):
+        try:
+            perfil = self.repositorio.obtener_perfil(user_id, 'rol, activo')
+            return {'rol': perfil.get('rol'), 'activo': perfil.get('activo')} if perfil else None
+        except Exception as e:
+            print(f"❌ Error obteniendo rol: {e}")
+            return None
+    
+    # ============================================================================
+    # AUTORIZACIÓN SOBRE PACIENTES (con caché)
+    # ============================================================================
+    
+    def obtener_paciente(self, paciente_id: str):
+        """
+        Dueño y nombre de un paciente (caché con TTL)
+        
+        Returns:
+            dict: {'user_id', 'nombre'} o None si no existe
+        """
+        if not paciente_id:
+            return None
+        
+        def cargar():
+            try:
+                return self.repositorio.obtener_paciente(paciente_id, 'user_id, nombre')
+            except Exception as e:
+                print(f"❌ Error obteniendo paciente {paciente_id}: {e}")
+                return None
+        
+        return self._pacientes.obtener(paciente_id, cargar)
+    
+    def puede_acceder_paciente(self, user_id: str, paciente_id: str):
+        """
+        Verifica que el usuario sea dueño del paciente o administrador
+        
+        Returns:
+            bool: True si tiene permiso (False también si el paciente no existe)
+        """
+        paciente = self.obtener_paciente(paciente_id)
+        if not paciente:
+            return False
+        return paciente['user_id'] == user_id or self.es_administrador(user_id)
+    
+    def registrar_paciente(self, paciente: dict):
+        """Guarda en caché el dueño de un paciente recién creado"""
+        self._pacientes.guardar(paciente['id'], {'user_id': paciente.get('user_id'), 'nombre': paciente.get('nombre')})
+        self._estadisticas.invalidar(paciente.get('user_id'))
+    
+    def diagnosticos_guardados(self, filas: list):
+        """
+        Invalida las estadísticas de los dueños de los pacientes con diagnósticos
+        nuevos (se registra con supabase_config.al_guardar_diagnosticos)
+        
+        Solo mira la caché de pacientes: corre en el replicador del spool, sin
+        token de usuario. Si el paciente no está en caché, las estadísticas de
+        su dueño se renuevan al expirar (ttl_estadisticas).
+        """
+        for paciente_id in {f.get('paciente_id') for f in filas}:
+            paciente = self._pacientes.obtener(paciente_id)
+            if paciente:
+                self._estadisticas.invalidar(paciente['user_id'])
+    
+    def invalidar_usuario(self, user_id: str):
+        """Olvida el rol/estado y el perfil en caché de un usuario"""
+        self._autorizacion.invalidar(user_id)
+        self._perfiles.invalidar(user_id)
+    
+    def metricas_cache(self):
+        """
+        Returns:
+            dict: Entradas, aciertos y fallos de las cachés de autorización
+        """
+        return {
+            'roles': self._autorizacion.metricas(),
+            'perfiles': self._perfiles.metricas(),
+            'pacientes': self._pacientes.metricas(),
+            'estadisticas': self._estadisticas.metricas()
+        }
     
     # ============================================================================
     # DECORADORES PARA RUTAS
@@ -184,8 +346,12 @@ class AuthManager:
             list: Lista de usuarios
         """
         try:
-            response = self.supabase.table('user_profiles').select('*').execute()
-            return response.data
+            usuarios, cursor = [], None
+            while True:
+                filas, cursor = self.repositorio.listar_perfiles(cursor)
+                usuarios.extend(filas)
+                if not cursor:
+                    return usuarios
         except Exception as e:
             print(f"❌ Error listando usuarios: {e}")
             return []
@@ -205,9 +371,8 @@ class AuthManager:
             return False
         
         try:
-            self.supabase.table('user_profiles').update({
-                'rol': nuevo_rol
-            }).eq('id', user_id).execute()
+            self.repositorio.actualizar_perfil(user_id, {'rol': nuevo_rol})
+            self.invalidar_usuario(user_id)
             
             print(f"✅ Rol cambiado: {user_id} → {nuevo_rol}")
             return True
@@ -226,9 +391,8 @@ class AuthManager:
             bool: True si se desactivó exitosamente
         """
         try:
-            self.supabase.table('user_profiles').update({
-                'activo': False
-            }).eq('id', user_id).execute()
+            self.repositorio.actualizar_perfil(user_id, {'activo': False})
+            self.invalidar_usuario(user_id)
             
             print(f"✅ Usuario desactivado: {user_id}")
             return True
@@ -266,7 +430,9 @@ class AuthManager:
     
     def obtener_estadisticas_usuario(self, user_id: str = None):
         """
-        Obtiene estadísticas del usuario
+        Obtiene estadísticas del usuario con una sola consulta agregada
+        (función SQL estadisticas_usuario), en caché hasta que se guarda un
+        diagnóstico o se crea un paciente suyo
         
         Args:
             user_id: ID del usuario (si es None, usa el usuario actual)
@@ -274,59 +440,62 @@ class AuthManager:
         Returns:
             dict: Estadísticas del usuario
         """
-        try:
-            if not user_id:
-                current_user = self.obtener_usuario_actual()
-                if not current_user:
-                    return None
-                user_id = current_user.id
-            
-            # Contar pacientes
-            pacientes = self.supabase.table('pacientes').select('id', count='exact').eq('user_id', user_id).execute()
-            
-            # Contar diagnósticos
-            diagnosticos = self.supabase.table('diagnosticos')\
-                .select('id', count='exact')\
-                .in_('paciente_id', 
-                     self.supabase.table('pacientes').select('id').eq('user_id', user_id).execute().data
-                ).execute()
-            
-            # Contar alertas críticas
-            alertas = self.supabase.table('diagnosticos')\
-                .select('id', count='exact')\
-                .eq('alerta_critica', True)\
-                .in_('paciente_id',
-                     self.supabase.table('pacientes').select('id').eq('user_id', user_id).execute().data
-                ).execute()
-            
-            return {
-                'total_pacientes': pacientes.count,
-                'total_diagnosticos': diagnosticos.count,
-                'alertas_criticas': alertas.count
-            }
-        except Exception as e:
-            print(f"❌ Error obteniendo estadísticas: {e}")
-            return {
-                'total_pacientes': 0,
-                'total_diagnosticos': 0,
-                'alertas_criticas': 0
-            }
+        vacias = {
+            'total_pacientes': 0,
+            'total_diagnosticos': 0,
+            'alertas_criticas': 0
+        }
+        if not user_id:
+            current_user = self.obtener_usuario_actual()
+            if not current_user:
+                return None
+            user_id = current_user.id
+        
+        def cargar():
+            try:
+                fila = self.repositorio.estadisticas_usuario(user_id)
+                return {clave: fila.get(clave) or 0 for clave in vacias}
+            except Exception as e:
+                print(f"❌ Error obteniendo estadísticas: {e}")
+                return None
+        
+        return self._estadisticas.obtener(user_id, cargar) or vacias
     
     # ============================================================================
     # HELPERS PARA SESSION
     # ============================================================================
     
-    def guardar_sesion_flask(self, user_data):
-        """Guarda datos del usuario en la sesión de Flask"""
+    def guardar_sesion_flask(self, respuesta):
+        """Guarda usuario y token de la respuesta de login en la sesión de Flask"""
+        user_data = respuesta.user
+        sesion = getattr(respuesta, 'session', None)
         session['user_id'] = user_data.id
         session['user_email'] = user_data.email
-        session['access_token'] = user_data.session.access_token if hasattr(user_data, 'session') else None
+        session['access_token'] = sesion.access_token if sesion else None
+        session['refresh_token'] = sesion.refresh_token if sesion else None
+        session['token_expira'] = sesion.expires_at if sesion else None
     
     def limpiar_sesion_flask(self):
         """Limpia la sesión de Flask"""
         session.pop('user_id', None)
         session.pop('user_email', None)
         session.pop('access_token', None)
+        session.pop('refresh_token', None)
+        session.pop('token_expira', None)
+    
+    def token_sesion(self, margen: float = 30.0):
+        """
+        Token del usuario para las consultas de esta petición (pool_supabase.fijar_token)
+        
+        Returns:
+            str: access_token vigente (refrescado si expira en menos de `margen`
+                segundos), o None sin login (las consultas fallan: no hay clave
+                anon de respaldo)
+        """
+        expira = session.get('token_expira')
+        if expira and expira - margen < time.time() and not self._refrescar_sesion():
+            return None
+        return session.get('access_token')
     
     def obtener_user_id_sesion(self):
         """Obtiene el user_id de la sesión de Flask"""
@@ -0,0 +1,408 @@
+# benchmark_pipeline.py - Benchmarks de latencia y throughput del pipeline de captura
+#
+# Etapas medidas (señal sintética de simulador_udp, sin hardware ni BD):
+#   parseo      Datagramas de texto del firmware → muestras (receiver_udp._decodificar)
+#   filtro      receiver_udp._filt_ecg sobre una ventana de un canal
+#   proceso     receiver_udp._process_packet (filtros + EASI→XYZ + remuestreo)
+#   hrv         HRVAnalyzer.analizar
+#   ia          HolterAnalyzer.diagnosticar con un modelo Keras mínimo (requiere TensorFlow)
+#   extremo     UDP localhost → receive_packets → HRV/IA → fila_diagnostico en la
+#               cola de persistencia (spool SQLite temporal) → paquete socket.io
+#               del payload real (forma_onda binaria como adjunto)
+#
+# Cada etapa reporta p50/p99 (ms), muestras/s y el pico de memoria asignada
+# durante una iteración de la etapa (tracemalloc: Python + buffers de numpy;
+# no incluye la memoria nativa de TensorFlow). La iteración con tracemalloc
+# se hace aparte para no inflar los tiempos.
+# Los resultados se guardan en JSON para comparar entre commits:
+#   python benchmark_pipeline.py --salida bench_base.json
+#   python benchmark_pipeline.py --comparar bench_base.json
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tracemalloc
+import tempfile
+import subprocess
+import numpy as np
+
+import receiver_udp
+import simulador_udp
+from hr_hrv_analyzer import HRVAnalyzer, interpretar_hrv
+
+
+# ============================================================================
+# UTILIDADES DE MEDICIÓN
+# ============================================================================
+
+def _pico_memoria_mb(funcion):
+    """
+    Pico de memoria asignada durante una llamada a funcion (MB)
+
+    Por etapa y no del proceso: ru_maxrss solo crece, así que tras la primera
+    etapa repetiría el pico de la más pesada ya ejecutada.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        funcion()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    finally:
+        tracemalloc.stop()
+
+
+def _resumen(medicion, muestras_por_iteracion):
+    """p50/p99 en ms y muestras/s a partir de (tiempos por iteración, pico de memoria)"""
+    tiempos, pico_mb = medicion
+    tiempos = np.asarray(tiempos)
+    return {
+        "iteraciones": len(tiempos),
+        "p50_ms": round(float(np.percentile(tiempos, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(tiempos, 99)) * 1000, 3),
+        "media_ms": round(float(np.mean(tiempos)) * 1000, 3),
+        "muestras_por_seg": round(muestras_por_iteracion / float(np.mean(tiempos)), 1),
+        "memoria_pico_mb": pico_mb
+    }
+
+
+def _medir(funcion, iteraciones, calentamiento=2):
+    """
+    Returns:
+        tuple: (tiempos por iteración en s, pico de memoria de una iteración en MB)
+    """
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos, _pico_memoria_mb(funcion)
+
+
+def _bytes_socketio(evento, payload):
+    """
+    Bytes que emite socket.io para un evento: el paquete de texto (JSON con
+    marcadores en lugar de los bytes) más cada adjunto binario
+    """
+    try:
+        from socketio import packet
+        codificado = packet.Packet(packet.EVENT, data=[evento, payload], namespace="/").encode()
+        partes = codificado if isinstance(codificado, list) else [codificado]
+        return sum(len(p.encode() if isinstance(p, str) else p) for p in partes)
+    except ImportError:
+        pass
+
+    adjuntos = []
+
+    def reemplazar(valor):
+        if isinstance(valor, (bytes, bytearray)):
+            adjuntos.append(valor)
+            return {"_placeholder": True, "num": len(adjuntos) - 1}
+        if isinstance(valor, dict):
+            return {k: reemplazar(v) for k, v in valor.items()}
+        if isinstance(valor, (list, tuple)):
+            return [reemplazar(v) for v in valor]
+        return valor
+
+    texto = json.dumps([evento, reemplazar(payload)], separators=(",", ":"))
+    return len(texto.encode()) + sum(len(a) for a in adjuntos)
+
+
+# ============================================================================
+# ETAPAS
+# ============================================================================
+
+def bench_parseo(muestras, iteraciones):
+    """Decodificación de datagramas hasta completar ventanas (sin DSP)"""
+    datagramas = simulador_udp.empaquetar(muestras)
+
+    def parsear():
+        return sum(len(receiver_udp._decodificar(data)) for data in datagramas)
+
+    return _resumen(_medir(parsear, iteraciones), len(muestras))
+
+
+def bench_filtro(ventana, iteraciones):
+    canal = ventana[:, 0].astype(float)
+    return _resumen(_medir(lambda: receiver_udp._filt_ecg(canal), iteraciones), len(canal))
+
+
+def bench_proceso(ventana, iteraciones):
+    v = ventana.astype(float)
+    return _resumen(
+        _medir(lambda: receiver_udp._process_packet(v[:, 0], v[:, 1], v[:, 2], v[:, 3]), iteraciones),
+        len(v)
+    )
+
+
+def bench_hrv(xyz, iteraciones):
+    analizador = HRVAnalyzer(frecuencia_muestreo=500)
+    sin_estado = _resumen(_medir(lambda: analizador.analizar(xyz), iteraciones), len(xyz))
+    con_estado = _resumen(_medir(lambda: analizador.analizar(xyz, paciente_id="bench"), iteraciones), len(xyz))
+    return {"umbral_ventana": sin_estado, "plantilla_paciente": con_estado}
+
+
+def crear_motor_stub():
+    """
+    HolterAnalyzer con un modelo Keras mínimo (misma entrada/salida que el real)
+
+    Returns:
+        HolterAnalyzer o None si TensorFlow no está instalado
+    """
+    try:
+        import tensorflow as tf
+        from holter_ai import HolterAnalyzer
+    except ImportError:
+        return None
+
+    modelo = tf.keras.Sequential([
+        tf.keras.Input(shape=(5000, 3)),
+        tf.keras.layers.Conv1D(8, 7, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling1D(),
+        tf.keras.layers.Dense(4, activation="sigmoid")
+    ])
+    motor = HolterAnalyzer.__new__(HolterAnalyzer)
+    motor.model = modelo
+    motor.classes = ['CD', 'MI', 'NORM', 'STTC']
+    return motor
+
+
+def bench_ia(motor, xyz, iteraciones):
+    if motor is None:
+        return {"omitido": "TensorFlow no disponible"}
+    return _resumen(_medir(lambda: motor.diagnosticar(xyz), iteraciones), len(xyz))
+
+
+def bench_extremo(segundos_senal, velocidad, motor):
+    """
+    Ruta completa con socket UDP real y persistencia local
+
+    Returns:
+        dict: Latencia por ventana (desde ventana completa hasta payload
+              serializado y diagnóstico encolado) y throughput global
+    """
+    # fila_diagnostico vive en supabase_config: sin BD configurada, base local
+    # temporal para que el import no pida credenciales de Supabase
+    directorio = tempfile.mkdtemp()
+    os.environ.setdefault("DR_CORAZON_BD", "sqlite:///" + os.path.join(directorio, "bench.db"))
+    from supabase_config import fila_diagnostico
+    from senales_compactas import forma_onda_binaria
+    from escritor_diagnosticos import EscritorDiagnosticos
+    from spool_local import SpoolLocal
+
+    # Puerto libre para no chocar con un servidor en ejecución
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    receiver_udp.UDP_IP, receiver_udp.UDP_PORT = "127.0.0.1", puerto
+
+    spool = SpoolLocal(os.path.join(directorio, "bench_spool.db"))
+    escritor = EscritorDiagnosticos(lambda filas, senales: spool.agregar_lote("diagnosticos", filas, senales))
+    escritor.iniciar()
+    analizador = HRVAnalyzer(frecuencia_muestreo=500)
+
+    muestras = simulador_udp.generar_easi(segundos_senal)
+    ventanas_esperadas = len(muestras) // receiver_udp.N_IN
+    reproductor = simulador_udp.ReproductorUDP([muestras], ("127.0.0.1", puerto), velocidad=velocidad)
+
+    # Socket abierto antes de empezar a enviar (receive_packets lo crearía tarde, al primer next())
+    sock = receiver_udp.create_socket()
+
+    def datagramas():
+        ultimo = time.monotonic()
+        while True:
+            try:
+                yield sock.recvfrom(4096)
+                ultimo = time.monotonic()
+            except BlockingIOError:
+                # Fin: el simulador terminó y no llega nada desde hace 1 s
+                if time.monotonic() - ultimo > 1.0 and sum(reproductor.enviados) > 0:
+                    return
+                time.sleep(0.0005)
+
+    tiempos = []
+    bytes_payload = 0
+    pico_mb = None
+    paquetes = receiver_udp.receive_packets(enable_plot=False, fuente=datagramas())
+    inicio_total = time.perf_counter()
+    reproductor.iniciar()
+
+    def procesar(datos, capturada):
+        """Lo mismo que NodoCaptura._procesar_ventana tras la ventana completa"""
+        nonlocal bytes_payload
+        t_ia = time.perf_counter()
+        resultado = motor.diagnosticar(datos) if motor else {"status": "OK", "diagnostico_texto": "-",
+                                                              "detalles": {}, "alerta_infarto": False}
+        tiempo_analisis = time.perf_counter() - t_ia
+        hrv = analizador.analizar(datos, usar_canal='mejor', paciente_id="bench")
+        escritor.encolar(fila_diagnostico(
+            paciente_id="bench",
+            diagnostico=resultado["diagnostico_texto"],
+            probabilidades=resultado["detalles"],
+            tiempo_analisis=tiempo_analisis,
+            alerta_critica=resultado.get("alerta_infarto", False),
+            hr_bpm=hrv["hr_bpm"],
+            hrv_sdnn=hrv["hrv_sdnn"],
+            hrv_rmssd=hrv["hrv_rmssd"],
+            hrv_pnn50=hrv["hrv_pnn50"],
+            num_picos_r=hrv["num_picos"],
+            timestamp=capturada
+        ))
+        payload = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "paciente_id": "bench",
+            "dispositivo": "bench",
+            "diagnostico": resultado["diagnostico_texto"],
+            "probabilidades": resultado["detalles"],
+            "tiempo_analisis": round(tiempo_analisis, 3),
+            "alerta": resultado.get("alerta_infarto", False),
+            "hr_bpm": hrv["hr_bpm"],
+            "hr_clasificacion": hrv["clasificacion_hr"],
+            "hrv_sdnn": hrv["hrv_sdnn"],
+            "hrv_rmssd": hrv["hrv_rmssd"],
+            "hrv_pnn50": hrv["hrv_pnn50"],
+            "num_picos": hrv["num_picos"],
+            "calidad_señal": hrv["calidad"],
+            "interpretacion_hrv": interpretar_hrv(hrv["hrv_sdnn"], hrv["hrv_rmssd"], hrv["hrv_pnn50"]),
+            "picos_indices": hrv["picos_indices"].tolist(),
+            "forma_onda": forma_onda_binaria(datos, 500)
+        }
+        bytes_payload = _bytes_socketio("diagnostico", payload)
+
+    datos = None
+    for datos in paquetes:
+        capturada = time.time()
+        t0 = time.perf_counter()
+        procesar(datos, capturada)
+        tiempos.append(time.perf_counter() - t0)
+
+        if len(tiempos) >= ventanas_esperadas:
+            break
+
+    duracion = time.perf_counter() - inicio_total
+    # Pico de memoria repitiendo la última ventana con tracemalloc, fuera de
+    # los tiempos (encola una fila más en el spool)
+    if datos is not None:
+        pico_mb = _pico_memoria_mb(lambda: procesar(datos, time.time()))
+    reproductor.detener()
+    sock.close()
+    escritor.detener()
+
+    resumen = _resumen((tiempos, pico_mb), receiver_udp.N_IN)
+    resumen.update({
+        "ventanas": len(tiempos),
+        "muestras_por_seg_global": round(len(tiempos) * receiver_udp.N_IN / duracion, 1),
+        "velocidad_envio": velocidad,
+        "bytes_payload_socketio": bytes_payload,
+        "filas_en_spool": spool.pendientes(),
+        "ia": "stub keras" if motor else "omitida (sin TensorFlow)"
+    })
+    return resumen
+
+
+# ============================================================================
+# COMPARACIÓN ENTRE COMMITS
+# ============================================================================
+
+def _aplanar(datos, prefijo=""):
+    plano = {}
+    for clave, valor in datos.items():
+        if isinstance(valor, dict):
+            plano.update(_aplanar(valor, f"{prefijo}{clave}."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            plano[f"{prefijo}{clave}"] = valor
+    return plano
+
+
+def comparar(actual, base, umbral=0.10):
+    """Imprime las diferencias de p50/p99 respecto a una ejecución anterior"""
+    a = _aplanar(actual["etapas"])
+    b = _aplanar(base["etapas"])
+    print(f"\n📊 Comparación con {base.get('commit', '?')} (umbral {umbral:.0%})")
+    regresiones = 0
+    for clave in sorted(a):
+        if not (clave.endswith("p50_ms") or clave.endswith("p99_ms")) or clave not in b or not b[clave]:
+            continue
+        cambio = (a[clave] - b[clave]) / b[clave]
+        marca = "⚠️ " if cambio > umbral else ("✅" if cambio < -umbral else "  ")
+        regresiones += cambio > umbral
+        print(f"  {marca} {clave:45s} {b[clave]:9.3f} → {a[clave]:9.3f} ms ({cambio:+.1%})")
+    return regresiones
+
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del pipeline de captura Dr Corazón")
+    parser.add_argument("--iteraciones", type=int, default=50, help="Iteraciones por etapa")
+    parser.add_argument("--segundos", type=float, default=60.0, help="Segundos de señal en la prueba extremo a extremo")
+    parser.add_argument("--velocidad", type=float, default=20.0, help="Velocidad del simulador en extremo a extremo")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (default bench_<commit>.json)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para comparar")
+    parser.add_argument("--sin-extremo", action="store_true", help="Omitir la prueba con socket UDP")
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print("⏱️  Dr Corazón - Benchmarks del pipeline")
+    print("=" * 60)
+
+    muestras = simulador_udp.generar_easi(receiver_udp.WINDOW_SEC + 1)
+    ventana = muestras[:receiver_udp.N_IN]
+    v = ventana.astype(float)
+    X, Y, Z = receiver_udp._process_packet(v[:, 0], v[:, 1], v[:, 2], v[:, 3])
+    xyz = np.column_stack([X, Y, Z]).astype(np.float32)
+    motor = crear_motor_stub()
+
+    etapas = {}
+    for nombre, funcion in [
+        ("parseo", lambda: bench_parseo(ventana, args.iteraciones)),
+        ("filtro", lambda: bench_filtro(ventana, args.iteraciones)),
+        ("proceso", lambda: bench_proceso(ventana, args.iteraciones)),
+        ("hrv", lambda: bench_hrv(xyz, args.iteraciones)),
+        ("ia", lambda: bench_ia(motor, xyz, args.iteraciones)),
+    ]:
+        etapas[nombre] = funcion()
+        print(f"  {nombre:8s} {json.dumps(etapas[nombre])}")
+
+    if not args.sin_extremo:
+        etapas["extremo"] = bench_extremo(args.segundos, args.velocidad, motor)
+        print(f"  {'extremo':8s} {json.dumps(etapas['extremo'])}")
+
+    resultado = {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "iteraciones": args.iteraciones,
+        "etapas": etapas
+    }
+
+    ruta = args.salida or f"bench_{resultado['commit'] or 'local'}.json"
+    with open(ruta, "w") as f:
+        json.dump(resultado, f, indent=2)
+    print(f"\n💾 Resultados guardados en {ruta}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            regresiones = comparar(resultado, json.load(f))
+        if regresiones:
+            print(f"\n⚠️  {regresiones} métricas empeoraron más del umbral")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bus_eventos.py - Publicación de eventos del nodo de captura hacia los clientes
+#
+# El nodo de captura/inferencia no conoce a los clientes: publica cada
+# diagnóstico, alerta y bloque de onda en vivo con bus.emitir(evento, datos, sala).
+#   - BusLocal:      mismo proceso que el servidor web (socketio.emit directo)
+#   - BusColaSocketIO: cola de mensajes de socket.io (Redis, Kafka/AMQP vía
+#                    kombu, ZeroMQ). Cada worker web arrancado con
+#                    SocketIO(message_queue=url) reparte a sus propios clientes.
+#   - BusMemoria:    sustituto local para pruebas (guarda lo publicado)
+#
+# Uso:
+#   bus = crear_bus(os.environ.get('DR_CORAZON_COLA'), socketio=socketio)
+#   bus.emitir('diagnostico', payload, sala='paciente_42')
+
+import threading
+from collections import deque
+
+
+class BusLocal:
+    """
+    Emite directamente por el servidor socket.io del proceso
+    """
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+
+    def emitir(self, evento, datos, sala=None):
+        self.socketio.emit(evento, datos, room=sala)
+
+
+class BusColaSocketIO:
+    """
+    Publica en la cola de mensajes de socket.io sin servidor web propio
+    (gestor write_only): lo reciben todos los workers web conectados a la cola
+    """
+
+    def __init__(self, url, canal="flask-socketio"):
+        """
+        Args:
+            url: redis://..., zmq+tcp://host:puerto+puerto, amqp://... u otra URL de kombu
+            canal: Canal de la cola (el mismo que usan los workers web)
+        """
+        import socketio  # python-socketio, ya es dependencia de flask-socketio
+
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            gestor = socketio.RedisManager
+        elif url.startswith("zmq"):
+            gestor = socketio.ZmqManager
+        elif url.startswith("kafka://"):
+            gestor = socketio.KafkaManager
+        else:
+            gestor = socketio.KombuManager
+        self.url = url
+        self._gestor = gestor(url, channel=canal, write_only=True)
+
+    def emitir(self, evento, datos, sala=None):
+        self._gestor.emit(evento, datos, namespace="/", room=sala)
+
+
+class BusMemoria:
+    """
+    Sustituto en memoria para pruebas y scripts: guarda los eventos publicados
+    """
+
+    def __init__(self, maximo=10000):
+        self._lock = threading.Lock()
+        self.eventos = deque(maxlen=maximo)  # (evento, datos, sala)
+
+    def emitir(self, evento, datos, sala=None):
+        with self._lock:
+            self.eventos.append((evento, datos, sala))
+
+    def tomar(self, evento=None):
+        """
+        Returns:
+            list: Eventos publicados (todos o solo los de un tipo) y vacía el bus
+        """
+        with self._lock:
+            eventos = list(self.eventos)
+            self.eventos.clear()
+        return [e for e in eventos if evento is None or e[0] == evento]
+
+
+def crear_bus(url=None, socketio=None):
+    """
+    Args:
+        url: URL de la cola de mensajes; None para emitir en el proceso
+        socketio: Servidor SocketIO del proceso (sin url); sin él, BusMemoria
+    """
+    if url:
+        return BusColaSocketIO(url)
+    if socketio is not None:
+        return BusLocal(socketio)
+    return BusMemoria()
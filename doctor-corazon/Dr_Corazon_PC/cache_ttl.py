@@ -0,0 +1,126 @@
+# cache_ttl.py - Caché en memoria con expiración por entrada
+#
+# Para datos que cambian poco y se consultan en cada petición (rol de un
+# usuario, dueño de un paciente): un acierto es una búsqueda en un dict,
+# en lugar de una ida y vuelta a Supabase. Quien modifica el dato invalida
+# la entrada; la expiración acota lo que puede quedar desactualizado si el
+# cambio se hizo desde otro proceso.
+#
+# Uso:
+#   roles = CacheTTL(ttl=30)
+#   rol = roles.obtener(user_id, lambda: consultar_rol(user_id))
+#   roles.invalidar(user_id)
+
+import time
+import threading
+from collections import OrderedDict
+
+_FALTA = object()
+
+
+class CacheTTL:
+    """
+    Diccionario acotado (LRU) cuyas entradas expiran a los `ttl` segundos
+    """
+
+    def __init__(self, ttl=60.0, max_entradas=10000):
+        """
+        Args:
+            ttl: Segundos de vida de cada entrada
+            max_entradas: Al superarlas se descartan las menos usadas
+        """
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._datos = OrderedDict()  # clave -> (expira, valor)
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, cargar=None):
+        """
+        Devuelve el valor vigente o lo carga con `cargar()` y lo guarda.
+        La carga se hace sin el lock (puede ser una consulta remota);
+        los valores None no se guardan.
+
+        Returns:
+            Valor en caché, el cargado, o None si no hay y no se pasó `cargar`
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave, _FALTA)
+            if entrada is not _FALTA and entrada[0] > ahora:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+
+        if cargar is None:
+            return None
+        valor = cargar()
+        if valor is not None:
+            self.guardar(clave, valor)
+        return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Entradas, aciertos y fallos
+        """
+        with self._lock:
+            return {'entradas': len(self._datos), 'aciertos': self.aciertos, 'fallos': self.fallos}
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    print("⏱️  Caché con TTL")
+    print("=" * 50)
+
+    cargas = []
+
+    def cargar():
+        cargas.append(1)
+        return 'administrador'
+
+    cache = CacheTTL(ttl=0.2, max_entradas=2)
+    assert cache.obtener('u1', cargar) == 'administrador'
+    assert cache.obtener('u1', cargar) == 'administrador'
+    assert len(cargas) == 1
+
+    cache.invalidar('u1')
+    cache.obtener('u1', cargar)
+    assert len(cargas) == 2
+
+    time.sleep(0.25)
+    cache.obtener('u1', cargar)
+    assert len(cargas) == 3
+
+    cache.guardar('u2', 1)
+    cache.guardar('u3', 1)
+    assert cache.obtener('u1') is None  # Desalojada (LRU)
+    assert cache.obtener('u2') == 1
+
+    inicio = time.perf_counter()
+    for _ in range(100000):
+        cache.obtener('u2')
+    print(f"  Acierto: {(time.perf_counter() - inicio) * 10:.2f} µs")
+    print(f"  {cache.metricas()}")
+
+    print("\n✅ Módulo funcionando correctamente!")
@@ -0,0 +1,176 @@
+# concurrencia.py - Modelo de ejecución del servidor (eventlet o hilos)
+#
+# Con eventlet (modo por defecto del servidor) todas las peticiones, websockets
+# y tareas de fondo son green threads en un único hilo del SO: la E/S de red
+# (socket parcheado, incluido el cliente HTTP de Supabase) cede el control
+# en lugar de bloquear. Lo que NO cede es el trabajo de CPU (filtros, TF,
+# HRV) ni las llamadas C bloqueantes (fsync de SQLite); esas se ejecutan
+# con ejecutar_bloqueante() en el pool de hilos reales de eventlet (tpool)
+# para que el bucle de eventos siga atendiendo clientes.
+#
+# Sin eventlet (modo 'threading', scripts, reanalisis.py, benchmarks)
+# ejecutar_bloqueante() llama directamente a la función.
+#
+# El estado que tocan a la vez green threads y funciones en tpool se protege
+# con crear_lock(): tras monkey_patch threading.Lock es un lock verde, y un
+# hilo real de tpool que lo encuentra ocupado intenta ceder a un hub que no
+# es el suyo y cuelga el bucle de eventos.
+#
+# Uso (primera línea ejecutable del servidor, antes de importar nada más):
+#   import concurrencia
+#   MODO_ASYNC = concurrencia.preparar(os.environ.get('DR_CORAZON_ASYNC', 'eventlet'))
+
+_tpool = None
+
+
+def preparar(modo='eventlet'):
+    """
+    Activa el modo de ejecución. Debe llamarse antes de importar Flask,
+    socket, threading, supabase, etc.
+
+    Args:
+        modo: 'eventlet' o 'threading'
+
+    Returns:
+        str: Modo efectivo para SocketIO(async_mode=...) ('threading' si eventlet no está instalado)
+    """
+    global _tpool
+    if modo != 'eventlet':
+        return 'threading'
+    try:
+        import eventlet
+        from eventlet import tpool
+    except ImportError:
+        print("⚠️  eventlet no instalado: servidor en modo 'threading'")
+        return 'threading'
+
+    eventlet.monkey_patch()
+    _tpool = tpool
+    return 'eventlet'
+
+
+def eventlet_activo():
+    """True si eventlet.monkey_patch() convirtió los hilos en green threads"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+def crear_lock():
+    """
+    Lock para estado compartido entre green threads y hilos de tpool
+
+    Con eventlet es el Lock original del SO (un greenlet que espera detiene
+    el bucle mientras espera: solo para secciones críticas cortas, o acceder
+    siempre desde tpool); sin eventlet, threading.Lock.
+    """
+    import threading
+    if eventlet_activo():
+        from eventlet import patcher
+        return patcher.original('threading').Lock()
+    return threading.Lock()
+
+
+def ejecutar_bloqueante(funcion, *args, **kwargs):
+    """
+    Ejecuta trabajo de CPU o bloqueante fuera del bucle de eventos
+
+    Con eventlet la green thread que llama espera sin bloquear al resto;
+    sin eventlet es una llamada normal.
+    """
+    if _tpool is None:
+        return funcion(*args, **kwargs)
+    return _tpool.execute(funcion, *args, **kwargs)
+
+
+# ============================================================================
+# PRUEBA DE CARGA DEL BUCLE DE EVENTOS
+# ============================================================================
+
+if __name__ == "__main__":
+    # Ventanas de captura en tpool (HRV con estado por paciente, métricas y
+    # spool SQLite) mientras N green threads leen las métricas del spool y del
+    # proceso como /api/control/estado. Mide el retraso del bucle de eventos
+    # (un latido cada 5 ms) y detecta el cuelgue de un lock verde en tpool.
+    #   python concurrencia.py --clientes 200 --dispositivos 4 --segundos 10
+    import os
+    import sys
+    import time
+    import argparse
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Prueba de carga del bucle de eventos (eventlet + tpool)")
+    parser.add_argument("--clientes", type=int, default=200, help="Green threads que leen métricas")
+    parser.add_argument("--dispositivos", type=int, default=4, help="Ventanas de captura en paralelo")
+    parser.add_argument("--segundos", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if preparar('eventlet') != 'eventlet':
+        sys.exit(1)
+    import eventlet
+    import receiver_udp
+    import simulador_udp
+    from metricas import metricas
+    from hr_hrv_analyzer import HRVAnalyzer
+    from spool_local import SpoolLocal, ReplicadorSpool
+
+    print("🧵 Prueba de carga del bucle de eventos")
+    print("=" * 50)
+
+    v = simulador_udp.generar_easi(receiver_udp.WINDOW_SEC + 1)[:receiver_udp.N_IN].astype(float)
+    X, Y, Z = receiver_udp._process_packet(v[:, 0], v[:, 1], v[:, 2], v[:, 3])
+    xyz = np.column_stack([X, Y, Z]).astype(np.float32)
+
+    spool = SpoolLocal(os.path.join(tempfile.mkdtemp(), "carga.db"))
+    replicador = ReplicadorSpool(spool, lambda tabla, filas: filas)
+    analizador = HRVAnalyzer(frecuencia_muestreo=500)
+    fin = time.monotonic() + args.segundos
+    cuentas = {'ventanas': 0, 'lecturas': 0}
+    retrasos = []
+
+    def ventana(paciente_id):
+        with metricas.temporizador('hrv'):
+            hrv = analizador.analizar(xyz, paciente_id=paciente_id)
+        metricas.contador('ventanas')
+        spool.agregar_lote("diagnosticos", [{'paciente_id': paciente_id, 'hr_bpm': hrv['hr_bpm']}])
+
+    def captura(i):
+        while time.monotonic() < fin:
+            ejecutar_bloqueante(ventana, f"paciente-{i}")
+            cuentas['ventanas'] += 1
+
+    def cliente():
+        while time.monotonic() < fin:
+            replicador.metricas()
+            metricas.instantanea()
+            cuentas['lecturas'] += 1
+            eventlet.sleep(0.05)
+
+    def latido():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            eventlet.sleep(0.005)
+            retrasos.append(time.perf_counter() - inicio - 0.005)
+
+    hilos = [eventlet.spawn(latido)]
+    hilos += [eventlet.spawn(captura, i) for i in range(args.dispositivos)]
+    hilos += [eventlet.spawn(cliente) for _ in range(args.clientes)]
+    terminado = False
+    with eventlet.Timeout(args.segundos + 10, False):
+        for hilo in hilos:
+            hilo.wait()
+        terminado = True
+
+    retrasos_ms = np.array(retrasos) * 1000
+    print(f"   Ventanas: {cuentas['ventanas']} ({cuentas['ventanas'] / args.segundos:.1f}/s) | "
+          f"lecturas de métricas: {cuentas['lecturas']}")
+    print(f"   Retraso del bucle: p50 {np.percentile(retrasos_ms, 50):.2f} ms | "
+          f"p99 {np.percentile(retrasos_ms, 99):.2f} ms | máx {retrasos_ms.max():.1f} ms")
+    if not terminado:
+        print("❌ El bucle de eventos se colgó")
+        os._exit(1)
+    print("\n✅ Bucle de eventos sin cuelgues")
+    os._exit(0)
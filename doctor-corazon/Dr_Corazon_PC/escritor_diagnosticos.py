@@ -0,0 +1,167 @@
+# escritor_diagnosticos.py - Persistencia write-behind de diagnósticos
+#
+# El hilo de captura encola diagnósticos en memoria y retorna al instante.
+# Un hilo escritor los agrupa en lotes y los inserta con una sola petición
+# (insert([...])), con reintentos y backoff exponencial si la BD falla.
+
+import time
+import threading
+from collections import deque
+
+
+class EscritorDiagnosticos:
+    """
+    Cola en memoria + hilo escritor que vacía diagnósticos por lotes
+    """
+
+    def __init__(self, funcion_lote, tam_lote=50, intervalo_flush=1.0,
+                 max_cola=10000, max_reintentos=5, backoff_base=0.5, backoff_max=30.0):
+        """
+        Args:
+            funcion_lote: Callable(filas, senales) que persiste un lote y lanza excepción
+                si falla; senales es una lista paralela (fila de senales_ecg o None)
+                (ej. SpoolLocal.agregar_lote con tabla "diagnosticos")
+            tam_lote: Máximo de filas por inserción
+            intervalo_flush: Segundos máximos que una fila espera en cola
+            max_cola: Capacidad de la cola; al llenarse se descartan las filas más antiguas
+            max_reintentos: Reintentos por lote antes de descartarlo
+            backoff_base: Espera inicial entre reintentos (se duplica en cada intento)
+            backoff_max: Espera máxima entre reintentos
+        """
+        self.funcion_lote = funcion_lote
+        self.tam_lote = tam_lote
+        self.intervalo_flush = intervalo_flush
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cola = deque(maxlen=max_cola)
+        self._cond = threading.Condition()
+        self._activo = False
+        self._hilo = None
+
+        # Métricas
+        self._encolados = 0
+        self._guardados = 0
+        self._descartados = 0
+        self._lotes_ok = 0
+        self._lotes_fallidos = 0
+        self._reintentos = 0
+        self._latencia_ultimo_flush = None
+        self._latencia_max_flush = 0.0
+
+    # ============================================================================
+    # CICLO DE VIDA
+    # ============================================================================
+
+    def iniciar(self):
+        """Arranca el hilo escritor (daemon)"""
+        with self._cond:
+            if self._activo:
+                return
+            self._activo = True
+        self._hilo = threading.Thread(target=self._ciclo, name="escritor_diagnosticos", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10.0):
+        """Detiene el hilo escritor tras vaciar la cola"""
+        with self._cond:
+            self._activo = False
+            self._cond.notify_all()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    # ============================================================================
+    # API DEL PRODUCTOR (hilo de captura)
+    # ============================================================================
+
+    def encolar(self, fila: dict, senal: dict = None):
+        """
+        Encola una fila de diagnóstico. Nunca bloquea por la BD.
+
+        Args:
+            fila: Dict construido con supabase_config.fila_diagnostico()
+            senal: Fila opcional de senales_ecg (supabase_config.fila_senales_ecg)
+        """
+        with self._cond:
+            if len(self._cola) == self._cola.maxlen:
+                self._descartados += 1
+            self._cola.append((fila, senal))
+            self._encolados += 1
+            if len(self._cola) >= self.tam_lote:
+                self._cond.notify()
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Profundidad de cola, contadores y latencias de flush (s)
+        """
+        with self._cond:
+            return {
+                'profundidad_cola': len(self._cola),
+                'encolados': self._encolados,
+                'guardados': self._guardados,
+                'descartados': self._descartados,
+                'lotes_ok': self._lotes_ok,
+                'lotes_fallidos': self._lotes_fallidos,
+                'reintentos': self._reintentos,
+                'latencia_ultimo_flush': self._latencia_ultimo_flush,
+                'latencia_max_flush': self._latencia_max_flush
+            }
+
+    # ============================================================================
+    # HILO ESCRITOR
+    # ============================================================================
+
+    def _tomar_lote(self):
+        """Espera hasta tener un lote completo o vencer el intervalo de flush"""
+        with self._cond:
+            limite = time.monotonic() + self.intervalo_flush
+            while self._activo and len(self._cola) < self.tam_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+
+            n = min(self.tam_lote, len(self._cola))
+            return [self._cola.popleft() for _ in range(n)]
+
+    def _escribir_lote(self, lote):
+        """Inserta un lote con reintentos y backoff exponencial"""
+        espera = self.backoff_base
+        for intento in range(self.max_reintentos + 1):
+            inicio = time.monotonic()
+            try:
+                self.funcion_lote([f for f, _ in lote], [s for _, s in lote])
+                latencia = time.monotonic() - inicio
+                with self._cond:
+                    self._guardados += len(lote)
+                    self._lotes_ok += 1
+                    self._latencia_ultimo_flush = round(latencia, 4)
+                    self._latencia_max_flush = max(self._latencia_max_flush, latencia)
+                return True
+            except Exception as e:
+                if intento == self.max_reintentos:
+                    print(f"❌ Lote de {len(lote)} diagnósticos descartado tras {intento} reintentos: {e}")
+                    break
+                print(f"⚠️  Error guardando lote ({len(lote)} diagnósticos), reintento en {espera:.1f}s: {e}")
+                with self._cond:
+                    self._reintentos += 1
+                time.sleep(espera)
+                espera = min(espera * 2, self.backoff_max)
+
+        with self._cond:
+            self._lotes_fallidos += 1
+            self._descartados += len(lote)
+        return False
+
+    def _ciclo(self):
+        """Bucle del hilo escritor"""
+        while True:
+            lote = self._tomar_lote()
+            if lote:
+                self._escribir_lote(lote)
+                continue
+            with self._cond:
+                if not self._activo and not self._cola:
+                    return
@@ -0,0 +1,258 @@
+# estado_compartido.py - Estado del sistema compartido entre procesos
+#
+# Lo que antes era el dict estado_sistema del servidor: modo de captura,
+# paciente que mira cada usuario, último diagnóstico por paciente y
+# suscripciones al monitor en vivo. Con varios workers web y un nodo de
+# captura separado todos leen y escriben el mismo estado:
+#   - EstadoMemoria: dicts en el proceso (un único proceso, por defecto)
+#   - EstadoRedis:   hashes en Redis (o compatible: Valkey, KeyDB, Dragonfly)
+#
+# Uso:
+#   estado = crear_estado(url_estado(os.environ.get('DR_CORAZON_COLA')))
+#   estado.fijar(modo_captura='pausado')
+#   anterior = estado.fijar_paciente_activo(user_id, paciente_id)
+
+import os
+import json
+import base64
+import threading
+
+PREFIJO = "drcorazon:"
+
+ESTADO_INICIAL = {
+    'conectado': False,
+    'capturando': False,
+    'modo_captura': 'auto',  # 'auto', 'manual', 'pausado'
+}
+
+
+# ============================================================================
+# CODIFICACIÓN (payloads con adjuntos binarios)
+# ============================================================================
+
+def _bytes_a_json(valor):
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return {'__b64__': base64.b64encode(bytes(valor)).decode('ascii')}
+    raise TypeError(f"{type(valor).__name__} no es serializable")
+
+
+def _json_a_bytes(obj):
+    if len(obj) == 1 and '__b64__' in obj:
+        return base64.b64decode(obj['__b64__'])
+    return obj
+
+
+def codificar(valor):
+    """JSON que conserva los campos bytes (ej. forma_onda['datos'])"""
+    return json.dumps(valor, default=_bytes_a_json, ensure_ascii=False)
+
+
+def decodificar(texto):
+    """Inversa de codificar(); None si no hay texto"""
+    if texto is None:
+        return None
+    return json.loads(texto, object_hook=_json_a_bytes)
+
+
+# ============================================================================
+# EN MEMORIA (un solo proceso)
+# ============================================================================
+
+class EstadoMemoria:
+    """
+    Estado del sistema dentro del proceso
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._campos = dict(ESTADO_INICIAL)
+        self._paciente_activo = {}     # user_id -> paciente_id
+        self._ultimo_diagnostico = {}  # paciente_id -> payload
+        self._onda_viva = {}           # sid -> (clave, hz)
+
+    def obtener(self, campo, defecto=None):
+        return self._campos.get(campo, defecto)
+
+    def fijar(self, **campos):
+        with self._lock:
+            self._campos.update(campos)
+
+    def instantanea(self):
+        """
+        Returns:
+            dict: Campos simples del estado (conectado, capturando, modo_captura, ...)
+        """
+        with self._lock:
+            return dict(self._campos)
+
+    def paciente_activo(self, user_id):
+        return self._paciente_activo.get(user_id)
+
+    def fijar_paciente_activo(self, user_id, paciente_id):
+        """
+        Returns:
+            str: Paciente que miraba antes el usuario (o None)
+        """
+        with self._lock:
+            anterior = self._paciente_activo.get(user_id)
+            self._paciente_activo[user_id] = paciente_id
+        return anterior
+
+    def usuarios_activos(self):
+        return len(self._paciente_activo)
+
+    def ultimo_diagnostico(self, paciente_id):
+        return self._ultimo_diagnostico.get(paciente_id)
+
+    def guardar_ultimo_diagnostico(self, paciente_id, payload):
+        self._ultimo_diagnostico[paciente_id] = payload
+
+    def suscribir_onda(self, sid, clave, hz):
+        with self._lock:
+            self._onda_viva[sid] = (clave, hz)
+
+    def desuscribir_onda(self, sid):
+        """
+        Returns:
+            tuple: (clave, hz) que tenía el cliente (None si no estaba suscrito)
+        """
+        with self._lock:
+            return self._onda_viva.pop(sid, None)
+
+    def tasas_onda(self):
+        """
+        Returns:
+            dict: {clave: set(hz)} pedidas por los clientes del monitor en vivo
+        """
+        with self._lock:
+            tasas = {}
+            for clave, hz in self._onda_viva.values():
+                tasas.setdefault(clave, set()).add(hz)
+        return tasas
+
+
+# ============================================================================
+# REDIS (varios workers web + nodo de captura)
+# ============================================================================
+
+class EstadoRedis:
+    """
+    Estado del sistema en hashes de Redis, compartido por todos los procesos
+    """
+
+    def __init__(self, url, prefijo=PREFIJO):
+        """
+        Args:
+            url: redis://host:puerto/db
+            prefijo: Prefijo de las claves (varias instalaciones en un mismo Redis)
+        """
+        import redis  # Opcional: solo para despliegues con varios procesos
+
+        self._r = redis.Redis.from_url(url, decode_responses=True)
+        self._k_campos = prefijo + "estado"
+        self._k_paciente_activo = prefijo + "paciente_activo"
+        self._k_ultimo = prefijo + "ultimo_diagnostico"
+        self._k_onda = prefijo + "onda_viva"
+        # Valores iniciales sin pisar los que ya fijó otro proceso
+        for campo, valor in ESTADO_INICIAL.items():
+            self._r.hsetnx(self._k_campos, campo, json.dumps(valor))
+
+    def obtener(self, campo, defecto=None):
+        valor = self._r.hget(self._k_campos, campo)
+        return defecto if valor is None else json.loads(valor)
+
+    def fijar(self, **campos):
+        self._r.hset(self._k_campos, mapping={c: json.dumps(v) for c, v in campos.items()})
+
+    def instantanea(self):
+        return {c: json.loads(v) for c, v in self._r.hgetall(self._k_campos).items()}
+
+    def paciente_activo(self, user_id):
+        return self._r.hget(self._k_paciente_activo, user_id)
+
+    def fijar_paciente_activo(self, user_id, paciente_id):
+        pipe = self._r.pipeline()  # MULTI/EXEC: lectura y escritura atómicas
+        pipe.hget(self._k_paciente_activo, user_id)
+        pipe.hset(self._k_paciente_activo, user_id, paciente_id)
+        anterior, _ = pipe.execute()
+        return anterior
+
+    def usuarios_activos(self):
+        return self._r.hlen(self._k_paciente_activo)
+
+    def ultimo_diagnostico(self, paciente_id):
+        if paciente_id is None:
+            return None
+        return decodificar(self._r.hget(self._k_ultimo, paciente_id))
+
+    def guardar_ultimo_diagnostico(self, paciente_id, payload):
+        self._r.hset(self._k_ultimo, paciente_id, codificar(payload))
+
+    def suscribir_onda(self, sid, clave, hz):
+        self._r.hset(self._k_onda, sid, json.dumps([clave, hz]))
+
+    def desuscribir_onda(self, sid):
+        pipe = self._r.pipeline()
+        pipe.hget(self._k_onda, sid)
+        pipe.hdel(self._k_onda, sid)
+        anterior, _ = pipe.execute()
+        return tuple(json.loads(anterior)) if anterior else None
+
+    def tasas_onda(self):
+        tasas = {}
+        for valor in self._r.hvals(self._k_onda):
+            clave, hz = json.loads(valor)
+            tasas.setdefault(clave, set()).add(hz)
+        return tasas
+
+
+def url_estado(url_cola=None):
+    """
+    URL del estado compartido: DR_CORAZON_ESTADO o, si no está, la cola de
+    mensajes cuando es Redis (un único Redis para ambos). None = en memoria.
+    """
+    url = os.environ.get('DR_CORAZON_ESTADO')
+    if url:
+        return url
+    if url_cola and url_cola.startswith(("redis://", "rediss://", "unix://")):
+        return url_cola
+    return None
+
+
+def crear_estado(url=None):
+    """
+    Args:
+        url: URL de Redis; None para el estado en memoria (un solo proceso)
+    """
+    if not url:
+        return EstadoMemoria()
+    return EstadoRedis(url)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    print("🗂️  Estado compartido")
+    print("=" * 50)
+
+    payload = {'diagnostico': 'Normal', 'forma_onda': {'datos': b'\x00\x01\xff', 'puntos': 1}}
+    assert decodificar(codificar(payload)) == payload
+
+    estado = crear_estado()
+    assert estado.obtener('modo_captura') == 'auto'
+    estado.fijar(modo_captura='pausado', capturando=False)
+    assert estado.instantanea()['modo_captura'] == 'pausado'
+
+    assert estado.fijar_paciente_activo('u1', 'p1') is None
+    assert estado.fijar_paciente_activo('u1', 'p2') == 'p1'
+    assert estado.usuarios_activos() == 1
+
+    estado.suscribir_onda('sid1', 'p2', 25)
+    estado.suscribir_onda('sid2', 'p2', 5)
+    assert estado.tasas_onda() == {'p2': {25, 5}}
+    assert estado.desuscribir_onda('sid1') == ('p2', 25)
+    assert estado.desuscribir_onda('sid1') is None
+
+    print("\n✅ Módulo funcionando correctamente!")
@@ -0,0 +1,424 @@
+# exportacion.py - Exportación de datos por streaming (memoria acotada)
+#
+# Recorre perfil → pacientes → diagnósticos (→ señales) página a página
+# (cursores keyset del repositorio) y entrega el archivo en trozos a medida que se
+# genera: en memoria solo hay una página y el trozo comprimido en curso,
+# sin importar cuántos diagnósticos tenga el usuario.
+#   - ndjson_gzip(): un registro JSON por línea, comprimido con gzip
+#   - zip_usuario(): ZIP con perfil.json, pacientes.csv, diagnosticos.csv
+#                    y senales/<diagnostico_id>.npy
+#
+# Las exportaciones masivas del admin (todos los usuarios) corren en un hilo
+# de fondo (ExportacionesAdmin) que escribe a disco y reporta su progreso.
+# Ese hilo no tiene token de usuario: lee con el repositorio de servicio
+# (supabase_config.repositorio_servicio, clave service_role); con el de
+# usuario, bajo RLS, la exportación saldría vacía.
+#
+# Uso (Flask):
+#   Response(stream_with_context(ndjson_gzip(registros_usuario(repositorio, user_id))),
+#            mimetype='application/gzip')
+
+import io
+import os
+import csv
+import json
+import time
+import uuid
+import zlib
+import base64
+import zipfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from senales_compactas import descomprimir_senal, desde_bytea
+
+TAM_PAGINA = 500
+
+
+class ExportacionEnCurso(RuntimeError):
+    """Ya hay una exportación masiva en ejecución"""
+
+
+class ExportacionNoDisponible(RuntimeError):
+    """Exportación masiva sin repositorio de servicio"""
+
+
+# ============================================================================
+# LECTURA POR PÁGINAS
+# ============================================================================
+
+def _paginas(listar):
+    """
+    Itera todas las páginas de un listado del repositorio
+
+    Args:
+        listar: Callable(cursor) → (filas, cursor siguiente)
+    """
+    cursor = None
+    while True:
+        filas, cursor = listar(cursor)
+        if filas:
+            yield filas
+        if not cursor:
+            return
+
+
+def _paginas_pacientes(repo, user_id):
+    return _paginas(lambda cursor: repo.listar_pacientes(user_id, cursor, TAM_PAGINA))
+
+
+def _paginas_diagnosticos(repo, paciente_id, columnas=("*",)):
+    return _paginas(lambda cursor: repo.listar_diagnosticos(paciente_id, cursor, TAM_PAGINA, columnas, desc=False))
+
+
+def _senales(repo, diagnostico_ids):
+    """Señales de una página de diagnósticos (una consulta por página)"""
+    for fila in repo.senales(diagnostico_ids):
+        registro = {'tipo': 'senal', 'diagnostico_id': fila['diagnostico_id']}
+        if fila.get('senal_comprimida'):
+            registro['blob'] = desde_bytea(fila['senal_comprimida'])
+        else:
+            # Filas antiguas guardadas como listas JSON
+            registro['xyz'] = [fila['canal_x'], fila['canal_y'], fila['canal_z']]
+        yield registro
+
+
+def _senal_a_array(registro):
+    if 'blob' in registro:
+        senal, _ = descomprimir_senal(registro['blob'])
+        return senal
+    return np.column_stack(registro['xyz']).astype(np.float32)
+
+
+def registros_usuario(repo, user_id, incluir_senales=False):
+    """
+    Genera los registros de un usuario en orden: perfil, y por cada paciente
+    el paciente seguido de sus diagnósticos (y señales)
+
+    Yields:
+        dict: Registro con 'tipo' ('perfil', 'paciente', 'diagnostico', 'senal')
+    """
+    perfil = repo.obtener_perfil(user_id)
+    if perfil:
+        yield {'tipo': 'perfil', **perfil}
+
+    for pacientes in _paginas_pacientes(repo, user_id):
+        for paciente in pacientes:
+            yield {'tipo': 'paciente', **paciente}
+            for diagnosticos in _paginas_diagnosticos(repo, paciente['id']):
+                for diagnostico in diagnosticos:
+                    yield {'tipo': 'diagnostico', **diagnostico}
+                if incluir_senales:
+                    yield from _senales(repo, [d['id'] for d in diagnosticos])
+
+
+# ============================================================================
+# FORMATOS
+# ============================================================================
+
+def ndjson_gzip(registros, nivel=6):
+    """
+    Serializa registros como NDJSON comprimido con gzip, en trozos
+
+    Las señales comprimidas (DCS1, ver senales_compactas.py) van en base64
+    en 'dcs1_base64'.
+
+    Yields:
+        bytes: Trozos del archivo .ndjson.gz
+    """
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits=31: cabecera gzip
+    for registro in registros:
+        if 'blob' in registro:
+            registro = dict(registro)
+            registro['dcs1_base64'] = base64.b64encode(registro.pop('blob')).decode('ascii')
+        linea = json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+        trozo = compresor.compress(linea.encode('utf-8'))
+        if trozo:
+            yield trozo
+    yield compresor.flush()
+
+
+class _Sumidero(io.RawIOBase):
+    """Destino no posicionable del ZIP: acumula lo escrito hasta que se vacía"""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+class _CSV:
+    """CSV sobre un archivo binario del ZIP; la cabecera sale de la primera fila"""
+
+    def __init__(self, binario):
+        self.texto = io.TextIOWrapper(binario, encoding='utf-8', newline='')
+        self.escritor = None
+
+    def filas(self, filas):
+        for fila in filas:
+            if self.escritor is None:
+                self.escritor = csv.DictWriter(self.texto, list(fila), extrasaction='ignore')
+                self.escritor.writeheader()
+            self.escritor.writerow({
+                k: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                for k, v in fila.items()
+            })
+        self.texto.flush()
+
+    def cerrar(self):
+        self.texto.flush()
+        self.texto.detach()  # El archivo del ZIP lo cierra su propio `with`
+
+
+def zip_usuario(repo, user_id, incluir_senales=False):
+    """
+    ZIP de un usuario: perfil.json, pacientes.csv, diagnosticos.csv y,
+    opcionalmente, senales/<diagnostico_id>.npy (float32, N x 3)
+
+    Yields:
+        bytes: Trozos del archivo .zip
+    """
+    sumidero = _Sumidero()
+    with zipfile.ZipFile(sumidero, 'w', zipfile.ZIP_DEFLATED) as zf:
+        perfil = repo.obtener_perfil(user_id)
+        zf.writestr('perfil.json', json.dumps(perfil or {}, ensure_ascii=False, indent=2, default=str))
+        yield sumidero.vaciar()
+
+        paciente_ids = []
+        with zf.open('pacientes.csv', 'w', force_zip64=True) as archivo:
+            tabla = _CSV(archivo)
+            for pacientes in _paginas_pacientes(repo, user_id):
+                tabla.filas(pacientes)
+                paciente_ids.extend(p['id'] for p in pacientes)
+                yield sumidero.vaciar()
+            tabla.cerrar()
+
+        with zf.open('diagnosticos.csv', 'w', force_zip64=True) as archivo:
+            tabla = _CSV(archivo)
+            for paciente_id in paciente_ids:
+                for diagnosticos in _paginas_diagnosticos(repo, paciente_id):
+                    tabla.filas(diagnosticos)
+                    yield sumidero.vaciar()
+            tabla.cerrar()
+
+        if incluir_senales:
+            for paciente_id in paciente_ids:
+                for diagnosticos in _paginas_diagnosticos(repo, paciente_id, columnas=('id', 'timestamp')):
+                    for registro in _senales(repo, [d['id'] for d in diagnosticos]):
+                        buffer = io.BytesIO()
+                        np.save(buffer, _senal_a_array(registro))
+                        zf.writestr(f"senales/{registro['diagnostico_id']}.npy", buffer.getvalue())
+                        yield sumidero.vaciar()
+    yield sumidero.vaciar()
+
+
+# ============================================================================
+# EXPORTACIÓN MASIVA EN SEGUNDO PLANO (admin)
+# ============================================================================
+
+class ExportacionesAdmin:
+    """
+    Exporta varios usuarios (o todos) a un .ndjson.gz en disco, en un hilo de fondo
+    """
+
+    def __init__(self, repo, directorio="exportaciones", max_historial=20):
+        """
+        Args:
+            repo: Repositorio con acceso de servicio a las filas de todos los
+                usuarios (supabase_config.repositorio_servicio); None si no
+                está configurado (iniciar lanza ExportacionNoDisponible)
+            directorio: Carpeta de los archivos exportados
+            max_historial: Trabajos cuyo estado se recuerda
+        """
+        self.repo = repo
+        self.directorio = directorio
+        self.max_historial = max_historial
+        self._lock = threading.Lock()
+        self._trabajos = OrderedDict()  # trabajo_id -> estado
+        self._en_curso = None
+
+    def iniciar(self, user_ids=None, incluir_senales=False):
+        """
+        Args:
+            user_ids: Usuarios a exportar (None = todos)
+            incluir_senales: Incluir las señales ECG
+
+        Returns:
+            str: ID del trabajo
+
+        Raises:
+            ExportacionEnCurso: Si ya hay una exportación corriendo
+            ExportacionNoDisponible: Sin repositorio de servicio
+        """
+        if self.repo is None:
+            raise ExportacionNoDisponible(
+                "Exportación masiva no disponible: falta la clave de servicio (SUPABASE_SERVICE_KEY)"
+            )
+        with self._lock:
+            if self._en_curso:
+                raise ExportacionEnCurso(f"Ya hay una exportación en curso ({self._en_curso})")
+            trabajo_id = uuid.uuid4().hex[:12]
+            self._trabajos[trabajo_id] = {
+                'id': trabajo_id,
+                'estado': 'en_curso',
+                'usuarios_total': len(user_ids) if user_ids else None,
+                'usuarios_hechos': 0,
+                'registros': 0,
+                'bytes': 0,
+                'inicio': time.time(),
+                'fin': None,
+                'error': None,
+                'archivo': None
+            }
+            while len(self._trabajos) > self.max_historial:
+                self._trabajos.popitem(last=False)
+            self._en_curso = trabajo_id
+
+        threading.Thread(
+            target=self._ejecutar, args=(trabajo_id, user_ids, incluir_senales),
+            name="exportacion", daemon=True
+        ).start()
+        return trabajo_id
+
+    def estado(self, trabajo_id):
+        """
+        Returns:
+            dict: Copia del estado del trabajo (None si no existe)
+        """
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            return dict(trabajo) if trabajo else None
+
+    def _actualizar(self, trabajo_id, **campos):
+        with self._lock:
+            self._trabajos[trabajo_id].update(campos)
+
+    def _todos_los_usuarios(self):
+        ids = []
+        for usuarios in _paginas(self.repo.listar_perfiles):
+            ids.extend(u['id'] for u in usuarios)
+        return ids
+
+    def _registros(self, trabajo_id, user_ids, incluir_senales):
+        registros = 0
+        for hechos, user_id in enumerate(user_ids):
+            for registro in registros_usuario(self.repo, user_id, incluir_senales):
+                registros += 1
+                yield registro
+            self._actualizar(trabajo_id, usuarios_hechos=hechos + 1, registros=registros)
+
+    def _ejecutar(self, trabajo_id, user_ids, incluir_senales):
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = os.path.join(self.directorio, f"exportacion_{time.strftime('%Y%m%d_%H%M%S')}_{trabajo_id}.ndjson.gz")
+        try:
+            if not user_ids:
+                user_ids = self._todos_los_usuarios()
+                self._actualizar(trabajo_id, usuarios_total=len(user_ids))
+
+            escritos = 0
+            with open(ruta + ".parcial", "wb") as archivo:
+                for trozo in ndjson_gzip(self._registros(trabajo_id, user_ids, incluir_senales)):
+                    archivo.write(trozo)
+                    escritos += len(trozo)
+                    self._actualizar(trabajo_id, bytes=escritos)
+            os.replace(ruta + ".parcial", ruta)
+
+            self._actualizar(trabajo_id, estado='terminado', archivo=ruta, fin=time.time())
+            print(f"✅ Exportación {trabajo_id}: {len(user_ids)} usuarios, {escritos / 1e6:.1f} MB → {ruta}")
+        except Exception as e:
+            print(f"❌ Error en exportación {trabajo_id}: {e}")
+            self._actualizar(trabajo_id, estado='error', error=str(e), fin=time.time())
+        finally:
+            with self._lock:
+                self._en_curso = None
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    import gzip
+
+    print("📦 Exportación por streaming")
+    print("=" * 50)
+
+    registros = ({'tipo': 'diagnostico', 'id': i, 'hr_bpm': 70 + i % 10} for i in range(100000))
+    trozos = 0
+    total = 0
+    salida = io.BytesIO()
+    for trozo in ndjson_gzip(registros):
+        trozos += 1
+        total += len(trozo)
+        salida.write(trozo)
+    lineas = gzip.decompress(salida.getvalue()).decode('utf-8').splitlines()
+    assert len(lineas) == 100000 and json.loads(lineas[-1])['id'] == 99999
+    print(f"  NDJSON.gz: 100000 registros en {trozos} trozos, {total / 1e3:.0f} KB")
+
+    # ZIP sobre un destino no posicionable, escrito en trozos
+    sumidero = _Sumidero()
+    partes = []
+    with zipfile.ZipFile(sumidero, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('diagnosticos.csv', 'w', force_zip64=True) as archivo:
+            tabla = _CSV(archivo)
+            for pagina in range(10):
+                tabla.filas([{'id': pagina * 10 + i, 'probabilidades': {'Normal': 0.9}} for i in range(10)])
+                partes.append(sumidero.vaciar())
+            tabla.cerrar()
+    partes.append(sumidero.vaciar())
+    with zipfile.ZipFile(io.BytesIO(b"".join(partes))) as zf:
+        filas = list(csv.DictReader(io.TextIOWrapper(zf.open('diagnosticos.csv'), encoding='utf-8')))
+    assert len(filas) == 100 and json.loads(filas[0]['probabilidades']) == {'Normal': 0.9}
+    print(f"  ZIP: 100 filas CSV en {len(partes)} trozos")
+
+    # Exportación masiva contra la base SQLite: cuenta de filas por tipo
+    import tempfile
+    from collections import Counter
+    from repositorio import crear_repositorio
+
+    directorio = tempfile.mkdtemp()
+    repo = crear_repositorio(f"sqlite:///{os.path.join(directorio, 'exportacion.db')}")
+    esperado = Counter()
+    for u in range(3):
+        repo.guardar_perfil({'id': f'u{u}', 'email': f'u{u}@ejemplo.com', 'rol': 'usuario'})
+        esperado['perfil'] += 1
+        for p in range(2):
+            paciente = repo.crear_paciente({'nombre': f'Paciente {u}.{p}', 'user_id': f'u{u}'})
+            n = 300 * (u + 1) + p  # Más de una página (TAM_PAGINA) para u1 y u2
+            repo.insertar('diagnosticos', [{'paciente_id': paciente['id'], 'diagnostico': 'Normal', 'hr_bpm': 70}
+                                           for _ in range(n)])
+            esperado['paciente'] += 1
+            esperado['diagnostico'] += n
+
+    exportaciones = ExportacionesAdmin(repo, directorio=directorio)
+    trabajo_id = exportaciones.iniciar()
+    while exportaciones.estado(trabajo_id)['estado'] == 'en_curso':
+        time.sleep(0.05)
+    trabajo = exportaciones.estado(trabajo_id)
+    assert trabajo['estado'] == 'terminado', trabajo['error']
+    with gzip.open(trabajo['archivo'], 'rt', encoding='utf-8') as f:
+        tipos = Counter(json.loads(linea)['tipo'] for linea in f)
+    assert tipos == esperado, (tipos, esperado)
+    assert trabajo['usuarios_hechos'] == trabajo['usuarios_total'] == 3
+    assert trabajo['registros'] == sum(esperado.values())
+    print(f"  Exportación masiva (SQLite): {dict(tipos)}")
+
+    try:
+        ExportacionesAdmin(None, directorio=directorio).iniciar()
+        raise AssertionError("Exportación sin repositorio de servicio")
+    except ExportacionNoDisponible:
+        pass
+
+    print("\n✅ Módulo funcionando correctamente!")
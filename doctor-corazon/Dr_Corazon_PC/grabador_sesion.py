@@ -0,0 +1,346 @@
+# grabador_sesion.py - Archivo continuo de sesiones holter (memory-mapped)
+#
+# Cada sesión es un directorio con segmentos de `horas_segmento` horas:
+#   sesion.json        Metadatos (dispositivo, fs, inicio, segmentos y muestras de cada uno)
+#   crudo_0000.npy     int32 (N, 4): ES, AS, AI, ALAB tal como llegan del ESP32
+#   xyz_0000.npy       float32 (M, 3): X, Y, Z procesado (500 Hz)
+#   indice_0000.npy    float64 (V, 3): [timestamp inicio ventana, offset crudo, offset xyz]
+#
+# Los .npy se abren con np.memmap: escribir es copiar a la página mapeada
+# y leer un intervalo no carga el resto del día en memoria. Cada segmento se
+# preasigna completo (en NTFS no es disperso), así que se dimensiona por
+# segmento y no por sesión: al llenarse uno se abre el siguiente y, con
+# `max_segmentos`, se borra el más antiguo (disco acotado).
+#
+# sesion.json se reescribe cada `intervalo_metadatos` segundos, al rotar y
+# al cerrar: tras una caída se pierde como mucho ese intervalo de lectura.
+# Las sesiones de un solo archivo (crudo.npy, xyz.npy, indice.npy) se siguen
+# leyendo con LectorSesion.
+
+import os
+import json
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+
+FS_CRUDO = 853.364
+FS_XYZ = 500.0
+
+
+def _archivo(directorio, nombre, numero):
+    """Ruta del .npy de un segmento (numero None: sesión de un solo archivo)"""
+    if numero is None:
+        return os.path.join(directorio, f"{nombre}.npy")
+    return os.path.join(directorio, f"{nombre}_{numero:04d}.npy")
+
+
+class GrabadorSesion:
+    """
+    Graba una sesión continua de un dispositivo en segmentos memory-mapped
+    """
+
+    def __init__(self, directorio, dispositivo="esp32", horas_segmento=1.0, max_segmentos=None,
+                 intervalo_metadatos=30.0, fs_crudo=FS_CRUDO, fs_xyz=FS_XYZ,
+                 muestras_ventana_xyz=5000):
+        """
+        Args:
+            directorio: Carpeta de la sesión (se crea)
+            dispositivo: Identificador del dispositivo de origen
+            horas_segmento: Horas preasignadas por segmento (disco reservado
+                de golpe al abrir cada uno: ~34 MB por hora)
+            max_segmentos: Segmentos que se conservan; al superarlo se borra
+                el más antiguo. None = sin límite
+            intervalo_metadatos: Segundos entre escrituras de sesion.json
+            fs_crudo: Hz de las muestras EASI
+            fs_xyz: Hz de la señal XYZ procesada
+            muestras_ventana_xyz: Muestras XYZ por ventana (para dimensionar el índice)
+        """
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.fs_crudo = fs_crudo
+        self.fs_xyz = fs_xyz
+        self.max_segmentos = max_segmentos
+        self.intervalo_metadatos = intervalo_metadatos
+
+        segundos = horas_segmento * 3600 * 1.01  # margen por redondeo de ventanas
+        self._cap_crudo = int(segundos * fs_crudo)
+        self._cap_xyz = int(segundos * fs_xyz)
+        self._cap_ventanas = self._cap_xyz // muestras_ventana_xyz + 1
+
+        self.n_crudo = 0
+        self.n_xyz = 0
+        self.n_ventanas = 0
+        self.metadatos = {
+            "dispositivo": dispositivo,
+            "inicio": time.time(),
+            "fs_crudo": fs_crudo,
+            "fs_xyz": fs_xyz,
+            "horas_segmento": horas_segmento,
+            "max_segmentos": max_segmentos,
+            "segmentos": []
+        }
+        self._abrir_segmento(0)
+        print(f"🎙️  Grabando sesión de {dispositivo} en {directorio} (segmentos de {horas_segmento} h)")
+
+    def _abrir_segmento(self, numero):
+        self.segmento = numero
+        self.crudo = open_memmap(_archivo(self.directorio, "crudo", numero), mode="w+",
+                                 dtype=np.int32, shape=(self._cap_crudo, 4))
+        self.xyz = open_memmap(_archivo(self.directorio, "xyz", numero), mode="w+",
+                               dtype=np.float32, shape=(self._cap_xyz, 3))
+        self.indice = open_memmap(_archivo(self.directorio, "indice", numero), mode="w+",
+                                  dtype=np.float64, shape=(self._cap_ventanas, 3))
+        self.n_crudo = self.n_xyz = self.n_ventanas = 0
+        self.metadatos["segmentos"].append({"numero": numero, "n_crudo": 0, "n_xyz": 0, "n_ventanas": 0})
+        self._guardar_metadatos()
+
+    def _rotar(self):
+        """Cierra el segmento lleno, abre el siguiente y borra el más antiguo si sobra"""
+        for mapa in (self.crudo, self.xyz, self.indice):
+            mapa.flush()
+        self._guardar_metadatos()  # Muestras finales del segmento que se cierra
+        self._abrir_segmento(self.segmento + 1)
+
+        segmentos = self.metadatos["segmentos"]
+        while self.max_segmentos and len(segmentos) > self.max_segmentos:
+            viejo = segmentos.pop(0)
+            self._guardar_metadatos()  # El lector deja de verlo antes de borrarlo
+            for nombre in ("crudo", "xyz", "indice"):
+                try:
+                    os.remove(_archivo(self.directorio, nombre, viejo["numero"]))
+                except OSError as e:
+                    print(f"⚠️  No se pudo borrar el segmento {viejo['numero']}: {e}")
+        print(f"🔁 Sesión {self.directorio}: segmento {self.segmento}")
+
+    def agregar_ventana(self, crudo, xyz, timestamp_inicio):
+        """
+        Agrega una ventana: muestras crudas + XYZ procesado
+
+        Args:
+            crudo: Array (n, 4) int con ES, AS, AI, ALAB
+            xyz: Array (m, 3) float con X, Y, Z
+            timestamp_inicio: time.time() de la primera muestra de la ventana
+
+        Returns:
+            bool: False si la ventana no cabe ni en un segmento vacío
+        """
+        n, m = len(crudo), len(xyz)
+        if n > self._cap_crudo or m > self._cap_xyz:
+            return False
+        if (self.n_crudo + n > self._cap_crudo or self.n_xyz + m > self._cap_xyz
+                or self.n_ventanas >= self._cap_ventanas):
+            self._rotar()
+
+        self.indice[self.n_ventanas] = (timestamp_inicio, self.n_crudo, self.n_xyz)
+        self.crudo[self.n_crudo:self.n_crudo + n] = crudo
+        self.xyz[self.n_xyz:self.n_xyz + m] = xyz
+
+        self.n_crudo += n
+        self.n_xyz += m
+        self.n_ventanas += 1
+        if time.monotonic() - self._guardado >= self.intervalo_metadatos:
+            self._guardar_metadatos()
+        return True
+
+    def _guardar_metadatos(self):
+        """Actualiza sesion.json (escritura atómica con rename)"""
+        self.metadatos["segmentos"][-1].update(n_crudo=self.n_crudo, n_xyz=self.n_xyz,
+                                               n_ventanas=self.n_ventanas)
+        ruta = os.path.join(self.directorio, "sesion.json")
+        with open(ruta + ".tmp", "w") as f:
+            json.dump(self.metadatos, f)
+        os.replace(ruta + ".tmp", ruta)
+        self._guardado = time.monotonic()
+
+    def cerrar(self):
+        """Vuelca las páginas pendientes a disco y los metadatos"""
+        for mapa in (self.crudo, self.xyz, self.indice):
+            mapa.flush()
+        self._guardar_metadatos()
+
+
+class LectorSesion:
+    """
+    Lee intervalos de una sesión grabada sin cargar el archivo completo.
+    Los offsets de `indice` son globales (segmentos conservados, en orden).
+    """
+
+    def __init__(self, directorio):
+        with open(os.path.join(directorio, "sesion.json")) as f:
+            self.metadatos = json.load(f)
+
+        self.fs_crudo = self.metadatos["fs_crudo"]
+        self.fs_xyz = self.metadatos["fs_xyz"]
+        # Sesiones de un solo archivo: un segmento sin número
+        segmentos = self.metadatos.get("segmentos") or [
+            {"numero": None, **{k: self.metadatos[k] for k in ("n_crudo", "n_xyz", "n_ventanas")}}
+        ]
+
+        self._crudo, self._xyz, indices = [], [], []
+        base_crudo = base_xyz = 0
+        for seg in segmentos:
+            if not seg["n_ventanas"]:
+                continue
+            self._crudo.append(np.load(_archivo(directorio, "crudo", seg["numero"]), mmap_mode="r")[:seg["n_crudo"]])
+            self._xyz.append(np.load(_archivo(directorio, "xyz", seg["numero"]), mmap_mode="r")[:seg["n_xyz"]])
+            indice = np.array(np.load(_archivo(directorio, "indice", seg["numero"]), mmap_mode="r")[:seg["n_ventanas"]])
+            indice[:, 1] += base_crudo
+            indice[:, 2] += base_xyz
+            indices.append(indice)
+            base_crudo += seg["n_crudo"]
+            base_xyz += seg["n_xyz"]
+        self.indice = np.concatenate(indices) if indices else np.zeros((0, 3))
+        # Por tipo: (vistas por segmento, offset global de inicio de cada una + total, vacío)
+        self._partes = {
+            "crudo": (self._crudo, np.cumsum([0] + [len(c) for c in self._crudo]), np.zeros((0, 4), np.int32)),
+            "xyz": (self._xyz, np.cumsum([0] + [len(x) for x in self._xyz]), np.zeros((0, 3), np.float32)),
+        }
+
+    def _total(self, tipo):
+        return int(self._partes[tipo][1][-1])
+
+    @property
+    def crudo(self):
+        """(N, 4) int32 de toda la sesión (vista si hay un segmento; copia si hay varios)"""
+        return self._tramo("crudo", 0, self._total("crudo"))
+
+    @property
+    def xyz(self):
+        """(M, 3) float32 de toda la sesión (vista si hay un segmento; copia si hay varios)"""
+        return self._tramo("xyz", 0, self._total("xyz"))
+
+    @property
+    def inicio(self):
+        return float(self.indice[0, 0]) if len(self.indice) else self.metadatos["inicio"]
+
+    def _tramo(self, tipo, a, b):
+        """Muestras globales [a, b): vista de un segmento o copia si cruza varios"""
+        partes, inicios, vacio = self._partes[tipo]
+        if b <= a:
+            return vacio
+        primero = int(np.searchsorted(inicios, a, side="right")) - 1
+        ultimo = int(np.searchsorted(inicios, b, side="left")) - 1
+        trozos = [partes[k][max(a - inicios[k], 0):b - inicios[k]] for k in range(primero, ultimo + 1)]
+        return trozos[0] if len(trozos) == 1 else np.concatenate(trozos)
+
+    def _offset(self, timestamp, columna, fs, total):
+        """Convierte un timestamp en índice de muestra usando el índice de ventanas"""
+        if not len(self.indice):
+            return 0
+        v = max(int(np.searchsorted(self.indice[:, 0], timestamp, side="right")) - 1, 0)
+        t_ventana, base = self.indice[v, 0], self.indice[v, columna]
+        return int(np.clip(base + round((timestamp - t_ventana) * fs), 0, total))
+
+    def leer_crudo(self, t_inicio, t_fin):
+        """
+        Returns:
+            np.ndarray: (n, 4) int32 de las muestras crudas entre dos timestamps
+                (vista memory-mapped salvo que cruce un cambio de segmento)
+        """
+        total = self._total("crudo")
+        a = self._offset(t_inicio, 1, self.fs_crudo, total)
+        b = self._offset(t_fin, 1, self.fs_crudo, total)
+        return self._tramo("crudo", a, b)
+
+    def leer_xyz(self, t_inicio, t_fin):
+        """
+        Returns:
+            np.ndarray: (m, 3) float32 de X, Y, Z entre dos timestamps
+                (vista memory-mapped salvo que cruce un cambio de segmento)
+        """
+        total = self._total("xyz")
+        a = self._offset(t_inicio, 2, self.fs_xyz, total)
+        b = self._offset(t_fin, 2, self.fs_xyz, total)
+        return self._tramo("xyz", a, b)
+
+    def _ventana(self, i, columna, tipo):
+        """Vista de la ventana i (columna 1: crudo, 2: xyz) y su timestamp"""
+        inicio = int(self.indice[i, columna])
+        fin = int(self.indice[i + 1, columna]) if i + 1 < len(self.indice) else self._total(tipo)
+        return float(self.indice[i, 0]), self._tramo(tipo, inicio, fin)
+
+    def ventana_xyz(self, i):
+        """
+        Returns:
+            tuple: (timestamp_inicio, np.memmap (m, 3)) de la ventana i
+        """
+        return self._ventana(i, 2, "xyz")
+
+    def ventana_crudo(self, i):
+        """
+        Returns:
+            tuple: (timestamp_inicio, np.memmap (n, 4)) de la ventana i
+        """
+        return self._ventana(i, 1, "crudo")
+
+    def ventanas_xyz(self):
+        """
+        Itera las ventanas XYZ grabadas
+
+        Yields:
+            tuple: (timestamp_inicio, np.memmap (m, 3))
+        """
+        for i in range(len(self.indice)):
+            yield self.ventana_xyz(i)
+
+    def ventanas_crudo(self):
+        """
+        Itera las ventanas de muestras crudas grabadas
+
+        Yields:
+            tuple: (timestamp_inicio, np.memmap (n, 4))
+        """
+        for i in range(len(self.indice)):
+            yield self.ventana_crudo(i)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    import tempfile
+
+    print("🎙️  Grabador de sesiones holter")
+    print("=" * 50)
+
+    directorio = os.path.join(tempfile.mkdtemp(), "sesion_prueba")
+    grabador = GrabadorSesion(directorio, horas_segmento=0.25)  # 4 segmentos en 1 h
+
+    n_crudo = int(round(FS_CRUDO * 10))
+    t0 = 1_700_000_000.0
+    inicio = time.perf_counter()
+    for v in range(360):  # 1 hora de ventanas de 10 s
+        crudo = np.full((n_crudo, 4), v, dtype=np.int32)
+        xyz = np.full((5000, 3), v, dtype=np.float32)
+        grabador.agregar_ventana(crudo, xyz, t0 + 10 * v)
+    grabador.cerrar()
+    duracion = time.perf_counter() - inicio
+    print(f"  1 h grabada en {duracion:.2f}s ({360 * 10 / duracion:.0f}x tiempo real)")
+
+    lector = LectorSesion(directorio)
+    tramo = lector.leer_xyz(t0 + 1800, t0 + 1805)
+    assert tramo.shape == (2500, 3) and np.all(tramo == 180)
+    assert np.all(lector.leer_crudo(t0 + 3595, t0 + 3600) == 359)
+    assert sum(1 for _ in lector.ventanas_xyz()) == 360
+    assert len(lector.metadatos["segmentos"]) == 4
+    assert np.all(lector.ventana_crudo(91)[1] == 91)
+    cruce = lector.leer_xyz(t0 + 895, t0 + 915)  # Atraviesa el cambio de segmento
+    assert cruce.shape == (10000, 3) and np.all(cruce[:2500] == 89) and np.all(cruce[-2500:] == 91)
+
+    # Rotación con disco acotado: se conservan los 2 segmentos más recientes
+    directorio = os.path.join(tempfile.mkdtemp(), "sesion_rotada")
+    grabador = GrabadorSesion(directorio, horas_segmento=0.25, max_segmentos=2, intervalo_metadatos=3600)
+    for v in range(360):
+        grabador.agregar_ventana(np.full((n_crudo, 4), v, dtype=np.int32),
+                                 np.full((5000, 3), v, dtype=np.float32), t0 + 10 * v)
+    lector = LectorSesion(directorio)
+    assert len(lector.indice) < 360  # Metadatos aún sin volcar: solo hasta la última rotación
+    grabador.cerrar()
+    lector = LectorSesion(directorio)
+    assert [s["numero"] for s in lector.metadatos["segmentos"]] == [2, 3]
+    assert len(os.listdir(directorio)) == 7  # sesion.json + 2 segmentos x 3 archivos
+    assert lector.ventana_xyz(0)[0] == t0 + 10 * 180 and np.all(lector.leer_xyz(t0 + 3595, t0 + 3600) == 359)
+    print(f"  Rotación: segmentos {[s['numero'] for s in lector.metadatos['segmentos']]} conservados")
+
+    print("\n✅ Módulo funcionando correctamente!")
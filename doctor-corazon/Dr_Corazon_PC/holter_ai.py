@@ -68,29 +68,53 @@ class HolterAnalyzer:
             # verbose=0 para que no salga la barra de carga en el dispositivo
             probabilidades = self.model.predict(tensor, verbose=0)[0]
             
-            # Interpretamos resultados (Umbral 0.5)
-            diagnosticos_detectados = []
-            resultado_detallado = {}
+            return self._interpretar(probabilidades)
             
-            for i, clase in enumerate(self.classes):
-                score = probabilidades[i]
-                resultado_detallado[clase] = float(score) # Guardamos probabilidad
-                
-                if score > 0.5:
-                    diagnosticos_detectados.append(clase)
+        except Exception as e:
+            return {"status": "ERROR", "mensaje": str(e)}
+
+    def diagnosticar_lote(self, senales):
+        """
+        Diagnostica varias ventanas con una sola llamada al modelo
+        (uso offline: re-análisis de sesiones grabadas).
+        
+        Args:
+            senales: Lista de arrays (5000, 3)
+        
+        Returns:
+            list: Un dict por ventana, igual que diagnosticar()
+        """
+        if len(senales) == 0:
+            return []
+        try:
+            tensor = np.concatenate([self.preprocesar_senal(s) for s in senales], axis=0)
+            probabilidades = self.model.predict(tensor, batch_size=len(senales), verbose=0)
+            return [self._interpretar(p) for p in probabilidades]
+        except Exception as e:
+            return [{"status": "ERROR", "mensaje": str(e)} for _ in senales]
+
+    def _interpretar(self, probabilidades):
+        """Convierte el vector de salida del modelo en el dict de diagnóstico"""
+        # Interpretamos resultados (Umbral 0.5)
+        diagnosticos_detectados = []
+        resultado_detallado = {}
+        
+        for i, clase in enumerate(self.classes):
+            score = probabilidades[i]
+            resultado_detallado[clase] = float(score) # Guardamos probabilidad
             
-            # Si no detectó nada con seguridad, marcamos como incierto
-            if not diagnosticos_detectados:
-                status = "INCIERTO / SIN HALLAZGOS CLAROS"
-            else:
-                status = ", ".join(diagnosticos_detectados)
-                
-            return {
-                "status": "OK",
-                "diagnostico_texto": status,
-                "detalles": resultado_detallado,
-                "alerta_infarto": resultado_detallado.get('MI', 0) > 0.5 # Bandera crítica
-            }
+            if score > 0.5:
+                diagnosticos_detectados.append(clase)
+        
+        # Si no detectó nada con seguridad, marcamos como incierto
+        if not diagnosticos_detectados:
+            status = "INCIERTO / SIN HALLAZGOS CLAROS"
+        else:
+            status = ", ".join(diagnosticos_detectados)
             
-        except Exception as e:
-            return {"status": "ERROR", "mensaje": str(e)}
\ No newline at end of file
+        return {
+            "status": "OK",
+            "diagnostico_texto": status,
+            "detalles": resultado_detallado,
+            "alerta_infarto": resultado_detallado.get('MI', 0) > 0.5 # Bandera crítica
+        }
@@ -1,41 +1,175 @@
 # hr_hrv_analyzer.py - Análisis de Frecuencia Cardíaca y Variabilidad
+import time
 import numpy as np
 from scipy import signal
 from scipy.signal import find_peaks
+from concurrencia import crear_lock
+
+# ============================================================================
+# ESTADO DEL DETECTOR POR PACIENTE
+# ============================================================================
+
+class EstadoDetector:
+    """
+    Estado aprendido del detector de picos R para un paciente/canal:
+    amplitud R, nivel de ruido y plantilla QRS (en la señal filtrada 5-15 Hz)
+    """
+    
+    def __init__(self):
+        self.amplitud_r = None      # Pico típico de la correlación con la plantilla
+        self.nivel_ruido = None     # Nivel típico de la correlación fuera de los QRS
+        self.plantilla = None       # Plantilla QRS normalizada (media 0, norma 1)
+        self.latidos = None         # Latidos típicos por ventana
+        self.ventanas = 0
+        self.reinicios = 0          # Veces que se descartó lo aprendido (cambio de ganancia/ruido)
+        self.ultimo_uso = time.monotonic()
+    
+    def reiniciar(self):
+        """Olvida plantilla y umbrales: se vuelven a aprender de la ventana actual"""
+        self.amplitud_r = None
+        self.nivel_ruido = None
+        self.plantilla = None
+        self.latidos = None
+        self.reinicios += 1
+
+
+class CacheDetectores:
+    """
+    Cache thread-safe de EstadoDetector por clave (paciente, canal).
+    Los estados sin uso durante `ttl_segundos` se descartan.
+    """
+    
+    def __init__(self, ttl_segundos=600):
+        self.ttl = ttl_segundos
+        self._estados = {}
+        self._lock = crear_lock()  # analizar() corre en tpool con eventlet
+    
+    def obtener(self, clave):
+        """Obtiene (o crea) el estado de una clave y purga los inactivos"""
+        ahora = time.monotonic()
+        with self._lock:
+            vencidos = [k for k, e in self._estados.items() if ahora - e.ultimo_uso > self.ttl]
+            for k in vencidos:
+                del self._estados[k]
+            
+            estado = self._estados.get(clave)
+            if estado is None:
+                estado = EstadoDetector()
+                self._estados[clave] = estado
+            estado.ultimo_uso = ahora
+            return estado
+    
+    def descartar(self, clave):
+        """Elimina el estado de una clave (ej. cambio de paciente)"""
+        with self._lock:
+            self._estados.pop(clave, None)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._estados)
+
 
 class HRVAnalyzer:
     """
     Calculador de HR (Heart Rate) y HRV (Heart Rate Variability)
     """
     
-    def __init__(self, frecuencia_muestreo=500):
+    # Tope de la envolvente en el umbral robusto: mediana + K_MAD·MAD
+    # (los picos R quedan ~7-20 MAD por encima; un artefacto, cientos)
+    K_MAD = 10.0
+    
+    def __init__(self, frecuencia_muestreo=500, ttl_estado_segundos=600):
         """
         Args:
             frecuencia_muestreo: Hz, típicamente 500 Hz para ECG
+            ttl_estado_segundos: Inactividad tras la que se descarta el
+                estado aprendido de un paciente
         """
         self.fs = frecuencia_muestreo
+        
+        # Filtro QRS (5-15 Hz), diseñado una sola vez
+        self.sos_qrs = signal.butter(4, [5, 15], btype='band', fs=self.fs, output='sos')
+        
+        # Estado aprendido por paciente (umbrales + plantilla QRS)
+        self.estados = CacheDetectores(ttl_segundos=ttl_estado_segundos)
+        self.medio_qrs = int(0.06 * self.fs)  # ±60 ms alrededor del pico R
     
-    def detectar_picos_r(self, señal_ecg):
+    def detectar_picos_r(self, señal_ecg, paciente_id=None, canal=None):
         """
         Detecta los picos R en la señal ECG (complejo QRS)
         
+        Sin paciente_id usa umbrales calculados sobre la propia ventana.
+        Con paciente_id reutiliza el estado aprendido en ventanas anteriores
+        (plantilla QRS + amplitud R + ruido) y detecta por filtro adaptado.
+        Si el filtro adaptado encuentra muy pocos latidos comparado con el
+        umbral de la ventana (cambio de ganancia, ruido, electrodo movido),
+        se usan los del umbral y el estado se vuelve a aprender.
+        
         Args:
             señal_ecg: Array 1D con la señal ECG (normalizada)
+            paciente_id: ID del paciente para usar su estado (opcional)
+            canal: Canal usado ('X', 'Y', 'Z'), forma parte de la clave
         
         Returns:
             indices: Array con las posiciones de los picos R
         """
-        # Normalizar señal
-        señal = (señal_ecg - np.mean(señal_ecg)) / np.std(señal_ecg)
+        # Normalizar señal (con estado: escala robusta, un artefacto no
+        # debe cambiar la escala de toda la ventana)
+        if paciente_id is None:
+            escala = np.std(señal_ecg)
+        else:
+            escala = 1.4826 * np.median(np.abs(señal_ecg - np.median(señal_ecg)))
+        if escala < 1e-9:
+            return np.array([], dtype=int)
+        señal = (señal_ecg - np.mean(señal_ecg)) / escala
         
         # Filtro pasa banda para resaltar complejo QRS (5-15 Hz)
-        sos = signal.butter(4, [5, 15], btype='band', fs=self.fs, output='sos')
-        señal_filtrada = signal.sosfilt(sos, señal)
+        señal_filtrada = signal.sosfilt(self.sos_qrs, señal)
+        
+        if paciente_id is None:
+            return self._detectar_por_umbral(señal_filtrada)
+        
+        estado = self.estados.obtener((paciente_id, canal))
+        
+        correlacion = None
+        if estado.plantilla is None:
+            # Primera ventana del paciente: umbral robusto a artefactos
+            picos = self._detectar_por_umbral(señal_filtrada, robusto=True)
+        else:
+            picos, correlacion = self._detectar_por_plantilla(señal_filtrada, estado)
+            if len(picos) < max(3, 0.5 * estado.latidos):
+                # Muchos menos latidos de lo habitual: si el umbral de la ventana
+                # encuentra bastantes más, lo aprendido ya no describe la señal
+                por_umbral = self._detectar_por_umbral(señal_filtrada, robusto=True)
+                if len(picos) < max(3, 0.5 * len(por_umbral)):
+                    estado.reiniciar()
+                    picos, correlacion = por_umbral, None
+        
+        self._actualizar_estado(estado, señal_filtrada, picos, correlacion)
+        return picos
+    
+    def _detectar_por_umbral(self, señal_filtrada, robusto=False):
+        """
+        Detección por umbral relativo a la ventana
         
+        Args:
+            señal_filtrada: Señal filtrada 5-15 Hz
+            robusto: Si True la amplitud de referencia se recorta a
+                mediana + k·MAD de la envolvente y los picos muy por encima
+                de los latidos se descartan como artefactos, para que un
+                único artefacto no suprima todos los latidos
+        """
         # Detectar picos
         # Altura mínima: 50% del máximo de la señal filtrada
         # Distancia mínima: 0.4 seg (150 BPM máximo)
-        altura_minima = 0.5 * np.max(np.abs(señal_filtrada))
+        if robusto:
+            envolvente = np.abs(señal_filtrada)
+            mediana = np.median(envolvente)
+            mad = 1.4826 * np.median(np.abs(envolvente - mediana))
+            tope = mediana + self.K_MAD * mad
+            altura_minima = 0.5 * np.percentile(np.minimum(envolvente, tope), 99)
+        else:
+            altura_minima = 0.5 * np.max(np.abs(señal_filtrada))
         distancia_minima = int(0.4 * self.fs)  # 400ms entre picos
         
         picos, propiedades = find_peaks(
@@ -45,8 +179,98 @@ class HRVAnalyzer:
             prominence=0.3
         )
         
+        if robusto and len(picos) >= 3:
+            # Artefacto (movimiento, electrodo): se blanquea su entorno y se
+            # repite la búsqueda, así no tapa el latido que tenga al lado
+            alturas = propiedades['peak_heights']
+            artefactos = picos[alturas > 4.0 * np.median(alturas)]
+            if len(artefactos) > 0:
+                señal_filtrada = señal_filtrada.copy()
+                margen = int(0.2 * self.fs)
+                for p in artefactos:
+                    señal_filtrada[max(0, p - margen):p + margen + 1] = 0.0
+                picos, _ = find_peaks(
+                    señal_filtrada,
+                    height=altura_minima,
+                    distance=distancia_minima,
+                    prominence=0.3
+                )
+        
         return picos
     
+    def _detectar_por_plantilla(self, señal_filtrada, estado):
+        """
+        Detección por filtro adaptado: correlación con la plantilla QRS
+        del paciente y umbral entre el nivel de ruido y la amplitud R aprendidos
+        
+        Returns:
+            tuple: (picos, correlación con la plantilla)
+        """
+        # Correlación con la plantilla (convolución con la plantilla invertida)
+        correlacion = np.convolve(señal_filtrada, estado.plantilla[::-1], mode='same')
+        
+        umbral = estado.nivel_ruido + 0.3 * (estado.amplitud_r - estado.nivel_ruido)
+        distancia_minima = int(0.4 * self.fs)
+        
+        picos, _ = find_peaks(correlacion, height=umbral, distance=distancia_minima)
+        
+        # Descartar artefactos muy por encima de los latidos de esta ventana
+        # (relativo a la propia ventana: un cambio de ganancia afecta a todos)
+        if len(picos) >= 3:
+            picos = picos[correlacion[picos] < 4.0 * np.median(correlacion[picos])]
+        
+        return picos, correlacion
+    
+    def _actualizar_estado(self, estado, señal_filtrada, picos, correlacion=None):
+        """
+        Actualiza plantilla, amplitud R y nivel de ruido con los latidos
+        detectados en esta ventana (promedio exponencial)
+        
+        Args:
+            correlacion: Correlación ya calculada con la plantilla anterior
+                (se reutiliza: la plantilla cambia poco entre ventanas)
+        """
+        m = self.medio_qrs
+        picos_validos = picos[(picos >= m) & (picos < len(señal_filtrada) - m)]
+        if len(picos_validos) < 3:
+            return
+        
+        # Plantilla de la ventana: mediana de los QRS alineados
+        segmentos = np.stack([señal_filtrada[p - m:p + m + 1] for p in picos_validos])
+        plantilla = np.median(segmentos, axis=0)
+        plantilla = plantilla - np.mean(plantilla)
+        norma = np.linalg.norm(plantilla)
+        if norma < 1e-9:
+            return
+        plantilla /= norma
+        
+        if estado.plantilla is None:
+            estado.plantilla = plantilla
+        else:
+            mezcla = 0.8 * estado.plantilla + 0.2 * plantilla
+            estado.plantilla = mezcla / np.linalg.norm(mezcla)
+        
+        # Amplitud R y ruido medidos con la plantilla (la nueva si no había)
+        if correlacion is None:
+            correlacion = np.convolve(señal_filtrada, estado.plantilla[::-1], mode='same')
+        amplitud = float(np.median(correlacion[picos_validos]))
+        
+        # Fuera de los QRS: marcas +1/-1 en los bordes y suma acumulada
+        bordes = np.zeros(len(correlacion) + 1, dtype=np.int32)
+        np.add.at(bordes, np.maximum(picos_validos - 2 * m, 0), 1)
+        np.add.at(bordes, np.minimum(picos_validos + 2 * m + 1, len(correlacion)), -1)
+        fuera_qrs = np.abs(correlacion[np.cumsum(bordes[:-1]) == 0])
+        ruido = float(np.percentile(fuera_qrs, 95)) if len(fuera_qrs) else 0.0
+        
+        if estado.amplitud_r is None:
+            estado.amplitud_r, estado.nivel_ruido = amplitud, ruido
+            estado.latidos = float(len(picos))
+        else:
+            estado.amplitud_r = 0.875 * estado.amplitud_r + 0.125 * amplitud
+            estado.nivel_ruido = 0.875 * estado.nivel_ruido + 0.125 * ruido
+            estado.latidos = 0.875 * estado.latidos + 0.125 * len(picos)
+        estado.ventanas += 1
+    
     def calcular_intervalos_rr(self, picos):
         """
         Calcula intervalos R-R (tiempo entre latidos consecutivos)
@@ -198,13 +422,14 @@ class HRVAnalyzer:
         
         return rr_clean
     
-    def analizar(self, señal_ecg, usar_canal='mejor'):
+    def analizar(self, señal_ecg, usar_canal='mejor', paciente_id=None):
         """
         Análisis completo de HR y HRV
         
         Args:
             señal_ecg: Array (N, 3) con canales X, Y, Z o array 1D
             usar_canal: 'x', 'y', 'z', 'mejor' (detecta automáticamente)
+            paciente_id: Si se indica, usa el estado aprendido del paciente
         
         Returns:
             dict con:
@@ -238,7 +463,7 @@ class HRVAnalyzer:
             canal_usado = 'Único'
         
         # Detectar picos R
-        picos = self.detectar_picos_r(señal)
+        picos = self.detectar_picos_r(señal, paciente_id=paciente_id, canal=canal_usado)
         num_picos = len(picos)
         
         # Calcular HR
@@ -438,4 +663,39 @@ if __name__ == "__main__":
         if valor:
             print(f"  {clave}: {valor}")
     
+    # Detector con estado: cambio brusco de ganancia y de ruido
+    print("\n🔁 Detector por paciente ante cambios de ganancia/ruido:")
+    rng = np.random.default_rng(0)
+    t = np.arange(10 * fs) / fs
+    
+    def ventana_ecg(ganancia_qrs=1.0, ruido=0.05, latidos=12):
+        ecg = 0.2 * np.sin(2 * np.pi * 0.3 * t)
+        for centro in (np.arange(latidos) + 0.5) * (10 / latidos):
+            ecg += ganancia_qrs * 1.5 * np.exp(-((t - centro) / 0.012) ** 2)
+            ecg += 0.2 * np.exp(-((t - centro - 0.25) / 0.05) ** 2)  # Onda T
+        return ecg + ruido * rng.standard_normal(len(t))
+    
+    for nombre, cambio in [("ganancia QRS x5", {'ganancia_qrs': 5.0}),
+                           ("ganancia QRS x0.2", {'ganancia_qrs': 0.2}),
+                           ("ruido σ=0.3", {'ruido': 0.3})]:
+        analizador = HRVAnalyzer(frecuencia_muestreo=fs)
+        for _ in range(3):
+            analizador.analizar(ventana_ecg(), paciente_id='prueba')
+        despues = [analizador.analizar(ventana_ecg(**cambio), paciente_id='prueba') for _ in range(4)]
+        latidos = [r['num_picos'] for r in despues]
+        assert all(n >= 11 for n in latidos), (nombre, latidos)
+        assert all(r['hr_bpm'] is not None for r in despues), nombre
+        print(f"  {nombre}: {latidos} latidos (12 reales)")
+    
+    # Artefacto (electrodo suelto) en la primera ventana del paciente: no
+    # debe fijar el umbral ni sembrar una plantilla mala
+    analizador = HRVAnalyzer(frecuencia_muestreo=fs)
+    primera = ventana_ecg()
+    inicio = int(4.1 * fs)
+    primera[inicio:inicio + 15] += 40.0
+    latidos = [analizador.analizar(primera, paciente_id='prueba')['num_picos']]
+    latidos += [analizador.analizar(ventana_ecg(), paciente_id='prueba')['num_picos'] for _ in range(3)]
+    assert all(n >= 11 for n in latidos), ("artefacto en la primera ventana", latidos)
+    print(f"  artefacto en la primera ventana: {latidos} latidos (12 reales)")
+    
     print("\n✅ Módulo funcionando correctamente!")
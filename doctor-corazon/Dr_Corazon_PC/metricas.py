@@ -0,0 +1,236 @@
+# metricas.py - Instrumentación del camino crítico (contadores, gauges, tiempos por etapa)
+#
+# Diseñado para llamarse por muestra/datagrama sin coste apreciable:
+#   - Contadores e histogramas viven en un "shard" por hilo (threading.local,
+#     por greenlet con eventlet), así el hilo de captura nunca toma un lock
+#     para registrar. Los shards de hilos/greenlets terminados se funden en
+#     uno solo al leer y al crear shards nuevos: la memoria no crece con el
+#     número de peticiones atendidas.
+#   - Los gauges son una asignación en un dict (atómica en CPython).
+#   - Solo la lectura (/metrics, /api/control/estado) recorre los shards y suma.
+#
+# Uso:
+#   from metricas import metricas
+#   metricas.contador('datagramas')
+#   with metricas.temporizador('filtro'):
+#       ...
+#   metricas.gauge('buffer_llenado', 0.4)
+
+import time
+import threading
+from bisect import bisect_left
+from concurrencia import crear_lock, eventlet_activo
+
+# Límites de los histogramas de tiempo (segundos), estilo Prometheus.
+# Empiezan en 10 µs para que la decodificación por datagrama no caiga toda en el primer bucket
+BUCKETS_SEG = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    """Métricas acumuladas por un único hilo"""
+
+    def __init__(self):
+        self.contadores = {}
+        self.histogramas = {}  # etapa -> [conteos por bucket..., +Inf], suma, total
+
+
+def _vida_actual():
+    """
+    Returns:
+        Callable() -> bool: True mientras vive el dueño del shard en curso
+    """
+    if eventlet_activo():
+        # threading.local es por greenlet, y current_thread() de un greenlet que
+        # no nació de threading.Thread (peticiones, tareas de socketio) sigue
+        # "vivo" para siempre: la vida del shard es la del greenlet
+        import greenlet
+        return greenlet.getcurrent().__bool__  # False al terminar
+    return threading.current_thread().is_alive
+
+
+class _Temporizador:
+    """Context manager que registra la duración de un bloque en una etapa"""
+
+    __slots__ = ("_metricas", "_etapa", "_inicio")
+
+    def __init__(self, metricas, etapa):
+        self._metricas = metricas
+        self._etapa = etapa
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metricas.observar(self._etapa, time.perf_counter() - self._inicio)
+        return False
+
+
+class Metricas:
+    """
+    Registro de métricas del proceso
+    """
+
+    def __init__(self, prefijo="drcorazon"):
+        self.prefijo = prefijo
+        self._local = threading.local()
+        self._shards = []  # [(vivo: Callable() -> bool, shard)]
+        self._limite_retiro = 64  # Al llegar a tantos shards se funden los terminados
+        self._shards_lock = crear_lock()  # Solo al crear un shard nuevo (una vez por hilo); también desde tpool
+        self._retirado = _Shard()  # Acumulado de hilos ya terminados (ej. hilos de peticiones)
+        self._gauges = {}
+        self.inicio = time.time()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append((_vida_actual(), shard))
+                if len(self._shards) >= self._limite_retiro:
+                    self._retirar()
+                    self._limite_retiro = max(64, 2 * len(self._shards))
+        return shard
+
+    def _retirar(self):
+        """Funde los shards de hilos terminados (llamar con el lock tomado)"""
+        vivos = []
+        for vivo, shard in self._shards:
+            if vivo():
+                vivos.append((vivo, shard))
+            else:
+                self._fundir(self._retirado, shard)
+        self._shards = vivos
+
+    # ============================================================================
+    # REGISTRO (camino crítico)
+    # ============================================================================
+
+    def contador(self, nombre, n=1):
+        """Incrementa un contador monotónico"""
+        c = self._shard().contadores
+        c[nombre] = c.get(nombre, 0) + n
+
+    def gauge(self, nombre, valor):
+        """Fija el valor actual de un gauge"""
+        self._gauges[nombre] = valor
+
+    def observar(self, etapa, segundos):
+        """Registra la duración de una etapa"""
+        h = self._shard().histogramas
+        datos = h.get(etapa)
+        if datos is None:
+            datos = h[etapa] = [[0] * (len(BUCKETS_SEG) + 1), 0.0, 0]
+        datos[0][bisect_left(BUCKETS_SEG, segundos)] += 1
+        datos[1] += segundos
+        datos[2] += 1
+
+    def temporizador(self, etapa):
+        """Context manager: with metricas.temporizador('filtro'): ..."""
+        return _Temporizador(self, etapa)
+
+    # ============================================================================
+    # LECTURA
+    # ============================================================================
+
+    def _agregar(self):
+        """Suma los shards de todos los hilos"""
+        contadores, histogramas = {}, {}
+        with self._shards_lock:
+            # Los shards de hilos terminados ya no cambian: se funden en uno solo
+            self._retirar()
+            shards = [self._retirado] + [shard for _, shard in self._shards]
+        for shard in shards:
+            for nombre, valor in list(shard.contadores.items()):
+                contadores[nombre] = contadores.get(nombre, 0) + valor
+            for etapa, (buckets, suma, total) in list(shard.histogramas.items()):
+                acumulado = histogramas.setdefault(etapa, [[0] * (len(BUCKETS_SEG) + 1), 0.0, 0])
+                for i, n in enumerate(buckets):
+                    acumulado[0][i] += n
+                acumulado[1] += suma
+                acumulado[2] += total
+        return contadores, histogramas
+
+    @staticmethod
+    def _fundir(destino, shard):
+        for nombre, valor in shard.contadores.items():
+            destino.contadores[nombre] = destino.contadores.get(nombre, 0) + valor
+        for etapa, (buckets, suma, total) in shard.histogramas.items():
+            acumulado = destino.histogramas.setdefault(etapa, [[0] * (len(BUCKETS_SEG) + 1), 0.0, 0])
+            for i, n in enumerate(buckets):
+                acumulado[0][i] += n
+            acumulado[1] += suma
+            acumulado[2] += total
+
+    @staticmethod
+    def _percentil(buckets, total, q):
+        """Percentil aproximado (límite superior del bucket)"""
+        if not total:
+            return None
+        objetivo = q * total
+        acumulado = 0
+        for i, n in enumerate(buckets):
+            acumulado += n
+            if acumulado >= objetivo:
+                return BUCKETS_SEG[i] if i < len(BUCKETS_SEG) else float("inf")
+        return None
+
+    def instantanea(self):
+        """
+        Returns:
+            dict: {'contadores', 'gauges', 'etapas': {etapa: total, media_ms, p50_ms, p99_ms}}
+        """
+        contadores, histogramas = self._agregar()
+        etapas = {}
+        for etapa, (buckets, suma, total) in histogramas.items():
+            p50 = self._percentil(buckets, total, 0.50)
+            p99 = self._percentil(buckets, total, 0.99)
+            etapas[etapa] = {
+                'total': total,
+                'media_ms': round(1000 * suma / total, 3) if total else None,
+                'p50_ms': round(1000 * p50, 3) if p50 not in (None, float("inf")) else p50,
+                'p99_ms': round(1000 * p99, 3) if p99 not in (None, float("inf")) else p99,
+            }
+        return {
+            'uptime_seg': round(time.time() - self.inicio, 1),
+            'contadores': contadores,
+            'gauges': dict(self._gauges),
+            'etapas': etapas
+        }
+
+    def prometheus(self):
+        """
+        Returns:
+            str: Métricas en formato de exposición de texto de Prometheus
+        """
+        contadores, histogramas = self._agregar()
+        p = self.prefijo
+        lineas = []
+
+        for nombre, valor in sorted(contadores.items()):
+            lineas.append(f"# TYPE {p}_{nombre}_total counter")
+            lineas.append(f"{p}_{nombre}_total {valor}")
+
+        for nombre, valor in sorted(self._gauges.items()):
+            if valor is None:
+                continue
+            lineas.append(f"# TYPE {p}_{nombre} gauge")
+            lineas.append(f"{p}_{nombre} {float(valor)}")
+
+        if histogramas:
+            lineas.append(f"# TYPE {p}_etapa_segundos histogram")
+        for etapa, (buckets, suma, total) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, n in zip(BUCKETS_SEG, buckets):
+                acumulado += n
+                lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+            lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {total}')
+            lineas.append(f'{p}_etapa_segundos_sum{{etapa="{etapa}"}} {suma}')
+            lineas.append(f'{p}_etapa_segundos_count{{etapa="{etapa}"}} {total}')
+
+        return "\n".join(lineas) + "\n"
+
+
+# Instancia global del proceso (como el cliente `supabase` en supabase_config)
+metricas = Metricas()
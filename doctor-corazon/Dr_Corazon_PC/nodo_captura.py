@@ -0,0 +1,360 @@
+# nodo_captura.py - Servicio de captura e inferencia
+#
+# Recibe UDP de los ESP32, diagnostica cada ventana, persiste (escritor →
+# spool → Supabase) y publica diagnósticos, alertas y la onda en vivo en un
+# bus de eventos (bus_eventos.py). No sirve páginas ni websockets.
+#
+#   - Un solo proceso (por defecto): el servidor web lo arranca en un hilo,
+#     con BusLocal y el estado en memoria.
+#   - Escalado horizontal: se ejecuta aparte y los workers web, sean
+#     cuantos sean, reciben los eventos por la cola de mensajes de
+#     socket.io; modo de captura, vinculaciones dispositivo → paciente,
+#     último diagnóstico y suscripciones viven en el estado compartido.
+#
+# Uso (nodo separado, un Redis para cola y estado):
+#   DR_CORAZON_COLA=redis://localhost:6379/0 python nodo_captura.py
+#   DR_CORAZON_COLA=redis://localhost:6379/0 DR_CORAZON_CAPTURA=remota gunicorn ... (workers web)
+
+import os
+import time
+import threading
+
+import receiver_udp
+from holter_ai import HolterAnalyzer
+from hr_hrv_analyzer import HRVAnalyzer, interpretar_hrv
+from supabase_config import fila_diagnostico, fila_senales_ecg, insertar_lote
+from escritor_diagnosticos import EscritorDiagnosticos
+from spool_local import SpoolLocal, ReplicadorSpool
+from grabador_sesion import GrabadorSesion
+from senales_compactas import forma_onda_binaria
+from onda_viva import EmisorOndaViva
+from metricas import metricas
+from concurrencia import ejecutar_bloqueante
+
+# Configuración
+RUTA_MODELO = "vcg_model_optimized_4classes.h5"
+GUARDAR_SENALES = False  # Guardar la señal XYZ de cada ventana (comprimida, ~20 KB)
+GRABAR_SESION = True     # Archivo continuo crudo + XYZ en disco (memory-mapped)
+DIRECTORIO_GRABACIONES = "grabaciones"
+HORAS_SEGMENTO = float(os.environ.get('DR_CORAZON_HORAS_SEGMENTO', '1'))  # Disco preasignado por segmento
+MAX_SEGMENTOS = int(os.environ.get('DR_CORAZON_MAX_SEGMENTOS', '0')) or None  # Rotación: 0 = sin límite
+RUTA_SPOOL = "spool_dr_corazon.db"
+PUERTO_METRICAS = 9101   # /metrics del nodo cuando corre separado del servidor web
+
+
+def sala_paciente(paciente_id):
+    """Sala socket.io de todos los clientes que monitorean un paciente"""
+    return f'paciente_{paciente_id}'
+
+
+class NodoCaptura:
+    """
+    Captura UDP + inferencia + persistencia, publicando en un bus de eventos
+    """
+
+    def __init__(self, bus, estado, registro, ruta_spool=RUTA_SPOOL):
+        """
+        Args:
+            bus: Destino de los eventos (bus_eventos.BusLocal, BusColaSocketIO, BusMemoria)
+            estado: Estado compartido (estado_compartido.EstadoMemoria o EstadoRedis)
+            registro: Vinculaciones dispositivo → paciente (RegistroDispositivos o su versión Redis)
+            ruta_spool: Archivo SQLite del spool local
+        """
+        self.bus = bus
+        self.estado = estado
+        self.registro = registro
+
+        # Persistencia: captura → cola en memoria → spool local (SQLite WAL) → Supabase
+        # El hilo de captura nunca espera a la BD y nada se pierde si Supabase cae
+        self.spool = SpoolLocal(ruta_spool)
+        # Sin usuario en este hilo: inserta con la clave service_role
+        self.replicador = ReplicadorSpool(
+            self.spool, lambda tabla, filas: insertar_lote(tabla, filas, servicio=True)
+        )
+        self.escritor = EscritorDiagnosticos(
+            lambda filas, senales: ejecutar_bloqueante(self.spool.agregar_lote, "diagnosticos", filas, senales)
+        )
+
+        # Monitor en vivo: bloques de XYZ filtrado ~25 veces/s a los clientes suscritos
+        # al paciente de cada dispositivo, independiente del diagnóstico de 10 s
+        self.onda_viva = EmisorOndaViva(
+            lambda payload, sala: bus.emitir('onda_viva', payload, sala),
+            clave_dispositivo=registro.paciente_de,
+            tasas_por_clave=estado.tasas_onda
+        )
+
+        self.motor_ia = None
+        self.analizador_hrv = None
+        self._hilo = None
+
+    # ============================================================================
+    # CICLO DE VIDA
+    # ============================================================================
+
+    def iniciar(self):
+        """Arranca escritor, replicador, monitor en vivo y el hilo de captura"""
+        self.escritor.iniciar()
+        self.replicador.iniciar()
+        self.onda_viva.iniciar()
+        self._hilo = threading.Thread(target=self.ciclo, name="captura", daemon=True)
+        self._hilo.start()
+
+    def esperar(self):
+        """Bloquea hasta que termine el hilo de captura"""
+        while self._hilo and self._hilo.is_alive():
+            self._hilo.join(timeout=1.0)
+
+    def metricas(self):
+        """
+        Returns:
+            dict: {'persistencia': ..., 'spool': ...} del escritor y el replicador
+        """
+        return {
+            'persistencia': self.escritor.metricas(),
+            'spool': self.replicador.metricas()
+        }
+
+    def publicar_metricas(self):
+        """Deja las métricas de persistencia en el estado compartido (las leen los workers web)"""
+        datos = self.metricas()
+        datos['actualizado'] = time.time()
+        self.estado.fijar(captura=datos)
+
+    # ============================================================================
+    # HILO DE CAPTURA
+    # ============================================================================
+
+    def ciclo(self):
+        """Hilo separado para captura de datos ESP32 - NO bloquea el servidor"""
+        print("\n🚀 Iniciando hilo de captura en background...")
+
+        # Inicializar IA y HRV
+        self.motor_ia = ejecutar_bloqueante(HolterAnalyzer, RUTA_MODELO)
+        self.analizador_hrv = HRVAnalyzer(frecuencia_muestreo=500)
+        print("✅ IA y HRV listos en background\n")
+
+        # Marcar como conectado
+        self.estado.fijar(conectado=True)
+        self.publicar_metricas()
+
+        self.bus.emitir('status', {
+            'message': 'Sistema inicializado',
+            'ia_ready': True,
+            'hrv_ready': True
+        })
+
+        print("👂 Esperando datos ECG desde ESP32...")
+        print(f"   Puerto UDP: {receiver_udp.UDP_PORT}")
+        print(f"   Esperando ventanas de {receiver_udp.WINDOW_SEC}s ({receiver_udp.N_OUT} muestras)\n")
+
+        # Archivo continuo por dispositivo (holter 24 h)
+        inicio_sesion = time.strftime('%Y%m%d_%H%M%S')
+
+        def crear_grabador(dispositivo):
+            if not GRABAR_SESION:
+                return None
+            return GrabadorSesion(
+                os.path.join(DIRECTORIO_GRABACIONES, f"{inicio_sesion}_{dispositivo.replace(':', '_')}"),
+                dispositivo=dispositivo,
+                horas_segmento=HORAS_SEGMENTO,
+                max_segmentos=MAX_SEGMENTOS
+            )
+
+        sin_vincular = set()
+
+        # USAR TU RECEPTOR EASI: un pipeline por dispositivo (IP del ESP32)
+        for dispositivo, datos_hardware in receiver_udp.receive_packets_por_dispositivo(
+                crear_grabador=crear_grabador, vivo=self.onda_viva):
+            capturada = time.time()  # Fin de la ventana: su hora en la BD aunque se guarde tarde
+            self.registro.visto(dispositivo)
+
+            # Verificar si está pausado (las ventanas se descartan, la grabación sigue)
+            if self.estado.obtener('modo_captura') == 'pausado':
+                continue
+
+            # Una lectura de la tabla de enrutamiento por ventana
+            paciente_id = self.registro.paciente_de(dispositivo)
+            if not paciente_id:
+                if dispositivo not in sin_vincular:
+                    print(f"⚠️  Dispositivo {dispositivo} sin paciente vinculado: ventanas sin analizar")
+                    sin_vincular.add(dispositivo)
+                continue
+            sin_vincular.discard(dispositivo)
+
+            self._procesar_ventana(dispositivo, paciente_id, datos_hardware, capturada)
+            self.publicar_metricas()
+
+    def _procesar_ventana(self, dispositivo, paciente_id, datos_hardware, capturada=None):
+        """
+        Diagnostica, persiste y publica una ventana de 10 s para su paciente
+        
+        Args:
+            capturada: Hora (epoch) en que se completó la ventana
+        """
+        sala = sala_paciente(paciente_id)
+
+        # Notificar procesamiento
+        self.bus.emitir('procesando', {
+            'message': 'Analizando señal EASI...',
+            'shape': datos_hardware.shape,
+            'paciente_id': paciente_id
+        }, sala)
+
+        # Análisis
+        start_time = time.time()
+        # CPU (TensorFlow, DSP): en el pool de hilos para no frenar el bucle de eventos
+        with metricas.temporizador('inferencia'):
+            resultado = ejecutar_bloqueante(self.motor_ia.diagnosticar, datos_hardware)
+        with metricas.temporizador('hrv'):
+            resultado_hrv = ejecutar_bloqueante(
+                self.analizador_hrv.analizar, datos_hardware, usar_canal='mejor', paciente_id=paciente_id
+            )
+        end_time = time.time()
+        metricas.contador('diagnosticos')
+
+        tiempo_analisis = end_time - start_time
+
+        if resultado["status"] != "OK":
+            return
+
+        print(f"\n📊 [{dispositivo}] Diagnóstico: {resultado['diagnostico_texto']} | HR: {resultado_hrv['hr_bpm']} BPM")
+
+        t_persistencia = time.perf_counter()
+
+        # Un diagnóstico por ventana, para el paciente del dispositivo (el escritor guarda por lotes)
+        try:
+            self.escritor.encolar(fila_diagnostico(
+                paciente_id=paciente_id,
+                diagnostico=resultado['diagnostico_texto'],
+                probabilidades=resultado['detalles'],
+                tiempo_analisis=tiempo_analisis,
+                alerta_critica=resultado.get('alerta_infarto', False),
+                notas=f"Dispositivo: {dispositivo} | EASI->XYZ",
+                hr_bpm=resultado_hrv['hr_bpm'],
+                hrv_sdnn=resultado_hrv['hrv_sdnn'],
+                hrv_rmssd=resultado_hrv['hrv_rmssd'],
+                hrv_pnn50=resultado_hrv['hrv_pnn50'],
+                num_picos_r=resultado_hrv['num_picos'],
+                timestamp=capturada
+            ), fila_senales_ecg(None, datos_hardware) if GUARDAR_SENALES else None)
+        except Exception as e:
+            print(f"❌ Error encolando diagnóstico de {dispositivo}: {e}")
+
+        metricas.observar('persistencia', time.perf_counter() - t_persistencia)
+
+        # Preparar payload
+        interpretacion_hrv = interpretar_hrv(
+            resultado_hrv['hrv_sdnn'],
+            resultado_hrv['hrv_rmssd'],
+            resultado_hrv['hrv_pnn50']
+        )
+
+        payload = {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'paciente_id': paciente_id,
+            'dispositivo': dispositivo,
+            'diagnostico': resultado['diagnostico_texto'],
+            'probabilidades': resultado['detalles'],
+            'tiempo_analisis': round(tiempo_analisis, 3),
+            'alerta': resultado.get('alerta_infarto', False),
+            'hr_bpm': resultado_hrv['hr_bpm'],
+            'hr_clasificacion': resultado_hrv['clasificacion_hr'],
+            'hrv_sdnn': resultado_hrv['hrv_sdnn'],
+            'hrv_rmssd': resultado_hrv['hrv_rmssd'],
+            'hrv_pnn50': resultado_hrv['hrv_pnn50'],
+            'num_picos': resultado_hrv['num_picos'],
+            'calidad_señal': resultado_hrv['calidad'],
+            'interpretacion_hrv': interpretacion_hrv,
+            'picos_indices': resultado_hrv['picos_indices'].tolist(),
+            # Envolvente min/max en int16: viaja como adjunto binario de socket.io
+            'forma_onda': forma_onda_binaria(datos_hardware, 500),
+        }
+
+        t_emision = time.perf_counter()
+
+        # Una emisión a la sala del paciente: el paquete (forma de onda binaria
+        # incluida) se codifica una sola vez sin importar cuántos clientes miran
+        self.bus.emitir('diagnostico', payload, sala)
+
+        # Si hay alerta, emitir alerta también
+        if resultado.get('alerta_infarto', False):
+            self.bus.emitir('alerta_critica', {
+                'tipo': 'infarto',
+                'mensaje': 'ALERTA: Posible infarto',
+                'hr_bpm': resultado_hrv['hr_bpm'],
+                'paciente_id': paciente_id
+            }, sala)
+            metricas.contador('alertas_emitidas')
+
+        metricas.observar('emision', time.perf_counter() - t_emision)
+
+        self.estado.guardar_ultimo_diagnostico(paciente_id, payload)
+
+
+# ============================================================================
+# MÉTRICAS DEL NODO SEPARADO
+# ============================================================================
+
+def servir_metricas(nodo, puerto=PUERTO_METRICAS):
+    """Sirve /metrics (formato Prometheus) del nodo en un hilo daemon"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            datos = nodo.metricas()
+            metricas.gauge('cola_persistencia', datos['persistencia']['profundidad_cola'])
+            metricas.gauge('persistencia_descartados', datos['persistencia']['descartados'])
+            metricas.gauge('persistencia_reintentos', datos['persistencia']['reintentos'])
+            metricas.gauge('spool_pendientes', datos['spool']['pendientes'])
+            metricas.gauge('spool_descartados', datos['spool']['descartados'])
+            metricas.gauge('spool_rechazados', datos['spool']['rechazados'])
+            metricas.gauge('spool_antiguedad_seg', datos['spool']['antiguedad_max_seg'])
+            cuerpo = metricas.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass  # Prometheus consulta cada pocos segundos: sin log por petición
+
+    servidor = ThreadingHTTPServer(('0.0.0.0', puerto), _Manejador)
+    threading.Thread(target=servidor.serve_forever, name="metricas_http", daemon=True).start()
+    return servidor
+
+
+# ============================================================================
+# SERVICIO SEPARADO
+# ============================================================================
+
+if __name__ == "__main__":
+    from bus_eventos import crear_bus
+    from estado_compartido import crear_estado, url_estado
+    from registro_dispositivos import crear_registro
+
+    url_cola = os.environ.get('DR_CORAZON_COLA')
+    url_compartido = url_estado(url_cola)
+    if not url_cola or not url_compartido:
+        raise SystemExit(
+            "❌ El nodo separado necesita DR_CORAZON_COLA (cola de socket.io) y un estado "
+            "compartido (Redis en la cola o DR_CORAZON_ESTADO). En un solo proceso basta "
+            "con python app_supabase_auth_v2.py"
+        )
+
+    print("\n" + "=" * 60)
+    print("🫀 Dr Corazón - Nodo de captura e inferencia")
+    print("=" * 60)
+    print(f"   Cola de eventos: {url_cola}")
+    print(f"   Estado compartido: {url_compartido}")
+
+    nodo = NodoCaptura(crear_bus(url_cola), crear_estado(url_compartido), crear_registro(url_compartido))
+    puerto = int(os.environ.get('DR_CORAZON_PUERTO_METRICAS', PUERTO_METRICAS))
+    servir_metricas(nodo, puerto)
+    print(f"   Métricas: http://localhost:{puerto}/metrics\n")
+
+    nodo.iniciar()
+    nodo.esperar()
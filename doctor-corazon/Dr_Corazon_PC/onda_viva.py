@@ -0,0 +1,313 @@
+# onda_viva.py - Canal de forma de onda en vivo (monitor desplazable)
+#
+# Independiente del diagnóstico de 10 s: el hilo de captura entrega cada
+# datagrama decodificado y un hilo emisor, ~25 veces por segundo:
+#   filtra de forma causal (mismo pasabanda + notch que receiver_udp, con
+#   estado entre bloques) → EASI→XYZ → decima ×3 (~284 Hz) → int16
+# y emite a las salas de suscriptores según la tasa elegida por cada
+# cliente (25, 10 o 5 envíos/s; a menor tasa, bloques más largos).
+#
+# Cada dispositivo tiene su propio estado de filtro; con clave_dispositivo
+# (ej. el paciente vinculado) cada flujo va solo a las salas de su paciente.
+# Sin suscriptores el hilo de captura solo hace una comprobación y retorna.
+#
+# Con el nodo de captura separado de los workers web las suscripciones
+# viven en el estado compartido (tasas_por_clave); el hilo emisor las
+# consulta una vez por ciclo, nunca por datagrama.
+
+import time
+import threading
+from collections import deque
+
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi, tf2sos
+
+from receiver_udp import FS_IN, SOS_BP, B_NOTCH, A_NOTCH
+
+TASAS_HZ = (25, 10, 5)
+DECIMACION = 3  # 853 Hz → 284 Hz; el pasabanda ya corta en 40 Hz (sin aliasing)
+_MAX_INT16 = 32767
+
+# Pasabanda + notch en una sola cascada de secciones de 2º orden
+SOS_VIVO = np.vstack([SOS_BP, tf2sos(B_NOTCH, A_NOTCH)])
+
+# Matriz EASI → XYZ (misma que receiver_udp._process_packet)
+EASI_A_XYZ = np.array([
+    [0.068, -0.022, 0.794],
+    [0.004, 1.056, -0.900],
+    [-0.650, 0.418, -0.421]
+], dtype=np.float64)
+
+
+def tasa_permitida(hz, tasas=TASAS_HZ):
+    """Tasa de envío permitida más cercana a la pedida"""
+    return min(tasas, key=lambda t: abs(t - float(hz)))
+
+
+def sala_onda_viva(hz, clave=None):
+    """Nombre de la sala socket.io para una tasa de envío (y paciente, si aplica)"""
+    return f'onda_viva_{clave}_{hz}' if clave else f'onda_viva_{hz}'
+
+
+class _Flujo:
+    """Estado de un dispositivo: entrada pendiente, filtro causal y bloques por tasa"""
+
+    def __init__(self, tasas):
+        self.entrada = deque()
+        self.muestras_entrada = 0
+        self.pendiente = {hz: [] for hz in tasas}
+        self.ultimo_envio = {hz: 0.0 for hz in tasas}
+        self.reiniciar()
+
+    def reiniciar(self):
+        # Estado del filtro causal (se inicializa con la primera muestra)
+        self.zi = None
+        self.fase = 0             # Desfase de la decimación entre bloques
+        self.muestras_salida = 0  # Para el eje de tiempo continuo del cliente
+        for bloques in self.pendiente.values():
+            bloques.clear()
+
+
+class EmisorOndaViva:
+    """
+    Filtra y reparte la forma de onda en vivo a los clientes suscritos
+    """
+
+    def __init__(self, funcion_emitir, clave_dispositivo=None, fs=FS_IN, tasas=TASAS_HZ,
+                 max_pendiente_seg=2.0, tasas_por_clave=None):
+        """
+        Args:
+            funcion_emitir: Callable(payload, sala) que envía a una sala socket.io
+            clave_dispositivo: Callable(dispositivo) → clave de suscripción (ej.
+                el paciente vinculado); None si el dispositivo no se emite.
+                Por defecto todos los dispositivos comparten la clave None.
+            fs: Hz de las muestras EASI crudas
+            tasas: Tasas de envío permitidas (Hz); la mayor marca el ritmo del hilo
+            max_pendiente_seg: Muestras crudas máximas retenidas si el emisor se atrasa
+            tasas_por_clave: Callable() → {clave: set(hz)} con las suscripciones
+                de otro lugar (ej. estado compartido entre procesos). Por
+                defecto, las registradas con suscribir().
+        """
+        self.funcion_emitir = funcion_emitir
+        self.clave_dispositivo = clave_dispositivo or (lambda dispositivo: None)
+        self.fs = fs
+        self.fs_salida = fs / DECIMACION
+        self.tasas = tuple(sorted(tasas, reverse=True))
+        self._max_pendiente = int(max_pendiente_seg * fs)
+
+        self._lock = threading.Lock()
+        self._suscriptores = {}  # sid -> (clave, hz)
+        self._tasas_por_clave = tasas_por_clave or self._tasas_propias
+        self._hay_suscriptores = False  # Lo actualiza el hilo emisor; lo lee agregar()
+        self._flujos = {}        # dispositivo -> _Flujo (solo el hilo de captura agrega)
+
+        self._activo = False
+        self._hilo = None
+
+    # ============================================================================
+    # SUSCRIPCIONES
+    # ============================================================================
+
+    def suscribir(self, sid, hz=25, clave=None):
+        """
+        Returns:
+            int: Tasa asignada (la permitida más cercana a la pedida)
+        """
+        hz = tasa_permitida(hz, self.tasas)
+        with self._lock:
+            self._suscriptores[sid] = (clave, hz)
+        self._hay_suscriptores = True
+        return hz
+
+    def desuscribir(self, sid):
+        """
+        Returns:
+            tuple: (clave, hz) que tenía el cliente (None si no estaba suscrito)
+        """
+        with self._lock:
+            return self._suscriptores.pop(sid, None)
+
+    def _tasas_propias(self):
+        with self._lock:
+            tasas_por_clave = {}
+            for clave, hz in self._suscriptores.values():
+                tasas_por_clave.setdefault(clave, set()).add(hz)
+        return tasas_por_clave
+
+    # ============================================================================
+    # ENTRADA (hilo de captura)
+    # ============================================================================
+
+    def agregar(self, muestras, dispositivo=None):
+        """
+        Entrega las muestras de un datagrama. Sin suscriptores no hace nada.
+
+        Args:
+            muestras: Lista de tuplas (ES, AS, AI, ALAB)
+            dispositivo: Dispositivo de origen
+        """
+        if not self._hay_suscriptores or not muestras:
+            return
+        flujo = self._flujos.get(dispositivo)
+        if flujo is None:
+            flujo = self._flujos[dispositivo] = _Flujo(self.tasas)
+        flujo.entrada.append(muestras)
+        flujo.muestras_entrada += len(muestras)
+        # Si el emisor se atrasa se descarta lo más viejo (es un monitor, no un registro)
+        while flujo.muestras_entrada > self._max_pendiente and flujo.entrada:
+            flujo.muestras_entrada -= len(flujo.entrada.popleft())
+
+    # ============================================================================
+    # HILO EMISOR
+    # ============================================================================
+
+    def iniciar(self):
+        self._activo = True
+        self._hilo = threading.Thread(target=self._ciclo, name="onda_viva", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._activo = False
+        if self._hilo:
+            self._hilo.join(timeout=2.0)
+
+    @staticmethod
+    def _tomar_entrada(flujo):
+        bloques = []
+        while flujo.entrada:
+            bloque = flujo.entrada.popleft()
+            flujo.muestras_entrada -= len(bloque)
+            bloques.extend(bloque)
+        return bloques
+
+    @staticmethod
+    def procesar(flujo, crudo):
+        """
+        Filtra de forma causal y decima un bloque de muestras crudas
+
+        Args:
+            flujo: Estado del dispositivo (filtro y fase de decimación)
+            crudo: Array (n, 4) con ES, AS, AI, ALAB
+
+        Returns:
+            np.ndarray: (m, 3) float32 con X, Y, Z a fs / DECIMACION
+        """
+        easi = np.asarray(crudo, dtype=np.float64)[:, :3]
+        if flujo.zi is None:
+            # Arranque sin transitorio: el filtro parte del nivel de la primera muestra
+            flujo.zi = sosfilt_zi(SOS_VIVO)[:, :, None] * easi[0][None, None, :]
+        filtrada, flujo.zi = sosfilt(SOS_VIVO, easi, axis=0, zi=flujo.zi)
+
+        xyz = filtrada @ EASI_A_XYZ.T
+        decimada = xyz[flujo.fase::DECIMACION]
+        flujo.fase = (flujo.fase - len(xyz)) % DECIMACION
+        return decimada.astype(np.float32)
+
+    def _payload(self, bloques):
+        """Concatena bloques (t0, xyz) y cuantiza a int16 con escala por canal"""
+        t0 = bloques[0][0]
+        xyz = np.concatenate([b for _, b in bloques])
+        escalas = np.max(np.abs(xyz), axis=0) / _MAX_INT16
+        escalas[escalas == 0] = 1.0
+        return {
+            'datos': np.round(xyz / escalas).astype('<i2').tobytes(),
+            'escalas': [float(e) for e in escalas],
+            'puntos': len(xyz),
+            'canales': 3,
+            't0': t0,
+            'dt': 1.0 / self.fs_salida
+        }
+
+    def _ciclo(self):
+        periodo = 1.0 / self.tasas[0]
+        while self._activo:
+            inicio = time.monotonic()
+
+            # Tasas pedidas por clave (paciente)
+            try:
+                tasas_por_clave = self._tasas_por_clave()
+            except Exception as e:
+                print(f"⚠️  Error leyendo suscripciones de onda en vivo: {e}")
+                tasas_por_clave = {}
+            self._hay_suscriptores = bool(tasas_por_clave)
+
+            for dispositivo, flujo in list(self._flujos.items()):
+                crudo = self._tomar_entrada(flujo)
+                clave = self.clave_dispositivo(dispositivo)
+                tasas_activas = tasas_por_clave.get(clave, set())
+
+                if not tasas_activas:
+                    # Sin clientes: el filtro se reinicia al volver a suscribirse
+                    flujo.reiniciar()
+                    continue
+
+                for hz in self.tasas:
+                    if hz not in tasas_activas:
+                        flujo.pendiente[hz].clear()
+
+                if crudo:
+                    xyz = self.procesar(flujo, crudo)
+                    t0 = flujo.muestras_salida / self.fs_salida
+                    flujo.muestras_salida += len(xyz)
+                    if len(xyz):
+                        for hz in tasas_activas:
+                            flujo.pendiente[hz].append((t0, xyz))
+
+                for hz in tasas_activas:
+                    if flujo.pendiente[hz] and inicio - flujo.ultimo_envio[hz] >= 1.0 / hz - 1e-3:
+                        try:
+                            self.funcion_emitir(self._payload(flujo.pendiente[hz]), sala_onda_viva(hz, clave))
+                        except Exception as e:
+                            print(f"⚠️  Error emitiendo onda en vivo ({dispositivo}, {hz} Hz): {e}")
+                        flujo.pendiente[hz].clear()
+                        flujo.ultimo_envio[hz] = inicio
+
+            time.sleep(max(0.0, periodo - (time.monotonic() - inicio)))
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    from simulador_udp import generar_easi, empaquetar
+
+    print("📺 Onda en vivo")
+    print("=" * 50)
+
+    recibidos = {}
+
+    def emitir(payload, sala):
+        recibidos.setdefault(sala, []).append(payload)
+
+    emisor = EmisorOndaViva(emitir)
+    emisor.suscribir("cliente_rapido", 25)
+    emisor.suscribir("cliente_lento", 4)
+    emisor.iniciar()
+
+    # 2 s de señal a tiempo real, datagrama a datagrama
+    muestras = generar_easi(2.0)
+    for d in empaquetar(muestras):
+        lineas = d.decode().splitlines()
+        emisor.agregar([tuple(int(v) for v in l.split()) for l in lineas])
+        time.sleep(len(lineas) / FS_IN)
+    time.sleep(0.3)
+    emisor.detener()
+
+    for sala, paquetes in sorted(recibidos.items()):
+        puntos = sum(p['puntos'] for p in paquetes)
+        print(f"  {sala}: {len(paquetes)} envíos, {puntos} puntos, "
+              f"{np.mean([len(p['datos']) for p in paquetes]):.0f} bytes/envío")
+
+    # Ambas tasas reciben la misma señal (mismos puntos), en bloques distintos
+    puntos_rapido = sum(p['puntos'] for p in recibidos[sala_onda_viva(25)])
+    puntos_lento = sum(p['puntos'] for p in recibidos[sala_onda_viva(5)])
+    assert len(recibidos[sala_onda_viva(25)]) > 2 * len(recibidos[sala_onda_viva(5)])
+    assert abs(puntos_rapido - puntos_lento) <= 3 * DECIMACION * 40
+
+    # Decimación continua entre bloques: el eje de tiempo no tiene saltos
+    p = recibidos[sala_onda_viva(25)]
+    for a, b in zip(p, p[1:]):
+        assert abs(a['t0'] + a['puntos'] * a['dt'] - b['t0']) < 1e-9
+
+    print("\n✅ Módulo funcionando correctamente!")
@@ -0,0 +1,169 @@
+# paginacion.py - Paginación por cursor (keyset), proyección de columnas y ETag
+#
+# Paginación keyset: en lugar de OFFSET (que recorre y descarta todas las
+# filas anteriores) cada página pide "las filas después de la última vista"
+# por (marca de tiempo, id), una búsqueda en el índice compuesto. El coste de
+# la página 1 y la página 500 es el mismo.
+#
+# El cursor es opaco para el cliente: base64 de la clave de la última fila.
+#
+# Uso:
+#   consulta = supabase.table('diagnosticos').select(columnas).eq('paciente_id', pid)
+#   filas, siguiente = paginar(consulta, request.args.get('cursor'), limite, ('timestamp', 'id'))
+
+import json
+import base64
+import hashlib
+
+LIMITE_MAX = 500
+
+
+class CursorInvalido(ValueError):
+    """El cursor recibido no se puede decodificar"""
+
+
+def codificar_cursor(fila, orden):
+    """
+    Args:
+        fila: Última fila de la página
+        orden: Columnas de la clave (ej. ('timestamp', 'id'))
+
+    Returns:
+        str: Cursor opaco (base64 url-safe)
+    """
+    clave = [fila[c] for c in orden]
+    return base64.urlsafe_b64encode(json.dumps(clave).encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor, orden):
+    """
+    Returns:
+        list: Valores de la clave, en el orden de `orden`
+
+    Raises:
+        CursorInvalido: Si el cursor no es válido
+    """
+    try:
+        clave = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise CursorInvalido("Cursor inválido")
+    if not isinstance(clave, list) or len(clave) != len(orden):
+        raise CursorInvalido("Cursor inválido")
+    return clave
+
+
+def _valor(v):
+    """Valor para un filtro PostgREST (comillas: fechas con '+' y ':')"""
+    return f'"{v}"' if isinstance(v, str) else str(v)
+
+
+def paginar(consulta, cursor, limite, orden, desc=True):
+    """
+    Ejecuta una página keyset de una consulta de postgrest
+
+    Args:
+        consulta: Consulta con select() y filtros ya aplicados
+        cursor: Cursor de la página anterior (None = primera página)
+        limite: Filas por página (se acota a LIMITE_MAX)
+        orden: Dos columnas de la clave, la segunda única (ej. ('timestamp', 'id'))
+        desc: Más recientes primero
+
+    Returns:
+        tuple: (filas, cursor de la siguiente página o None)
+
+    Raises:
+        CursorInvalido: Si el cursor no es válido
+    """
+    limite = max(1, min(int(limite), LIMITE_MAX))
+    col1, col2 = orden
+    if cursor:
+        v1, v2 = decodificar_cursor(cursor, orden)
+        op = 'lt' if desc else 'gt'
+        consulta = consulta.or_(
+            f"{col1}.{op}.{_valor(v1)},and({col1}.eq.{_valor(v1)},{col2}.{op}.{_valor(v2)})"
+        )
+    # Una fila de más indica si hay otra página sin un COUNT aparte
+    filas = consulta.order(col1, desc=desc).order(col2, desc=desc).limit(limite + 1).execute().data
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, codificar_cursor(filas[-1], orden)
+
+
+def proyeccion(pedidas, permitidas, por_defecto):
+    """
+    Columnas a seleccionar a partir de ?campos=a,b (solo las permitidas)
+
+    Args:
+        pedidas: Texto "a,b,c" del cliente o None
+        permitidas: Columnas que el cliente puede pedir
+        por_defecto: Columnas si no pide ninguna
+
+    Returns:
+        list: Columnas a seleccionar
+    """
+    if not pedidas:
+        return list(por_defecto)
+    columnas = [c.strip() for c in pedidas.split(',') if c.strip() in permitidas]
+    return columnas or list(por_defecto)
+
+
+def etag(*partes):
+    """ETag fuerte a partir de una versión de los datos y los parámetros de la consulta"""
+    return hashlib.sha1(json.dumps(partes, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    print("📑 Paginación keyset")
+    print("=" * 50)
+
+    orden = ('timestamp', 'id')
+    fila = {'timestamp': '2026-10-19T10:00:00+00:00', 'id': 8640}
+    cursor = codificar_cursor(fila, orden)
+    assert decodificar_cursor(cursor, orden) == ['2026-10-19T10:00:00+00:00', 8640]
+    try:
+        decodificar_cursor("no-es-un-cursor", orden)
+        raise AssertionError("Debió fallar")
+    except CursorInvalido:
+        pass
+
+    class _Consulta:
+        """Consulta de postgrest en memoria: solo lo que usa paginar()"""
+
+        def __init__(self, filas):
+            self.filas = filas
+            self.filtro = None
+
+        def or_(self, filtro):
+            self.filtro = filtro
+            return self
+
+        def order(self, col, desc=False):
+            return self
+
+        def limit(self, n):
+            self.n = n
+            return self
+
+        def execute(self):
+            self.data = self.filas[:self.n]
+            return self
+
+    filas = [{'timestamp': f'2026-10-19T10:{59 - i:02d}:00+00:00', 'id': 100 - i} for i in range(30)]
+    pagina, siguiente = paginar(_Consulta(filas), None, 20, orden)
+    assert len(pagina) == 20 and siguiente == codificar_cursor(pagina[-1], orden)
+    consulta = _Consulta(filas[20:])
+    pagina, siguiente = paginar(consulta, siguiente, 20, orden)
+    assert len(pagina) == 10 and siguiente is None
+    assert consulta.filtro == ('timestamp.lt."2026-10-19T10:40:00+00:00",'
+                               'and(timestamp.eq."2026-10-19T10:40:00+00:00",id.lt.81)')
+    print(f"  Filtro keyset: {consulta.filtro}")
+
+    assert proyeccion("id,hr_bpm,password", {'id', 'hr_bpm'}, ['id']) == ['id', 'hr_bpm']
+    assert etag('p1', 10, None) == etag('p1', 10, None) != etag('p1', 11, None)
+
+    print("\n✅ Módulo funcionando correctamente!")
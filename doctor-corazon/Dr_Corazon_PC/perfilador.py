@@ -0,0 +1,214 @@
+# perfilador.py - Perfilador por muestreo activable en caliente
+#
+# Un hilo muestreador lee sys._current_frames() cada pocos milisegundos
+# durante N segundos y acumula las pilas de los hilos de interés
+# (captura, peticiones Flask). El resultado está en formato "collapsed
+# stacks" (una línea "hilo;f1;f2;...;fn conteo"), listo para
+# flamegraph.pl, speedscope.app o inferno.
+#
+# Con eventlet las peticiones y la captura son green threads de un solo
+# hilo del SO y sys._current_frames() solo ve la pila del greenlet que corre
+# en ese momento. Por eso el muestreador va en un hilo real (tpool) y un
+# greenlet.settrace() anota qué greenlet está en ejecución: cada muestra del
+# hilo del bucle de eventos se atribuye a su green thread por nombre.
+#
+# Sin perfilado activo no existe el hilo muestreador ni hay ganchos en el
+# código medido: el coste es cero.
+#
+# Uso:
+#   from perfilador import perfilar
+#   texto = perfilar(segundos=10, filtro_hilos=['captura'])
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+INTERVALO_SEG = 0.005   # 200 muestras/s por hilo
+MAX_SEGUNDOS = 120      # Límite para no dejar un perfil corriendo indefinidamente
+
+_perfil_lock = threading.Lock()  # Un solo perfil a la vez
+
+
+class PerfilEnCurso(RuntimeError):
+    """Ya hay un perfil en ejecución"""
+
+
+def _etiqueta(frame):
+    """Nombre de un marco: funcion (archivo.py:linea de definición)"""
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _pila(frame):
+    """Pila de un hilo desde la raíz hasta el marco actual"""
+    marcos = []
+    while frame is not None:
+        marcos.append(_etiqueta(frame))
+        frame = frame.f_back
+    marcos.reverse()
+    return marcos
+
+
+def _eventlet_activo():
+    """True si eventlet.monkey_patch() convirtió los hilos en green threads"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+def muestrear(segundos, intervalo=INTERVALO_SEG, filtro_hilos=None):
+    """
+    Muestrea las pilas de los hilos (o green threads con eventlet) durante un tiempo
+
+    Args:
+        segundos: Duración del muestreo
+        intervalo: Segundos entre muestras
+        filtro_hilos: Lista de subcadenas de nombre de hilo a incluir
+            (None = todos salvo el hilo que muestrea)
+
+    Returns:
+        tuple: (Counter {pila_colapsada: muestras}, número de muestras tomadas)
+    """
+    if _eventlet_activo():
+        return _muestrear_greenlets(segundos, intervalo, filtro_hilos)
+
+    propio = threading.get_ident()
+    excluidos = {propio}
+    fin = time.monotonic() + segundos
+    pilas = Counter()
+    n = 0
+
+    while time.monotonic() < fin:
+        nombres = {h.ident: h.name for h in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in excluidos:
+                continue
+            nombre = nombres.get(ident, str(ident))
+            if filtro_hilos and not any(f in nombre for f in filtro_hilos):
+                continue
+            pilas[";".join([nombre] + _pila(frame))] += 1
+        n += 1
+        time.sleep(intervalo)
+
+    return pilas, n
+
+
+def _muestrear_greenlets(segundos, intervalo, filtro_hilos):
+    """
+    muestrear() con eventlet: muestrea desde un hilo real del pool de eventlet
+    y atribuye la pila del hilo del bucle de eventos al greenlet en ejecución
+    """
+    import greenlet
+    from eventlet import hubs, patcher, tpool
+
+    hilos_so = patcher.original('threading')
+    tiempo_so = patcher.original('time')
+    hilo_bucle = hilos_so.get_ident()   # Hilo del SO de los green threads
+    en_curso = [greenlet.getcurrent()]
+
+    def anotar(evento, args):
+        if evento in ('switch', 'throw'):
+            en_curso[0] = args[1]  # (origen, destino)
+
+    def bucle():
+        propio = hilos_so.get_ident()
+        fin = tiempo_so.monotonic() + segundos
+        muestras = Counter()
+        n = 0
+        while tiempo_so.monotonic() < fin:
+            nombres = {h.ident: h.name for h in hilos_so.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                hilo = en_curso[0] if ident == hilo_bucle else nombres.get(ident, str(ident))
+                muestras[(hilo, tuple(_pila(frame)))] += 1
+            n += 1
+            tiempo_so.sleep(intervalo)
+        return muestras, n
+
+    anterior = greenlet.settrace(anotar)
+    try:
+        muestras, n = tpool.execute(bucle)
+    finally:
+        greenlet.settrace(anterior)
+
+    # Nombres de los green threads (su ident es el id del greenlet)
+    nombres = {h.ident: h.name for h in threading.enumerate()}
+    hub = hubs.get_hub().greenlet
+    pilas = Counter()
+    for (hilo, pila), conteo in muestras.items():
+        if not isinstance(hilo, str):
+            hilo = "hub" if hilo is hub else nombres.get(id(hilo), f"greenlet-{id(hilo)}")
+        if filtro_hilos and not any(f in hilo for f in filtro_hilos):
+            continue
+        pilas[";".join((hilo,) + pila)] += conteo
+    return pilas, n
+
+
+def colapsar(pilas):
+    """
+    Returns:
+        str: Pilas en formato collapsed (ordenadas de mayor a menor)
+    """
+    return "".join(f"{pila} {conteo}\n" for pila, conteo in pilas.most_common())
+
+
+def perfilar(segundos=10, intervalo=INTERVALO_SEG, filtro_hilos=None):
+    """
+    Ejecuta un perfil completo y devuelve el archivo collapsed
+
+    Raises:
+        PerfilEnCurso: Si ya hay otro perfil en ejecución
+
+    Returns:
+        str: Pilas colapsadas
+    """
+    segundos = max(0.1, min(float(segundos), MAX_SEGUNDOS))
+    if not _perfil_lock.acquire(blocking=False):
+        raise PerfilEnCurso("Ya hay un perfil en ejecución")
+    try:
+        pilas, n = muestrear(segundos, intervalo, filtro_hilos)
+    finally:
+        _perfil_lock.release()
+
+    print(f"🔬 Perfil: {n} muestras en {segundos:.1f}s, {len(pilas)} pilas distintas")
+    return colapsar(pilas)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    # python perfilador.py --eventlet: la misma prueba con green threads
+    if "--eventlet" in sys.argv:
+        import eventlet
+        eventlet.monkey_patch()
+
+    import numpy as np
+
+    print("🔬 Perfilador por muestreo" + (" (eventlet)" if _eventlet_activo() else ""))
+    print("=" * 50)
+
+    def trabajo_caliente():
+        x = np.random.standard_normal(200_000)
+        for _ in range(10**6):
+            np.sort(x)
+            time.sleep(0)  # Con eventlet cede el bucle; sin eventlet no hace nada
+
+    def trabajo_frio():
+        time.sleep(60)
+
+    threading.Thread(target=trabajo_caliente, name="captura", daemon=True).start()
+    threading.Thread(target=trabajo_frio, name="inactivo", daemon=True).start()
+
+    texto = perfilar(segundos=1.0, filtro_hilos=["captura"])
+    print(texto[:500])
+    assert texto and all(linea.startswith("captura;") for linea in texto.splitlines())
+    assert "trabajo_caliente" in texto
+
+    print("\n✅ Módulo funcionando correctamente!")
@@ -0,0 +1,346 @@
+# pool_supabase.py - Conexiones a PostgREST compartidas y sin estado de sesión
+#
+# El Client de supabase-py guarda la sesión: sign_in_with_password cambia el
+# Authorization de todas las consultas siguientes, de cualquier hilo. Aquí las
+# tablas se consultan con un único httpx.Client (seguro entre hilos) que:
+#   - mantiene conexiones keep-alive (HTTP/2 si está instalado `h2`: muchas
+#     peticiones multiplexadas por conexión)
+#   - pone el Authorization de cada petición según quien la hace: el token
+#     del usuario de la petición actual (con_token). Sin token la petición
+#     falla (SinCredenciales): nunca sale en silencio con la clave anon.
+#   - limita las peticiones simultáneas y aplica timeouts configurables
+#
+# Los trabajos del servidor sin usuario (spool, exportaciones del admin,
+# re-análisis) usan un pool aparte con la clave service_role (clave_servicio):
+# todas sus peticiones llevan esa clave, explícitamente.
+#
+# El Client de supabase-py queda solo para Supabase Auth (login/registro).
+#
+# Uso:
+#   pool = PoolSupabase(SUPABASE_URL, SUPABASE_KEY, max_concurrentes=16)
+#   repo = RepositorioSupabase(pool)
+#   with con_token(session['access_token']):
+#       repo.listar_pacientes(user_id)
+#
+#   pool_servicio = PoolSupabase(SUPABASE_URL, SUPABASE_KEY, clave_servicio=SUPABASE_SERVICE_KEY)
+
+import time
+import threading
+from contextlib import contextmanager
+
+import httpx
+from postgrest import SyncPostgrestClient
+
+from metricas import metricas
+
+# Token de la petición en curso (threading.local es por green thread con eventlet)
+_contexto = threading.local()
+
+
+class SinCredenciales(PermissionError):
+    """Consulta a PostgREST sin token de usuario ni clave de servicio"""
+
+
+def fijar_token(token):
+    """Token JWT del usuario para las consultas de este hilo (None = sin usuario: fallan)"""
+    _contexto.token = token
+
+
+def token_actual():
+    return getattr(_contexto, 'token', None)
+
+
+@contextmanager
+def con_token(token):
+    """Consultas dentro del bloque con el token del usuario"""
+    anterior = token_actual()
+    fijar_token(token)
+    try:
+        yield
+    finally:
+        fijar_token(anterior)
+
+
+class _Transporte(httpx.BaseTransport):
+    """
+    Transporte compartido: Authorization de cada petición (token del hilo o
+    clave de servicio fija), máximo de peticiones en vuelo y métricas de latencia.
+    El Authorization se pone aquí y no como httpx.Auth del cliente porque
+    postgrest-py pasa auth explícito en cada petición.
+    """
+
+    def __init__(self, transporte, max_concurrentes, espera_max, clave_servicio=None):
+        self._transporte = transporte
+        self._clave_servicio = clave_servicio
+        self._cupos = threading.BoundedSemaphore(max_concurrentes)
+        self._espera_max = espera_max
+        self._lock = threading.Lock()
+        self.en_curso = 0
+        self.rechazadas = 0
+
+    def handle_request(self, request):
+        token = self._clave_servicio or token_actual()
+        if not token:
+            raise SinCredenciales("Consulta a Supabase sin token de usuario (con_token) ni clave de servicio")
+        request.headers['Authorization'] = f"Bearer {token}"
+        inicio = time.perf_counter()
+        if not self._cupos.acquire(timeout=self._espera_max):
+            with self._lock:
+                self.rechazadas += 1
+            raise httpx.PoolTimeout("Límite de peticiones simultáneas a Supabase", request=request)
+        metricas.observar('bd_espera', time.perf_counter() - inicio)
+        with self._lock:
+            self.en_curso += 1
+        try:
+            with metricas.temporizador('bd_peticion'):
+                return self._transporte.handle_request(request)
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+            self._cupos.release()
+
+    def close(self):
+        self._transporte.close()
+
+
+def _soporta_http2():
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+class PoolSupabase:
+    """
+    Acceso a PostgREST con conexiones compartidas, misma interfaz de tablas
+    que supabase.Client (table / from_ / rpc) para RepositorioSupabase
+    """
+
+    def __init__(self, url, clave, max_concurrentes=16, timeout=10.0, timeout_conexion=3.0,
+                 espera_max=5.0, keepalive=60.0, http2=True, esquema="public", clave_servicio=None):
+        """
+        Args:
+            url: SUPABASE_URL
+            clave: SUPABASE_KEY (apikey; nunca se usa como Authorization)
+            max_concurrentes: Peticiones simultáneas como máximo (el resto espera)
+            timeout: Segundos para leer/escribir una respuesta
+            timeout_conexion: Segundos para abrir una conexión
+            espera_max: Segundos que una petición espera un cupo antes de fallar
+            keepalive: Segundos que una conexión ociosa se mantiene abierta
+            http2: Usar HTTP/2 si `h2` está instalado
+            esquema: Esquema de Postgres
+            clave_servicio: Clave service_role (SUPABASE_SERVICE_KEY): todas las
+                peticiones la llevan en lugar del token del hilo (pool de los
+                trabajos del servidor; ignora RLS)
+        """
+        self.http2 = http2 and _soporta_http2()
+        if http2 and not self.http2:
+            print("⚠️  h2 no instalado: PostgREST por HTTP/1.1 keep-alive (pip install 'httpx[http2]')")
+
+        self._transporte = _Transporte(
+            httpx.HTTPTransport(
+                http2=self.http2,
+                retries=1,  # Reintenta solo fallos al conectar
+                limits=httpx.Limits(max_connections=max_concurrentes,
+                                    max_keepalive_connections=max_concurrentes,
+                                    keepalive_expiry=keepalive)
+            ),
+            max_concurrentes,
+            espera_max,
+            clave_servicio
+        )
+
+        # El cliente de postgrest arma URLs y cabeceras (esquema, apikey); su
+        # sesión se reemplaza por la compartida
+        self._postgrest = SyncPostgrestClient(f"{url}/rest/v1", schema=esquema, headers={'apikey': clave_servicio or clave})
+        sesion_original = self._postgrest.session
+        self._http = httpx.Client(
+            base_url=sesion_original.base_url,
+            headers=sesion_original.headers,
+            timeout=httpx.Timeout(timeout, connect=timeout_conexion, pool=espera_max),
+            transport=self._transporte
+        )
+        sesion_original.close()
+        self._postgrest.session = self._http
+
+    def table(self, nombre):
+        return self._postgrest.from_(nombre)
+
+    from_ = table
+
+    def rpc(self, funcion, parametros=None):
+        return self._postgrest.rpc(funcion, parametros or {})
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Peticiones en curso, rechazadas por el límite y si usa HTTP/2
+        """
+        return {
+            'en_curso': self._transporte.en_curso,
+            'rechazadas': self._transporte.rechazadas,
+            'http2': self.http2
+        }
+
+    def cerrar(self):
+        self._http.close()
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+def _servidor_postgrest(latencia, latencia_conexion):
+    """
+    PostgREST simulado en un puerto local (HTTP/1.1 keep-alive): cada
+    petición tarda `latencia` y cada conexión nueva `latencia_conexion`
+    (TCP + TLS hasta Supabase)
+
+    Returns:
+        tuple: (servidor, url, contador de conexiones abiertas)
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    conexiones = {'total': 0}
+    lock = threading.Lock()
+
+    class _Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with lock:
+                conexiones['total'] += 1
+            time.sleep(latencia_conexion)
+
+        def do_GET(self):
+            time.sleep(latencia)
+            cuerpo = b'[{"id": 1}]'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}", conexiones
+
+
+def _medir_latencia(cliente, hilos=64, consultas=640, token=None):
+    """
+    Latencia de consultas simultáneas desde `hilos` hilos, como los dashboards
+    en paralelo (una consulta de tabla por petición)
+
+    Returns:
+        dict: p50/p99/máx en ms y consultas/s
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+
+    def consulta(_):
+        with con_token(token):
+            inicio = time.perf_counter()
+            cliente.table('pacientes').select('id').eq('user_id', 'u').execute()
+            return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        tiempos = np.array(list(ejecutor.map(consulta, range(consultas)))) * 1000
+    duracion = time.perf_counter() - inicio
+    return {
+        'p50': float(np.percentile(tiempos, 50)),
+        'p99': float(np.percentile(tiempos, 99)),
+        'max': float(tiempos.max()),
+        'por_segundo': consultas / duracion
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Prueba del pool y latencia Client compartido vs pool")
+    parser.add_argument("--hilos", type=int, nargs="+", default=[16, 64], help="Peticiones en paralelo")
+    parser.add_argument("--consultas", type=int, default=640, help="Consultas por medición")
+    parser.add_argument("--latencia-ms", type=float, default=20.0, help="Latencia simulada de PostgREST")
+    parser.add_argument("--conexion-ms", type=float, default=60.0,
+                        help="Coste de abrir una conexión (TCP + TLS) simulado")
+    args = parser.parse_args()
+
+    print("🔌 Pool de PostgREST")
+    print("=" * 50)
+
+    simultaneas = {'ahora': 0, 'max': 0}
+    lock = threading.Lock()
+
+    def responder(request):
+        """PostgREST simulado: devuelve el Authorization recibido"""
+        with lock:
+            simultaneas['ahora'] += 1
+            simultaneas['max'] = max(simultaneas['max'], simultaneas['ahora'])
+        time.sleep(0.02)
+        with lock:
+            simultaneas['ahora'] -= 1
+        return httpx.Response(200, json=[{'auth': request.headers['Authorization']}])
+
+    pool = PoolSupabase("http://supabase.local", "clave-servidor", max_concurrentes=4, http2=False)
+    pool._transporte._transporte = httpx.MockTransport(responder)
+
+    def consulta(i):
+        with con_token(f"jwt-{i}" if i % 2 else None):
+            try:
+                return pool.table('pacientes').select('id').execute().data[0]['auth']
+            except SinCredenciales:
+                return None
+
+    with ThreadPoolExecutor(16) as ejecutor:
+        resultados = list(ejecutor.map(consulta, range(32)))
+
+    # Sin token la consulta falla: nunca sale con la clave anon
+    for i, auth in enumerate(resultados):
+        assert auth == (f"Bearer jwt-{i}" if i % 2 else None), auth
+    assert simultaneas['max'] <= 4
+    assert token_actual() is None
+    print(f"  32 consultas desde 16 hilos: máx. {simultaneas['max']} simultáneas, token correcto en cada una")
+    print(f"  {pool.metricas()}")
+
+    # Pool de servicio: siempre la clave service_role, haya o no token en el hilo
+    servicio = PoolSupabase("http://supabase.local", "clave-anon", max_concurrentes=4, http2=False,
+                            clave_servicio="clave-servicio")
+    servicio._transporte._transporte = httpx.MockTransport(responder)
+    for token in (None, "jwt-usuario"):
+        with con_token(token):
+            auth = servicio.table('pacientes').select('id').execute().data[0]['auth']
+        assert auth == "Bearer clave-servicio", auth
+    print("  Pool de servicio: clave service_role en cada petición")
+
+    # Latencia bajo carga: Client de supabase-py compartido (antes) vs pool
+    # (después), contra un PostgREST local con latencia y coste de conexión
+    try:
+        from supabase import create_client
+    except ImportError:
+        create_client = None
+        print("  (supabase no instalado: se omite la comparación con el Client compartido)")
+    servidor, url, conexiones = _servidor_postgrest(args.latencia_ms / 1000, args.conexion_ms / 1000)
+    clave = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.firma"  # create_client valida que parezca un JWT
+    print(f"\n⏱️  Latencia por consulta ({args.consultas} consultas, PostgREST a {args.latencia_ms:.0f} ms, "
+          f"conexión nueva {args.conexion_ms:.0f} ms):")
+    for hilos in args.hilos:
+        clientes = [("pool (16 cupos)", PoolSupabase(url, clave, max_concurrentes=16, http2=False))]
+        if create_client:
+            clientes.insert(0, ("Client compartido", create_client(url, clave)))
+        for nombre, cliente in clientes:
+            conexiones['total'] = 0
+            medida = _medir_latencia(cliente, hilos=hilos, consultas=args.consultas, token="jwt-usuario")
+            print(f"  {hilos:>4} hilos | {nombre:<18} p50 {medida['p50']:6.1f} ms | p99 {medida['p99']:6.1f} ms | "
+                  f"máx {medida['max']:6.1f} ms | {medida['por_segundo']:5.0f} consultas/s | "
+                  f"{conexiones['total']} conexiones")
+    servidor.shutdown()
+
+    print("\n✅ Módulo funcionando correctamente!")
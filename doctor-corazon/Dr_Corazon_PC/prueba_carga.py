@@ -0,0 +1,304 @@
+# prueba_carga.py - Prueba de carga de clientes del dashboard
+#
+# Abre N clientes socket.io simultáneos (como N pestañas del dashboard) con
+# la cookie de sesión de un usuario, los suscribe al monitor en vivo y, en
+# paralelo, consulta /api/control/estado como lo haría cada dashboard.
+# Con --paciente cada cliente además pide el listado de pacientes, el
+# historial y las estadísticas del paciente (rutas que consultan la BD).
+# Mide conexiones logradas, eventos recibidos y latencia HTTP por ruta.
+#
+# Requiere: pip install "python-socketio[client]" requests
+#
+# Uso (con el servidor y el simulador corriendo):
+#   python simulador_udp.py --dispositivos 1 --duracion 600 &
+#   python prueba_carga.py --cookie "session=<valor copiado del navegador>" --clientes 200
+#
+# Para comparar modos de servidor:
+#   DR_CORAZON_ASYNC=threading python app_supabase_auth_v2.py   # antes
+#   python app_supabase_auth_v2.py                              # eventlet (por defecto)
+#
+# Para comparar el acceso a Supabase (Client compartido vs pool_supabase.py):
+#   DR_CORAZON_BD_POOL=0 python app_supabase_auth_v2.py         # antes
+#   python app_supabase_auth_v2.py                              # pool (por defecto)
+#   python prueba_carga.py --cookie "session=..." --clientes 100 --paciente <uuid> --intervalo-http 1
+#
+# Sin Supabase (--local): el script levanta el servidor con DR_CORAZON_BD=sqlite,
+# un usuario y un paciente sembrados, una sesión firmada con un JWT HS256 propio
+# (en lugar del login de Supabase Auth) y el simulador UDP vinculado al paciente:
+#   python prueba_carga.py --local threading --clientes 50    # antes
+#   python prueba_carga.py --local eventlet --clientes 50     # después
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+URL_LOCAL = "http://dr-corazon.local"   # Emisor de los JWT de --local
+SECRETO_LOCAL = "prueba-carga-local-solo-para-medir-sin-supabase"
+
+
+def _rutas(args):
+    """Rutas HTTP que consulta cada cliente en cada ciclo"""
+    rutas = ["/api/control/estado"]
+    if args.paciente:
+        rutas += [
+            "/api/pacientes?campos=id,nombre,identificacion",
+            f"/api/paciente/{args.paciente}/diagnosticos?limite=10",
+            f"/api/paciente/{args.paciente}/estadisticas",
+        ]
+    return rutas
+
+
+def _cliente(i, args, resultados, barrera):
+    import socketio
+    import requests
+
+    r = {'conectado': False, 'error': None, 'diagnosticos': 0, 'onda_viva': 0,
+         'latencias_http': {ruta: [] for ruta in _rutas(args)}}
+    resultados[i] = r
+
+    sio = socketio.Client(reconnection=False)
+
+    @sio.on('diagnostico')
+    def _diagnostico(data):
+        r['diagnosticos'] += 1
+
+    @sio.on('onda_viva')
+    def _onda(data):
+        r['onda_viva'] += 1
+
+    barrera.wait()
+    try:
+        sio.connect(args.url, headers={'Cookie': args.cookie}, transports=['websocket'],
+                    wait_timeout=args.timeout)
+        r['conectado'] = True
+        sio.emit('suscribir_onda_viva', {'hz': args.hz})
+    except Exception as e:
+        r['error'] = str(e)
+        return
+
+    http = requests.Session()
+    http.headers['Cookie'] = args.cookie
+    fin = time.monotonic() + args.duracion
+    while time.monotonic() < fin:
+        for ruta in r['latencias_http']:
+            inicio = time.perf_counter()
+            try:
+                http.get(f"{args.url}{ruta}", timeout=args.timeout).raise_for_status()
+                r['latencias_http'][ruta].append(time.perf_counter() - inicio)
+            except Exception as e:
+                r['error'] = str(e)
+        time.sleep(args.intervalo_http)
+
+    sio.disconnect()
+
+
+def _carga(args):
+    """
+    Lanza los clientes contra args.url
+
+    Returns:
+        dict: conectados, onda_viva por cliente/s, diagnósticos por cliente,
+            latencias HTTP (ms) por ruta y errores
+    """
+    resultados = [None] * args.clientes
+    barrera = threading.Barrier(args.clientes)
+    hilos = [threading.Thread(target=_cliente, args=(i, args, resultados, barrera), daemon=True)
+             for i in range(args.clientes)]
+    inicio = time.monotonic()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join(args.duracion + 3 * args.timeout)
+    duracion = time.monotonic() - inicio
+
+    validos = [r for r in resultados if r]
+    conectados = [r for r in validos if r['conectado']]
+    return {
+        'conectados': len(conectados),
+        'onda_viva': np.mean([r['onda_viva'] for r in conectados]) / duracion if conectados else 0.0,
+        'diagnosticos': np.mean([r['diagnosticos'] for r in conectados]) if conectados else 0.0,
+        'latencias_http': {ruta: np.array([l for r in conectados for l in r['latencias_http'][ruta]]) * 1000
+                           for ruta in _rutas(args)},
+        'errores': sorted({r['error'] for r in validos if r['error']})
+    }
+
+
+def _mostrar(args, resumen):
+    print(f"   Conectados: {resumen['conectados']}/{args.clientes}")
+    if resumen['conectados']:
+        print(f"   onda_viva por cliente: {resumen['onda_viva']:.1f}/s (pedido {args.hz}/s)")
+        print(f"   diagnósticos por cliente: {resumen['diagnosticos']:.1f}")
+    for ruta, latencias in resumen['latencias_http'].items():
+        if len(latencias):
+            print(f"   HTTP {ruta.split('?')[0]}: p50 {np.percentile(latencias, 50):.0f} ms | "
+                  f"p99 {np.percentile(latencias, 99):.0f} ms | {len(latencias)} peticiones")
+    for e in resumen['errores'][:5]:
+        print(f"   ❌ {e}")
+
+
+# ============================================================================
+# SERVIDOR LOCAL (--local): SQLite, sesión firmada aquí, simulador UDP
+# ============================================================================
+
+def _servir_local(directorio, puerto, modelo=None):
+    """
+    Proceso hijo de --local: el servidor de app_supabase_auth_v2.py tal cual,
+    con un verificador de JWT que acepta los tokens firmados por este script
+    """
+    os.chdir(directorio)
+    sys.path.insert(0, DIRECTORIO)
+    import app_supabase_auth_v2 as servidor
+    from nodo_captura import RUTA_MODELO
+    from verificador_jwt import VerificadorJWT
+    import jwt
+
+    if modelo:
+        shutil.copy(modelo, RUTA_MODELO)
+    elif not os.path.exists(RUTA_MODELO):
+        # Sin el modelo entrenado: uno con la misma entrada/salida, para medir
+        # la carga del servidor (la inferencia real es más cara)
+        import tensorflow as tf
+        modelo = tf.keras.Sequential([
+            tf.keras.Input((5000, 3)),
+            tf.keras.layers.Conv1D(16, 15, strides=4, activation='relu'),
+            tf.keras.layers.GlobalAveragePooling1D(),
+            tf.keras.layers.Dense(4, activation='sigmoid')
+        ])
+        modelo.save(RUTA_MODELO)
+
+    with open("semilla.json") as f:
+        semilla = json.load(f)
+    ahora = int(time.time())
+    token = jwt.encode({
+        'sub': semilla['user_id'], 'email': semilla['email'], 'role': 'authenticated',
+        'aud': 'authenticated', 'iss': f"{URL_LOCAL}/auth/v1", 'iat': ahora, 'exp': ahora + 86400
+    }, SECRETO_LOCAL, algorithm="HS256")
+    servidor.auth.verificador = VerificadorJWT(URL_LOCAL, secreto=SECRETO_LOCAL)
+
+    firmador = servidor.app.session_interface.get_signing_serializer(servidor.app)
+    cookie = firmador.dumps({'user_id': semilla['user_id'], 'user_email': semilla['email'],
+                             'access_token': token, 'token_expira': ahora + 86400})
+    with open("cookie.tmp", "w") as f:
+        f.write(f"{servidor.app.config['SESSION_COOKIE_NAME']}={cookie}")
+    os.replace("cookie.tmp", "cookie")
+
+    servidor.nodo.iniciar()
+    servidor.socketio.run(servidor.app, host='127.0.0.1', port=puerto, debug=False,
+                          use_reloader=False, allow_unsafe_werkzeug=True, log_output=False)
+
+
+def _esperar(condicion, timeout, descripcion, proceso):
+    fin = time.monotonic() + timeout
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El servidor terminó (código {proceso.returncode}) esperando {descripcion}")
+        try:
+            valor = condicion()
+            if valor:
+                return valor
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Tiempo agotado esperando {descripcion}")
+
+
+def _carga_local(args):
+    """
+    Levanta servidor (modo args.local) y simulador, selecciona el paciente
+    sembrado y lanza la carga; todo en un directorio temporal
+
+    Returns:
+        dict: Resumen de _carga()
+    """
+    import requests
+    from repositorio import crear_repositorio
+
+    directorio = tempfile.mkdtemp(prefix="prueba_carga_")
+    url_bd = f"sqlite:///{os.path.join(directorio, 'dr_corazon_local.db')}"
+    repo = crear_repositorio(url_bd)
+    perfil = repo.insertar('user_profiles', [{'email': 'carga@local', 'nombre_completo': 'Prueba de carga',
+                                              'rol': 'usuario', 'activo': True}])[0]
+    paciente = repo.insertar('pacientes', [{'user_id': perfil['id'], 'nombre': 'Paciente de carga'}])[0]
+    with open(os.path.join(directorio, "semilla.json"), "w") as f:
+        json.dump({'user_id': perfil['id'], 'email': perfil['email']}, f)
+
+    entorno = dict(os.environ, DR_CORAZON_BD=url_bd, DR_CORAZON_ASYNC=args.local, DR_CORAZON_CAPTURA='local')
+    entorno.pop('DR_CORAZON_COLA', None)
+    log = open(os.path.join(directorio, "servidor.log"), "w")
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--servir-local", directorio, "--puerto", str(args.puerto)]
+        + (["--modelo", os.path.abspath(args.modelo)] if args.modelo else []),
+        env=entorno, stdout=log, stderr=subprocess.STDOUT
+    )
+    simulador = None
+    try:
+        args.url = f"http://127.0.0.1:{args.puerto}"
+        args.cookie = _esperar(lambda: open(os.path.join(directorio, "cookie")).read(), 120, "la sesión", servidor)
+        http = requests.Session()
+        http.headers['Cookie'] = args.cookie
+        _esperar(lambda: http.get(f"{args.url}/api/control/estado", timeout=5).ok, 120, "el servidor", servidor)
+
+        simulador = subprocess.Popen(
+            [sys.executable, os.path.join(DIRECTORIO, "simulador_udp.py"), "--dispositivos", "1",
+             "--duracion", str(args.duracion + 120)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        # El dispositivo aparece tras su primera ventana de 10 s
+        _esperar(lambda: http.get(f"{args.url}/api/dispositivos", timeout=5).json()['data'], 60, "el dispositivo", servidor)
+        seleccion = http.post(f"{args.url}/api/seleccionar-paciente", json={'paciente_id': paciente['id']},
+                              timeout=10).json()
+        if not seleccion.get('dispositivo'):
+            raise RuntimeError(f"No se pudo vincular el dispositivo: {seleccion}")
+        return _carga(args)
+    finally:
+        for proceso in (simulador, servidor):
+            if proceso:
+                proceso.terminate()
+                proceso.wait(10)
+        log.close()
+        print(f"   Registro del servidor: {os.path.join(directorio, 'servidor.log')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de clientes del dashboard")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--cookie", help="Cookie de sesión de un usuario con paciente seleccionado")
+    parser.add_argument("--clientes", type=int, default=50)
+    parser.add_argument("--duracion", type=float, default=60.0, help="Segundos de carga por cliente")
+    parser.add_argument("--hz", type=int, default=25, help="Tasa del monitor en vivo pedida")
+    parser.add_argument("--intervalo-http", type=float, default=5.0, help="Segundos entre consultas HTTP por cliente")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--paciente", help="UUID de un paciente del usuario: añade rutas que consultan la BD")
+    parser.add_argument("--local", choices=["threading", "eventlet"],
+                        help="Sin Supabase: levanta el servidor en este modo con SQLite y el simulador")
+    parser.add_argument("--modelo", help="Con --local: modelo .h5 a usar (sin él, uno sin entrenar)")
+    parser.add_argument("--puerto", type=int, default=5050, help="Puerto del servidor de --local")
+    parser.add_argument("--servir-local", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir_local:
+        _servir_local(args.servir_local, args.puerto, args.modelo)
+        return
+    if not args.local and not args.cookie:
+        parser.error("--cookie es obligatorio sin --local")
+
+    print("\n" + "=" * 60)
+    print("🏋️  Dr Corazón - Prueba de carga del dashboard")
+    print("=" * 60)
+    servidor = f"local ({args.local}, SQLite)" if args.local else args.url
+    print(f"   Servidor: {servidor} | Clientes: {args.clientes} | Duración: {args.duracion:.0f}s\n")
+
+    resumen = _carga_local(args) if args.local else _carga(args)
+    _mostrar(args, resumen)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# reanalisis.py - Re-análisis offline de sesiones grabadas
+#
+# Pasa las sesiones archivadas por grabador_sesion.py por las mismas etapas
+# que la captura en vivo:
+#   _process_packet (filtros, EASI→XYZ, remuestreo) → HRVAnalyzer → HolterAnalyzer
+# El DSP se reparte en procesos por bloques de ventanas; la inferencia se
+# hace por lotes en el proceso principal. Guarda un checkpoint por sesión y
+# modelo (hash del archivo) para poder reanudar: con un modelo nuevo todas las
+# sesiones se vuelven a analizar desde el principio. Las ventanas
+# incompletas se cuentan y se informan; si el modelo falla, el checkpoint
+# queda en la primera ventana sin diagnosticar y la sesión se reintenta en
+# la siguiente ejecución.
+#
+# Uso:
+#   python reanalisis.py grabaciones/20250101_080000 --salida resultados.ndjson
+#   python reanalisis.py grabaciones/* --paciente-id <uuid> --procesos 8
+
+import os
+import json
+import hashlib
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+from grabador_sesion import LectorSesion
+from hr_hrv_analyzer import HRVAnalyzer
+
+RUTA_MODELO = "vcg_model_optimized_4classes.h5"
+
+
+class FalloModelo(RuntimeError):
+    """El modelo no pudo diagnosticar un lote (la sesión queda a medias)"""
+
+
+# ============================================================================
+# ETAPA DSP (procesos trabajadores)
+# ============================================================================
+
+def _procesar_bloque(args):
+    """
+    Procesa un bloque de ventanas [inicio, fin) de una sesión
+
+    Returns:
+        tuple: ([(indice_ventana, timestamp, xyz (5000, 3), resultado_hrv), ...],
+                [indices de ventanas incompletas, que no se analizan])
+    """
+    directorio, inicio, fin, usar_xyz_grabado, paciente_id = args
+
+    import receiver_udp  # Solo en los trabajadores: filtros + transformación EASI
+
+    lector = LectorSesion(directorio)
+    analizador_hrv = HRVAnalyzer(frecuencia_muestreo=500)
+
+    leer_ventana = lector.ventana_xyz if usar_xyz_grabado else lector.ventana_crudo
+    salida, incompletas = [], []
+    for i in range(inicio, fin):
+        timestamp, datos = leer_ventana(i)
+
+        if usar_xyz_grabado:
+            xyz = np.asarray(datos, dtype=np.float32)
+        else:
+            crudo = np.asarray(datos, dtype=float)
+            if len(crudo) < receiver_udp.N_IN:
+                incompletas.append(i)
+                continue
+            crudo = crudo[:receiver_udp.N_IN]
+            X, Y, Z = receiver_udp._process_packet(crudo[:, 0], crudo[:, 1], crudo[:, 2], crudo[:, 3])
+            xyz = np.column_stack([X, Y, Z]).astype(np.float32)
+
+        resultado_hrv = analizador_hrv.analizar(xyz, usar_canal='mejor', paciente_id=paciente_id)
+        resultado_hrv.pop('rr_intervals', None)
+        resultado_hrv.pop('picos_indices', None)
+        salida.append((i, timestamp, xyz, resultado_hrv))
+
+    return salida, incompletas
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+def _leer_checkpoint(ruta):
+    if ruta and os.path.exists(ruta):
+        with open(ruta) as f:
+            return json.load(f)
+    return {}
+
+
+def identidad_modelo(ruta):
+    """Hash SHA-256 (16 hex) del archivo del modelo: distingue versiones aunque
+    se sobrescriba el mismo .h5"""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(1 << 20), b""):
+            h.update(trozo)
+    return h.hexdigest()[:16]
+
+
+def _guardar_checkpoint(ruta, checkpoint):
+    if not ruta:
+        return
+    with open(ruta + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(ruta + ".tmp", ruta)
+
+
+# ============================================================================
+# SALIDA
+# ============================================================================
+
+class SalidaNDJSON:
+    """Escribe un diagnóstico por línea en un archivo local"""
+
+    def __init__(self, ruta):
+        self.archivo = open(ruta, "a", encoding="utf-8")
+
+    def escribir(self, filas):
+        self.archivo.write("".join(json.dumps(f, ensure_ascii=False) + "\n" for f in filas))
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class SalidaSupabase:
+    """Inserta diagnósticos en la tabla diagnosticos por lotes"""
+
+    def __init__(self, paciente_id):
+        from supabase_config import fila_diagnostico, insertar_lote
+        self.paciente_id = paciente_id
+        self._fila = fila_diagnostico
+        self._insertar = lambda tabla, filas: insertar_lote(tabla, filas, servicio=True)
+
+    def escribir(self, filas):
+        datos = []
+        for f in filas:
+            fila = self._fila(
+                paciente_id=self.paciente_id,
+                diagnostico=f['diagnostico'],
+                probabilidades=f['probabilidades'],
+                tiempo_analisis=f['tiempo_analisis'],
+                alerta_critica=f['alerta_critica'],
+                notas=f"Re-análisis {f['sesion']} #{f['ventana']}",
+                hr_bpm=f['hr_bpm'],
+                hrv_sdnn=f['hrv_sdnn'],
+                hrv_rmssd=f['hrv_rmssd'],
+                hrv_pnn50=f['hrv_pnn50'],
+                num_picos_r=f['num_picos_r'],
+                timestamp=f['timestamp']
+            )
+            datos.append(fila)
+        self._insertar("diagnosticos", datos)
+
+    def cerrar(self):
+        pass
+
+
+# ============================================================================
+# RE-ANÁLISIS
+# ============================================================================
+
+def reanalizar_sesion(directorio, motor_ia, pool, salida, checkpoint, ruta_checkpoint,
+                      ventanas_por_bloque=32, usar_xyz_grabado=False, paciente_id=None,
+                      modelo=""):
+    """
+    Re-analiza una sesión grabada
+
+    Args:
+        modelo: Identidad del modelo (identidad_modelo); forma parte de la
+            clave del checkpoint, así un modelo distinto empieza desde 0
+
+    Returns:
+        tuple: (ventanas procesadas, ventanas incompletas omitidas) en esta ejecución
+
+    Raises:
+        FalloModelo: Si el modelo falla; lo anterior queda guardado y el
+            checkpoint apunta a la primera ventana sin diagnosticar
+    """
+    lector = LectorSesion(directorio)
+    total = len(lector.indice)
+    clave = f"{modelo}:{os.path.abspath(directorio)}"
+    inicio = checkpoint.get(clave, 0)
+
+    if inicio >= total:
+        print(f"⏭️  {directorio}: ya procesada ({total} ventanas)")
+        return 0, 0
+
+    print(f"📂 {directorio}: ventanas {inicio}..{total - 1}")
+    bloques = [
+        (directorio, a, min(a + ventanas_por_bloque, total), usar_xyz_grabado, paciente_id)
+        for a in range(inicio, total, ventanas_por_bloque)
+    ]
+
+    procesadas = omitidas = 0
+    # imap conserva el orden: el checkpoint siempre avanza de forma contigua
+    for bloque, (resultados, incompletas) in zip(bloques, pool.imap(_procesar_bloque, bloques)):
+        if incompletas:
+            omitidas += len(incompletas)
+            print(f"⚠️  {directorio}: {len(incompletas)} ventanas incompletas omitidas ({incompletas[:5]}...)")
+        if not resultados:
+            checkpoint[clave] = bloque[2]
+            _guardar_checkpoint(ruta_checkpoint, checkpoint)
+            continue
+
+        t0 = time.perf_counter()
+        diagnosticos = motor_ia.diagnosticar_lote([xyz for _, _, xyz, _ in resultados])
+        tiempo_lote = (time.perf_counter() - t0) / len(resultados)
+
+        filas = []
+        fallo = None
+        for (i, timestamp, _, hrv), diag in zip(resultados, diagnosticos):
+            if diag["status"] != "OK":
+                fallo = (i, diag.get("mensaje", diag["status"]))
+                break
+            filas.append({
+                'sesion': os.path.basename(os.path.normpath(directorio)),
+                'ventana': i,
+                'timestamp': timestamp,
+                'diagnostico': diag['diagnostico_texto'],
+                'probabilidades': diag['detalles'],
+                'tiempo_analisis': round(tiempo_lote, 4),
+                'alerta_critica': diag['alerta_infarto'],
+                'hr_bpm': hrv['hr_bpm'],
+                'hrv_sdnn': hrv['hrv_sdnn'],
+                'hrv_rmssd': hrv['hrv_rmssd'],
+                'hrv_pnn50': hrv['hrv_pnn50'],
+                'num_picos_r': hrv['num_picos']
+            })
+
+        salida.escribir(filas)
+        procesadas += len(filas)
+
+        # Tras un fallo del modelo el checkpoint no pasa de la ventana fallida
+        checkpoint[clave] = fallo[0] if fallo else bloque[2]
+        _guardar_checkpoint(ruta_checkpoint, checkpoint)
+        if fallo:
+            raise FalloModelo(f"{directorio}: el modelo falló en la ventana {fallo[0]}: {fallo[1]}")
+
+    return procesadas, omitidas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-análisis offline de sesiones holter grabadas")
+    parser.add_argument("sesiones", nargs="+", help="Directorios de sesión (grabaciones/<fecha>)")
+    parser.add_argument("--modelo", default=RUTA_MODELO, help="Modelo .h5 a usar")
+    parser.add_argument("--salida", default="reanalisis.ndjson", help="Archivo NDJSON de resultados")
+    parser.add_argument("--paciente-id", help="Guardar en Supabase para este paciente (en vez de NDJSON)")
+    parser.add_argument("--checkpoint", default="reanalisis_checkpoint.json", help="Archivo de checkpoint")
+    parser.add_argument("--sin-checkpoint", action="store_true", help="Ignorar checkpoint y empezar de cero")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="Procesos para el DSP")
+    parser.add_argument("--bloque", type=int, default=32, help="Ventanas por bloque (y por lote de inferencia)")
+    parser.add_argument("--usar-xyz-grabado", action="store_true",
+                        help="Usar el XYZ ya procesado en vez de re-filtrar el crudo")
+    args = parser.parse_args()
+
+    ruta_checkpoint = None if args.sin_checkpoint else args.checkpoint
+    checkpoint = _leer_checkpoint(ruta_checkpoint)
+    modelo = identidad_modelo(args.modelo)
+
+    print("\n" + "=" * 60)
+    print("🔁 Dr Corazón - Re-análisis offline")
+    print("=" * 60)
+    print(f"   Modelo: {args.modelo} ({modelo})")
+    print(f"   Sesiones: {len(args.sesiones)} | Procesos DSP: {args.procesos} | Bloque: {args.bloque}")
+    print(f"   Destino: {'Supabase paciente ' + args.paciente_id if args.paciente_id else args.salida}\n")
+
+    # El pool se crea antes de cargar TensorFlow: los trabajadores no lo heredan
+    with Pool(processes=args.procesos) as pool:
+        from holter_ai import HolterAnalyzer
+        motor_ia = HolterAnalyzer(args.modelo)
+        salida = SalidaSupabase(args.paciente_id) if args.paciente_id else SalidaNDJSON(args.salida)
+
+        inicio = time.perf_counter()
+        total = omitidas = 0
+        fallidas = []
+        try:
+            for directorio in args.sesiones:
+                try:
+                    procesadas, incompletas = reanalizar_sesion(
+                        directorio, motor_ia, pool, salida, checkpoint, ruta_checkpoint,
+                        ventanas_por_bloque=args.bloque,
+                        usar_xyz_grabado=args.usar_xyz_grabado,
+                        paciente_id=args.paciente_id,
+                        modelo=modelo
+                    )
+                except FalloModelo as e:
+                    print(f"❌ {e} (se reintenta al volver a ejecutar)")
+                    fallidas.append(directorio)
+                    continue
+                total += procesadas
+                omitidas += incompletas
+                duracion = time.perf_counter() - inicio
+                print(f"   {total} ventanas | {total / max(duracion, 1e-9):.1f} ventanas/s")
+        except KeyboardInterrupt:
+            print("\n⏸️  Interrumpido: el checkpoint permite reanudar")
+        finally:
+            salida.cerrar()
+
+    duracion = time.perf_counter() - inicio
+    print(f"\n✅ {total} ventanas en {duracion:.1f}s ({total / max(duracion, 1e-9):.1f} ventanas/s, "
+          f"{total * 10 / max(duracion, 1e-9):.0f}x tiempo real)")
+    if omitidas:
+        print(f"⚠️  {omitidas} ventanas incompletas omitidas (no se reintentan)")
+    if fallidas:
+        print(f"❌ {len(fallidas)} sesiones con fallos del modelo: {', '.join(fallidas)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
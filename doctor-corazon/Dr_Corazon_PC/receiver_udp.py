@@ -14,6 +14,9 @@ matplotlib.use('Agg')  # Backend no-GUI para evitar bloqueos
 import matplotlib.pyplot as plt
 from scipy.signal import butter, sosfiltfilt, iirnotch, filtfilt, resample
 
+from metricas import metricas
+from concurrencia import ejecutar_bloqueante
+
 # ==============================
 #  CONFIG UDP
 # ==============================
@@ -127,9 +130,10 @@ def _process_packet(es_arr, as_arr, ai_arr, alab_arr):
         tuple: (X_out, Y_out, Z_out) cada uno de 5000 muestras
     """
     # 1) FILTROS
-    es_f = _filt_ecg(es_arr)
-    as_f = _filt_ecg(as_arr)
-    ai_f = _filt_ecg(ai_arr)
+    with metricas.temporizador('filtro'):
+        es_f = _filt_ecg(es_arr)
+        as_f = _filt_ecg(as_arr)
+        ai_f = _filt_ecg(ai_arr)
 
     # 2) REMOVER OFFSET
     es_d = es_f - np.mean(es_f)
@@ -147,9 +151,10 @@ def _process_packet(es_arr, as_arr, ai_arr, alab_arr):
     Zn = _normalize_centered(Z)
 
     # 5) REMUESTREO 5000 muestras
-    X_out = resample(Xn, N_OUT)
-    Y_out = resample(Yn, N_OUT)
-    Z_out = resample(Zn, N_OUT)
+    with metricas.temporizador('remuestreo'):
+        X_out = resample(Xn, N_OUT)
+        Y_out = resample(Yn, N_OUT)
+        Z_out = resample(Zn, N_OUT)
 
     return X_out, Y_out, Z_out
 
@@ -158,16 +163,170 @@ def _process_packet(es_arr, as_arr, ai_arr, alab_arr):
 #  GENERADOR PRINCIPAL
 # ==============================
 
-def receive_packets(enable_plot=False):
+def _datagramas_socket(enable_plot=False):
+    """
+    Generador infinito de datagramas (data, addr) leídos del socket UDP
+    """
+    sock = create_socket()
+    print(f"[receiver_udp] Escuchando UDP en {UDP_IP}:{UDP_PORT} ...")
+    
+    while True:
+        try:
+            yield sock.recvfrom(4096)
+        except BlockingIOError:
+            if enable_plot:
+                plt.pause(0.001)
+            else:
+                time.sleep(0.001)
+
+
+def _decodificar(data):
+    """
+    Decodifica un datagrama de texto "ES AS AI ALAB\n" por muestra
+
+    Returns:
+        list: Tuplas (ES, AS, AI, ALAB); las líneas malformadas se descartan
+    """
+    t0 = time.perf_counter()
+    text = data.decode("utf-8", errors="ignore")
+    muestras = []
+    malformadas = 0
+
+    for line in text.splitlines():
+        parts = line.strip().split()
+        if len(parts) != 4:
+            malformadas += 1
+            continue
+        try:
+            muestras.append((int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3])))
+        except:
+            malformadas += 1
+
+    metricas.observar('decodificacion', time.perf_counter() - t0)
+    metricas.contador('datagramas')
+    metricas.contador('muestras', len(muestras))
+    if malformadas:
+        metricas.contador('lineas_malformadas', malformadas)
+    return muestras
+
+
+class PipelineDispositivo:
+    """
+    Ventaneo y procesado de un único dispositivo: buffers crudos propios,
+    ventana de ~10 s → _process_packet → XYZ (5000, 3) y archivo opcional
+    """
+
+    def __init__(self, dispositivo, grabador=None):
+        """
+        Args:
+            dispositivo: Identificador del dispositivo (IP de origen)
+            grabador: GrabadorSesion opcional para su sesión continua
+        """
+        self.dispositivo = dispositivo
+        self.grabador = grabador
+
+        # Buffers para datos crudos
+        self.raw_es = []
+        self.raw_as = []
+        self.raw_ai = []
+        self.raw_alab = []
+        self.t_inicio_ventana = None
+
+    @property
+    def llenado(self):
+        """Fracción de la ventana actual ya recibida"""
+        return len(self.raw_es) / N_IN
+
+    def agregar(self, muestras):
+        """
+        Agrega las muestras de un datagrama
+
+        Yields:
+            np.ndarray: (5000, 3) float32 por cada ventana completada
+        """
+        for es_raw, as_raw, ai_raw, alab in muestras:
+            if not self.raw_es:
+                self.t_inicio_ventana = time.time()
+
+            self.raw_es.append(es_raw)
+            self.raw_as.append(as_raw)
+            self.raw_ai.append(ai_raw)
+            self.raw_alab.append(alab)
+
+            # ¿Paquete completo?
+            if len(self.raw_es) >= N_IN:
+                yield self._cerrar_ventana()
+
+    def _cerrar_ventana(self):
+        es_arr = np.asarray(self.raw_es[:N_IN], float)
+        as_arr = np.asarray(self.raw_as[:N_IN], float)
+        ai_arr = np.asarray(self.raw_ai[:N_IN], float)
+        alab_arr = np.asarray(self.raw_alab[:N_IN], int)
+
+        print(f"[receiver_udp] Paquete listo ({self.dispositivo}): {N_IN} muestras. Procesando...")
+
+        # PROCESAR (fuera del bucle de eventos si el servidor corre con eventlet)
+        X_out, Y_out, Z_out = ejecutar_bloqueante(_process_packet, es_arr, as_arr, ai_arr, alab_arr)
+
+        # --- PAQUETE PARA IA ---
+        xyz = np.column_stack([X_out, Y_out, Z_out]).astype(np.float32)
+
+        # --- ARCHIVO CONTINUO (opcional) ---
+        if self.grabador is not None:
+            crudo = np.column_stack([es_arr, as_arr, ai_arr, alab_arr]).astype(np.int32)
+            self.grabador.agregar_ventana(crudo, xyz, self.t_inicio_ventana)
+
+        # limpiar buffers
+        self.raw_es.clear()
+        self.raw_as.clear()
+        self.raw_ai.clear()
+        self.raw_alab.clear()
+        metricas.contador('ventanas')
+
+        return xyz
+
+
+def _graficar(xyz):
+    """Actualiza la figura matplotlib con una ventana XYZ"""
+    t = np.linspace(0, WINDOW_SEC, N_OUT, endpoint=False)
+
+    line1.set_data(t, xyz[:, 0])
+    line2.set_data(t, xyz[:, 1])
+    line3.set_data(t, xyz[:, 2])
+
+    ax1.set_xlim(0, WINDOW_SEC)
+    ax2.set_xlim(0, WINDOW_SEC)
+    ax3.set_xlim(0, WINDOW_SEC)
+
+    _autoscale(ax1, xyz[:, 0])
+    _autoscale(ax2, xyz[:, 1])
+    _autoscale(ax3, xyz[:, 2])
+
+    fig.canvas.draw()
+    fig.canvas.flush_events()
+
+
+def receive_packets(enable_plot=False, grabador=None, fuente=None, vivo=None):
     """
     Generador que:
       - Recibe UDP continuo de ES AS AI ALAB
       - Procesa ventanas de ~10 s
       - Grafica X, Y, Z (solo si enable_plot=True)
+      - Archiva crudo + XYZ en disco (solo si se pasa un grabador)
+      - Reenvía las muestras al monitor en vivo (solo si se pasa vivo)
       - YIELDea matriz (5000 x 3) lista para IA
     
+    Trata todo lo recibido como un único flujo; para varios ESP32 usar
+    receive_packets_por_dispositivo.
+    
     Args:
         enable_plot (bool): Si True, muestra gráficas matplotlib
+        grabador: GrabadorSesion opcional (grabador_sesion.py) para la sesión continua
+        fuente: Iterable opcional de datagramas (data, addr) que sustituye al
+            socket (ej. simulador_udp.fuente_en_proceso para benchmarks
+            deterministas). El generador termina cuando se agota.
+        vivo: EmisorOndaViva opcional (onda_viva.py) que recibe cada datagrama
+            decodificado para el monitor en vivo del dashboard
     
     Yields:
         np.ndarray: Array de shape (5000, 3) con [X, Y, Z]
@@ -178,92 +337,75 @@ def receive_packets(enable_plot=False):
     if enable_plot:
         init_plot()
     
-    # Crear socket
-    sock = create_socket()
-    print(f"[receiver_udp] Escuchando UDP en {UDP_IP}:{UDP_PORT} ...")
+    # Socket UDP salvo que se inyecte otra fuente de datagramas
+    if fuente is None:
+        fuente = _datagramas_socket(enable_plot)
     
-    # Buffers para datos crudos
-    raw_es = []
-    raw_as = []
-    raw_ai = []
-    raw_alab = []
+    pipeline = PipelineDispositivo("esp32", grabador)
 
     print(f"[receiver_udp] Esperando paquete de {N_IN} muestras...")
 
-    while True:
-        # Leer UDP
-        try:
-            data, addr = sock.recvfrom(4096)
-        except BlockingIOError:
-            if enable_plot:
-                plt.pause(0.001)
-            else:
-                time.sleep(0.001)
-            continue
-
-        text = data.decode("utf-8", errors="ignore")
-        lines = text.splitlines()
-
-        for line in lines:
-            parts = line.strip().split()
-            if len(parts) != 4:
-                continue
-            try:
-                es_raw = int(parts[0])
-                as_raw = int(parts[1])
-                ai_raw = int(parts[2])
-                alab   = int(parts[3])
-            except:
-                continue
-
-            raw_es.append(es_raw)
-            raw_as.append(as_raw)
-            raw_ai.append(ai_raw)
-            raw_alab.append(alab)
-
-            # ¿Paquete completo?
-            if len(raw_es) >= N_IN:
-
-                es_arr = np.asarray(raw_es[:N_IN], float)
-                as_arr = np.asarray(raw_as[:N_IN], float)
-                ai_arr = np.asarray(raw_ai[:N_IN], float)
-                alab_arr = np.asarray(raw_alab[:N_IN], int)
-
-                print(f"[receiver_udp] Paquete listo: {N_IN} muestras. Procesando...")
-
-                # PROCESAR
-                X_out, Y_out, Z_out = _process_packet(es_arr, as_arr, ai_arr, alab_arr)
+    for data, addr in fuente:
+        muestras = _decodificar(data)
 
-                # --- GRAFICAR (solo si está habilitado) ---
-                if enable_plot and fig is not None:
-                    t = np.linspace(0, WINDOW_SEC, N_OUT, endpoint=False)
+        # Monitor en vivo (onda_viva.EmisorOndaViva): solo encola, filtra otro hilo
+        if vivo is not None:
+            vivo.agregar(muestras, addr[0])
 
-                    line1.set_data(t, X_out)
-                    line2.set_data(t, Y_out)
-                    line3.set_data(t, Z_out)
+        for xyz in pipeline.agregar(muestras):
+            # --- GRAFICAR (solo si está habilitado) ---
+            if enable_plot and fig is not None:
+                _graficar(xyz)
 
-                    ax1.set_xlim(0, WINDOW_SEC)
-                    ax2.set_xlim(0, WINDOW_SEC)
-                    ax3.set_xlim(0, WINDOW_SEC)
+            # ENTREGAR PAQUETE 5000×3
+            yield xyz
 
-                    _autoscale(ax1, X_out)
-                    _autoscale(ax2, Y_out)
-                    _autoscale(ax3, Z_out)
+        metricas.gauge('buffer_llenado', pipeline.llenado)
 
-                    fig.canvas.draw()
-                    fig.canvas.flush_events()
 
-                # --- PAQUETE PARA IA ---
-                xyz = np.column_stack([X_out, Y_out, Z_out]).astype(np.float32)
+def receive_packets_por_dispositivo(fuente=None, crear_grabador=None, vivo=None):
+    """
+    Como receive_packets, pero con un pipeline independiente por dispositivo
+    (IP de origen): las ventanas de dos ESP32 nunca se mezclan.
+    
+    Args:
+        fuente: Iterable opcional de datagramas (data, addr) en lugar del socket
+        crear_grabador: Callable(dispositivo) → GrabadorSesion o None, llamado
+            al ver cada dispositivo nuevo
+        vivo: EmisorOndaViva opcional para el monitor en vivo
+    
+    Yields:
+        tuple: (dispositivo, np.ndarray (5000, 3) con [X, Y, Z])
+    """
+    if fuente is None:
+        fuente = _datagramas_socket()
+    
+    pipelines = {}
 
-                # limpiar buffers
-                raw_es.clear()
-                raw_as.clear()
-                raw_ai.clear()
-                raw_alab.clear()
+    print(f"[receiver_udp] Esperando ventanas de {N_IN} muestras por dispositivo...")
 
-                # ENTREGAR PAQUETE 5000×3
-                yield xyz
+    try:
+        for data, addr in fuente:
+            dispositivo = addr[0]
+            pipeline = pipelines.get(dispositivo)
+            if pipeline is None:
+                print(f"[receiver_udp] Nuevo dispositivo: {dispositivo}")
+                grabador = crear_grabador(dispositivo) if crear_grabador else None
+                pipeline = pipelines[dispositivo] = PipelineDispositivo(dispositivo, grabador)
+                metricas.gauge('dispositivos', len(pipelines))
+
+            muestras = _decodificar(data)
+
+            if vivo is not None:
+                vivo.agregar(muestras, dispositivo)
+
+            for xyz in pipeline.agregar(muestras):
+                yield dispositivo, xyz
+    finally:
+        # Metadatos de las grabaciones al día aunque la captura termine o falle
+        for pipeline in pipelines.values():
+            if pipeline.grabador is not None:
+                pipeline.grabador.cerrar()
 
 
 # ==============================
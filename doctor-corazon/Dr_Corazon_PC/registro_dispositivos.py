@@ -0,0 +1,270 @@
+# registro_dispositivos.py - Tabla de enrutamiento dispositivo → paciente
+#
+# Cada ESP32 (identificado por su IP de origen) se vincula a lo sumo a un
+# paciente y cada paciente a lo sumo a un dispositivo. El hilo de captura
+# consulta la tabla por cada ventana sin tomar locks: los cambios construyen
+# una tabla nueva y la sustituyen de una vez (copy-on-write), así una
+# ventana nunca ve una vinculación a medio actualizar.
+#
+# Con varios procesos (workers web + nodo de captura) la tabla vive en
+# Redis (RegistroDispositivosRedis): mismos métodos, y cada cambio es un
+# script Lua, igual de atómico que el reemplazo de la tabla en memoria.
+#
+# Seleccionar un paciente nunca quita en silencio un dispositivo a otro
+# paciente: vincular_seleccion lanza DispositivoOcupado y el llamador decide
+# (admin o dueño de ese paciente) si repite con reemplazable=<paciente previo>.
+
+import time
+import threading
+
+
+class DispositivoOcupado(RuntimeError):
+    """El dispositivo está vinculado a otro paciente"""
+
+    def __init__(self, dispositivo, paciente_id):
+        super().__init__(f"El dispositivo {dispositivo} está vinculado a otro paciente")
+        self.dispositivo = dispositivo
+        self.paciente_id = paciente_id
+
+
+class RegistroDispositivos:
+    """
+    Vinculaciones dispositivo ↔ paciente y dispositivos vistos
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Solo para escritores
+        self._tabla = {}               # dispositivo -> paciente_id (se reemplaza, nunca se muta)
+        self._vistos = {}              # dispositivo -> time.time() de la última ventana
+
+    # ============================================================================
+    # CONSULTAS (hilo de captura, sin lock)
+    # ============================================================================
+
+    def paciente_de(self, dispositivo):
+        """
+        Returns:
+            str: paciente_id vinculado al dispositivo o None
+        """
+        return self._tabla.get(dispositivo)
+
+    def dispositivo_de(self, paciente_id):
+        """
+        Returns:
+            str: Dispositivo vinculado al paciente o None
+        """
+        for dispositivo, paciente in self._tabla.items():
+            if paciente == paciente_id:
+                return dispositivo
+        return None
+
+    def visto(self, dispositivo):
+        """Marca actividad del dispositivo (una vez por ventana)"""
+        self._vistos[dispositivo] = time.time()
+
+    def listar(self):
+        """
+        Returns:
+            list: [{'dispositivo', 'paciente_id', 'ultimo_visto'}] de dispositivos vistos o vinculados
+        """
+        tabla = self._tabla
+        vistos = dict(self._vistos)
+        return [
+            {'dispositivo': d, 'paciente_id': tabla.get(d), 'ultimo_visto': vistos.get(d)}
+            for d in sorted(set(tabla) | set(vistos))
+        ]
+
+    # ============================================================================
+    # CAMBIOS (atómicos)
+    # ============================================================================
+
+    def vincular(self, dispositivo, paciente_id):
+        """
+        Vincula un dispositivo a un paciente. Deshace en el mismo paso la
+        vinculación previa del dispositivo y la del paciente con otro dispositivo.
+        """
+        with self._lock:
+            self._reemplazar(dispositivo, paciente_id)
+
+    def _reemplazar(self, dispositivo, paciente_id):
+        """Construye la tabla nueva y la publica (llamar con el lock tomado)"""
+        tabla = {d: p for d, p in self._tabla.items() if p != paciente_id}
+        tabla[dispositivo] = paciente_id
+        self._tabla = tabla
+
+    def desvincular(self, dispositivo=None, paciente_id=None):
+        """Quita la vinculación de un dispositivo o de un paciente"""
+        with self._lock:
+            self._tabla = {
+                d: p for d, p in self._tabla.items()
+                if d != dispositivo and p != paciente_id
+            }
+
+    def vincular_seleccion(self, paciente_id, dispositivo=None, reemplazable=None):
+        """
+        Vinculación al seleccionar un paciente en el dashboard
+
+        Con dispositivo explícito lo vincula. Sin él: si el paciente ya tiene
+        dispositivo se conserva; si solo hay un dispositivo conocido se usa
+        ese (instalación clásica de un único ESP32).
+
+        Args:
+            reemplazable: paciente_id al que se le puede quitar el dispositivo
+                (el de un DispositivoOcupado anterior, si el usuario puede)
+
+        Returns:
+            str: Dispositivo vinculado al paciente o None si no se pudo decidir
+
+        Raises:
+            DispositivoOcupado: El dispositivo está vinculado a otro paciente
+                distinto de reemplazable (no se cambia nada)
+        """
+        with self._lock:
+            if not dispositivo:
+                actual = self.dispositivo_de(paciente_id)
+                if actual:
+                    return actual
+                conocidos = set(self._vistos) | set(self._tabla)
+                if len(conocidos) != 1:
+                    return None
+                dispositivo = next(iter(conocidos))
+
+            previo = self._tabla.get(dispositivo)
+            if previo not in (None, paciente_id, reemplazable):
+                raise DispositivoOcupado(dispositivo, previo)
+            self._reemplazar(dispositivo, paciente_id)
+            return dispositivo
+
+
+# ============================================================================
+# REDIS (compartido entre procesos)
+# ============================================================================
+
+# KEYS: dispositivo->paciente, paciente->dispositivo, vistos
+# ARGV: paciente_id, dispositivo ('' = elegir como vincular_seleccion),
+#       paciente reemplazable ('' = ninguno, '*' = cualquiera)
+# Devuelve el dispositivo, false si no se pudo decidir o {dispositivo, paciente}
+# si está vinculado a otro paciente (sin cambios)
+_LUA_VINCULAR = """
+local function vincular(d, p)
+  local d_previo = redis.call('HGET', KEYS[2], p)
+  if d_previo then redis.call('HDEL', KEYS[1], d_previo) end
+  local p_previo = redis.call('HGET', KEYS[1], d)
+  if p_previo then redis.call('HDEL', KEYS[2], p_previo) end
+  redis.call('HSET', KEYS[1], d, p)
+  redis.call('HSET', KEYS[2], p, d)
+  return d
+end
+local p, d, r = ARGV[1], ARGV[2], ARGV[3]
+if d == '' then
+  local actual = redis.call('HGET', KEYS[2], p)
+  if actual then return actual end
+  local conocidos, n = {}, 0
+  for _, x in ipairs(redis.call('HKEYS', KEYS[3])) do conocidos[x] = true end
+  for _, x in ipairs(redis.call('HKEYS', KEYS[1])) do conocidos[x] = true end
+  for x in pairs(conocidos) do n = n + 1; d = x end
+  if n ~= 1 then return false end
+end
+local previo = redis.call('HGET', KEYS[1], d)
+if previo and previo ~= p and previo ~= r and r ~= '*' then return {d, previo} end
+return vincular(d, p)
+"""
+
+# KEYS: dispositivo->paciente, paciente->dispositivo; ARGV: dispositivo, paciente_id ('' = ninguno)
+_LUA_DESVINCULAR = """
+local d, p = ARGV[1], ARGV[2]
+if d ~= '' then
+  local p_previo = redis.call('HGET', KEYS[1], d)
+  if p_previo then redis.call('HDEL', KEYS[2], p_previo) end
+  redis.call('HDEL', KEYS[1], d)
+end
+if p ~= '' then
+  local d_previo = redis.call('HGET', KEYS[2], p)
+  if d_previo then redis.call('HDEL', KEYS[1], d_previo) end
+  redis.call('HDEL', KEYS[2], p)
+end
+"""
+
+
+class RegistroDispositivosRedis:
+    """
+    Mismas vinculaciones que RegistroDispositivos, en hashes de Redis
+    """
+
+    def __init__(self, url, prefijo="drcorazon:"):
+        import redis  # Opcional: solo para despliegues con varios procesos
+
+        self._r = redis.Redis.from_url(url, decode_responses=True)
+        self._claves = [prefijo + "vinculos", prefijo + "vinculos_paciente", prefijo + "vistos"]
+        self._vincular = self._r.register_script(_LUA_VINCULAR)
+        self._desvincular = self._r.register_script(_LUA_DESVINCULAR)
+
+    def paciente_de(self, dispositivo):
+        return self._r.hget(self._claves[0], dispositivo)
+
+    def dispositivo_de(self, paciente_id):
+        return self._r.hget(self._claves[1], paciente_id)
+
+    def visto(self, dispositivo):
+        self._r.hset(self._claves[2], dispositivo, time.time())
+
+    def listar(self):
+        tabla = self._r.hgetall(self._claves[0])
+        vistos = {d: float(t) for d, t in self._r.hgetall(self._claves[2]).items()}
+        return [
+            {'dispositivo': d, 'paciente_id': tabla.get(d), 'ultimo_visto': vistos.get(d)}
+            for d in sorted(set(tabla) | set(vistos))
+        ]
+
+    def vincular(self, dispositivo, paciente_id):
+        self._vincular(keys=self._claves, args=[paciente_id, dispositivo, '*'])
+
+    def desvincular(self, dispositivo=None, paciente_id=None):
+        self._desvincular(keys=self._claves[:2], args=[dispositivo or '', paciente_id or ''])
+
+    def vincular_seleccion(self, paciente_id, dispositivo=None, reemplazable=None):
+        resultado = self._vincular(keys=self._claves, args=[paciente_id, dispositivo or '', reemplazable or ''])
+        if isinstance(resultado, list):
+            raise DispositivoOcupado(*resultado)
+        return resultado or None
+
+
+def crear_registro(url=None):
+    """
+    Args:
+        url: URL de Redis; None para la tabla en memoria (un solo proceso)
+    """
+    if not url:
+        return RegistroDispositivos()
+    return RegistroDispositivosRedis(url)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    print("📟 Registro de dispositivos")
+    print("=" * 50)
+
+    registro = RegistroDispositivos()
+    registro.visto("10.0.0.5")
+
+    # Único dispositivo: se vincula al primer paciente seleccionado
+    assert registro.vincular_seleccion("paciente-a") == "10.0.0.5"
+
+    # Otro paciente no se lo quita: ni por el dispositivo único ni explícito
+    for explicito in (None, "10.0.0.5"):
+        try:
+            registro.vincular_seleccion("paciente-b", explicito)
+            raise AssertionError("Se reasignó un dispositivo ajeno")
+        except DispositivoOcupado as e:
+            assert (e.dispositivo, e.paciente_id) == ("10.0.0.5", "paciente-a")
+    assert registro.paciente_de("10.0.0.5") == "paciente-a"
+
+    # Con permiso sobre el paciente previo (admin o dueño) se reasigna
+    assert registro.vincular_seleccion("paciente-b", "10.0.0.5", reemplazable="paciente-a") == "10.0.0.5"
+    assert registro.paciente_de("10.0.0.5") == "paciente-b"
+    assert registro.dispositivo_de("paciente-a") is None
+
+    print("✅ Módulo funcionando correctamente!")
@@ -0,0 +1,619 @@
+# repositorio.py - Acceso a datos: perfiles, pacientes, diagnósticos y señales
+#
+# Toda lectura/escritura de tablas pasa por un repositorio con la misma
+# interfaz en dos implementaciones:
+#   - RepositorioSupabase: PostgREST (la BD en la nube, por defecto)
+#   - RepositorioSQLite:   archivo local con los mismos esquemas e índices
+#                          (instalaciones on-prem, pruebas de carga, benchmarks)
+#
+# Las filas tienen la misma forma en ambos (timestamps ISO en UTC, relaciones
+# embebidas como dict), así que el resto del código no distingue el backend.
+# La autenticación (login, registro, JWT) sigue siendo de Supabase Auth.
+#
+# Uso:
+#   repo = crear_repositorio("sqlite:///dr_corazon_local.db")
+#   paciente = repo.crear_paciente({'nombre': 'Ana', 'user_id': uid})
+#   filas, siguiente = repo.listar_diagnosticos(paciente['id'], cursor=None, limite=50)
+
+import json
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from paginacion import paginar, codificar_cursor, decodificar_cursor, LIMITE_MAX
+from senales_compactas import desde_base64, desde_bytea
+
+TABLAS = ('user_profiles', 'pacientes', 'diagnosticos', 'senales_ecg')
+
+
+# ============================================================================
+# SUPABASE (PostgREST)
+# ============================================================================
+
+class RepositorioSupabase:
+    """
+    Repositorio sobre un cliente de Supabase
+    """
+
+    def __init__(self, cliente):
+        """
+        Args:
+            cliente: pool_supabase.PoolSupabase (o supabase.Client)
+        """
+        self.cliente = cliente
+
+    def _tabla(self, nombre):
+        return self.cliente.table(nombre)
+
+    # --- perfiles ---
+
+    def obtener_perfil(self, user_id, columnas="*"):
+        filas = self._tabla('user_profiles').select(columnas).eq('id', user_id).limit(1).execute().data
+        return filas[0] if filas else None
+
+    def listar_perfiles(self, cursor=None, limite=LIMITE_MAX):
+        """
+        Returns:
+            tuple: (perfiles, cursor siguiente) en orden de creación
+        """
+        return paginar(self._tabla('user_profiles').select('*'), cursor, limite, ('created_at', 'id'), desc=False)
+
+    def guardar_perfil(self, perfil):
+        return self._tabla('user_profiles').upsert(perfil).execute().data[0]
+
+    def actualizar_perfil(self, user_id, campos):
+        self._tabla('user_profiles').update(campos).eq('id', user_id).execute()
+
+    def registrar_acceso(self, user_id):
+        """Marca el último acceso del usuario (login)"""
+        self.cliente.rpc('update_user_last_access', {'user_id': user_id}).execute()
+
+    # --- pacientes ---
+
+    def crear_paciente(self, datos):
+        return self._tabla('pacientes').insert(datos).execute().data[0]
+
+    def obtener_paciente(self, paciente_id, columnas="*"):
+        filas = self._tabla('pacientes').select(columnas).eq('id', paciente_id).limit(1).execute().data
+        return filas[0] if filas else None
+
+    def listar_pacientes(self, user_id=None, cursor=None, limite=100, columnas=("*",), desc=False,
+                         con_usuario=False):
+        """
+        Args:
+            user_id: Dueño de los pacientes (None = todos, para administradores)
+            columnas: Columnas de pacientes (ya validadas por el llamador)
+            con_usuario: Embebe 'user_profiles': {'email', 'nombre_completo'} del dueño
+
+        Returns:
+            tuple: (pacientes, cursor siguiente), por (created_at, id)
+        """
+        seleccion = list(columnas) + (['user_profiles(email, nombre_completo)'] if con_usuario else [])
+        consulta = self._tabla('pacientes').select(", ".join(seleccion))
+        if user_id is not None:
+            consulta = consulta.eq('user_id', user_id)
+        return paginar(consulta, cursor, limite, ('created_at', 'id'), desc=desc)
+
+    # --- diagnósticos y señales ---
+
+    def insertar(self, tabla, filas):
+        """
+        Returns:
+            list: Filas insertadas (con 'id'), en el mismo orden
+        """
+        if not filas:
+            return []
+        return self._tabla(tabla).insert(filas).execute().data
+
+    def listar_diagnosticos(self, paciente_id, cursor=None, limite=10, columnas=("*",), desc=True):
+        """
+        Returns:
+            tuple: (diagnósticos, cursor siguiente), por (timestamp, id)
+        """
+        consulta = self._tabla('diagnosticos').select(", ".join(columnas)).eq('paciente_id', paciente_id)
+        return paginar(consulta, cursor, limite, ('timestamp', 'id'), desc=desc)
+
+    def alertas_criticas(self, limite=20):
+        """
+        Returns:
+            list: Diagnósticos con alerta crítica, más recientes primero, con 'pacientes' embebido
+        """
+        return self._tabla('diagnosticos')\
+            .select("*, pacientes(nombre, identificacion)")\
+            .eq("alerta_critica", True)\
+            .order("timestamp", desc=True)\
+            .limit(limite)\
+            .execute().data
+
+    def senales(self, diagnostico_ids):
+        """
+        Returns:
+            list: Filas de senales_ecg (diagnostico_id, senal_comprimida, canal_x/y/z)
+        """
+        if not diagnostico_ids:
+            return []
+        return self._tabla('senales_ecg')\
+            .select('diagnostico_id, senal_comprimida, canal_x, canal_y, canal_z')\
+            .in_('diagnostico_id', list(diagnostico_ids))\
+            .execute().data
+
+    # --- agregados ---
+
+    def estadisticas_paciente(self, paciente_id):
+        """
+        Returns:
+            dict: Fila de estadisticas_paciente (total, por_tipo, alertas_criticas,
+                ultimo_*) o None si no tiene diagnósticos
+        """
+        filas = self._tabla('estadisticas_paciente').select('*').eq('paciente_id', paciente_id).limit(1).execute().data
+        return filas[0] if filas else None
+
+    def rollups(self, paciente_id, resolucion_seg, desde, limite):
+        """
+        Args:
+            desde: datetime (UTC) del primer bucket
+
+        Returns:
+            list: Buckets de rollup_paciente en orden temporal
+        """
+        return self._tabla('rollup_paciente')\
+            .select("inicio, n, n_hr, hr_min, hr_max, hr_suma, n_hrv, sdnn_suma, rmssd_suma, alertas")\
+            .eq("paciente_id", paciente_id)\
+            .eq("resolucion_seg", resolucion_seg)\
+            .gte("inicio", desde.isoformat())\
+            .order("inicio")\
+            .limit(limite)\
+            .execute().data
+
+    def estadisticas_usuario(self, user_id):
+        """
+        Returns:
+            dict: total_pacientes, total_diagnosticos y alertas_criticas del usuario
+        """
+        filas = self.cliente.rpc('estadisticas_usuario', {'p_user_id': user_id}).execute().data
+        return filas[0] if filas else {}
+
+    def estadisticas_usuarios(self):
+        """
+        Returns:
+            list: Por usuario: email, num_pacientes, num_diagnosticos, alertas_criticas,
+                hr_promedio, hrv_sdnn_promedio
+        """
+        return self._tabla('vista_estadisticas_usuarios').select('*').execute().data
+
+
+# ============================================================================
+# SQLITE (local)
+# ============================================================================
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS user_profiles (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    nombre_completo TEXT,
+    rol TEXT CHECK (rol IN ('usuario', 'administrador')),
+    created_at TEXT NOT NULL,
+    ultimo_acceso TEXT,
+    activo INTEGER DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS pacientes (
+    id TEXT PRIMARY KEY,
+    user_id TEXT REFERENCES user_profiles(id),
+    nombre TEXT NOT NULL,
+    identificacion TEXT,
+    edad INTEGER,
+    genero TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS diagnosticos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    paciente_id TEXT REFERENCES pacientes(id),
+    timestamp TEXT NOT NULL,
+    diagnostico TEXT NOT NULL,
+    probabilidad_normal REAL,
+    probabilidad_infarto REAL,
+    probabilidad_bradicardia REAL,
+    probabilidad_taquicardia REAL,
+    tiempo_analisis REAL,
+    alerta_critica INTEGER DEFAULT 0,
+    notas TEXT,
+    hr_bpm REAL,
+    hrv_sdnn REAL,
+    hrv_rmssd REAL,
+    hrv_pnn50 REAL,
+    num_picos_r INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS senales_ecg (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    diagnostico_id INTEGER REFERENCES diagnosticos(id),
+    senal_comprimida BLOB,
+    canal_x TEXT,
+    canal_y TEXT,
+    canal_z TEXT,
+    frecuencia_muestreo INTEGER,
+    duracion_segundos INTEGER
+);
+
+-- Historial y paginación por paciente; alertas críticas recientes
+CREATE INDEX IF NOT EXISTS idx_diagnosticos_paciente_ts ON diagnosticos (paciente_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_diagnosticos_alerta_ts ON diagnosticos (alerta_critica, timestamp);
+CREATE INDEX IF NOT EXISTS idx_pacientes_user_creado ON pacientes (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_senales_diagnostico ON senales_ecg (diagnostico_id);
+"""
+
+_BOOLEANAS = {'alerta_critica', 'activo'}
+_JSON = {'canal_x', 'canal_y', 'canal_z'}
+
+
+def _ahora():
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+
+def _iso(valor):
+    """Timestamp → ISO UTC con microsegundos (formato fijo: se compara como texto)"""
+    if isinstance(valor, str):
+        valor = datetime.fromisoformat(valor)
+    if valor.tzinfo is None:
+        valor = valor.replace(tzinfo=timezone.utc)
+    return valor.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+class RepositorioSQLite:
+    """
+    Repositorio sobre un archivo SQLite (WAL) con el esquema de Supabase.
+    Las estadísticas y rollups se calculan con consultas agregadas sobre
+    idx_diagnosticos_paciente_ts en lugar de tablas mantenidas por trigger.
+    """
+
+    def __init__(self, ruta="dr_corazon_local.db"):
+        """
+        Args:
+            ruta: Archivo de la base (":memory:" para pruebas)
+        """
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_ESQUEMA)
+        self._columnas = {
+            tabla: [c[1] for c in self._conn.execute(f"PRAGMA table_info({tabla})")]
+            for tabla in TABLAS
+        }
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return [self._fila(f) for f in self._conn.execute(sql, parametros).fetchall()]
+
+    @staticmethod
+    def _fila(registro):
+        fila = dict(registro)
+        for clave in _BOOLEANAS & fila.keys():
+            if fila[clave] is not None:
+                fila[clave] = bool(fila[clave])
+        for clave in _JSON & fila.keys():
+            if fila[clave] is not None:
+                fila[clave] = json.loads(fila[clave])
+        return fila
+
+    def _seleccion(self, tabla, columnas):
+        """Columnas pedidas → SQL (solo columnas existentes: se interpolan)"""
+        if list(columnas) == ["*"]:
+            return ", ".join(f"{tabla}.{c}" for c in self._columnas[tabla])
+        validas = [c for c in columnas if c in self._columnas[tabla]]
+        if len(validas) != len(columnas):
+            raise ValueError(f"Columnas desconocidas en {tabla}: {set(columnas) - set(validas)}")
+        return ", ".join(f"{tabla}.{c}" for c in validas)
+
+    def _pagina(self, tabla, seleccion, donde, parametros, cursor, limite, orden, desc, union=""):
+        """Página keyset: misma semántica y cursores que paginacion.paginar()"""
+        limite = max(1, min(int(limite), LIMITE_MAX))
+        col1, col2 = (f"{tabla}.{c}" for c in orden)
+        condiciones, parametros = list(donde), list(parametros)
+        if cursor:
+            condiciones.append(f"({col1}, {col2}) {'<' if desc else '>'} (?, ?)")
+            parametros.extend(decodificar_cursor(cursor, orden))
+        sentido = "DESC" if desc else "ASC"
+        sql = (f"SELECT {seleccion} FROM {tabla} {union}"
+               f"{' WHERE ' + ' AND '.join(condiciones) if condiciones else ''} "
+               f"ORDER BY {col1} {sentido}, {col2} {sentido} LIMIT ?")
+        filas = self._consultar(sql, parametros + [limite + 1])
+        if len(filas) <= limite:
+            return filas, None
+        filas = filas[:limite]
+        return filas, codificar_cursor(filas[-1], orden)
+
+    def _preparar(self, tabla, fila):
+        if fila.get('senal_comprimida_b64') is not None:
+            # Lo que en Supabase hace el trigger decodificar_senal_b64
+            fila = dict(fila, senal_comprimida=desde_base64(fila['senal_comprimida_b64']))
+        fila = {c: v for c, v in fila.items() if c in self._columnas[tabla]}
+        if tabla in ('user_profiles', 'pacientes'):
+            fila.setdefault('id', str(uuid.uuid4()))
+            fila['created_at'] = _iso(fila['created_at']) if fila.get('created_at') else _ahora()
+        if tabla == 'diagnosticos':
+            fila['timestamp'] = _iso(fila['timestamp']) if fila.get('timestamp') else _ahora()
+        if fila.get('senal_comprimida') is not None:
+            fila['senal_comprimida'] = desde_bytea(fila['senal_comprimida'])
+        for clave in _JSON & fila.keys():
+            if fila[clave] is not None:
+                fila[clave] = json.dumps([float(v) for v in fila[clave]])
+        return fila
+
+    # --- perfiles ---
+
+    def obtener_perfil(self, user_id, columnas="*"):
+        columnas = [c.strip() for c in columnas.split(',')]
+        filas = self._consultar(
+            f"SELECT {self._seleccion('user_profiles', columnas)} FROM user_profiles WHERE id = ?", (user_id,)
+        )
+        return filas[0] if filas else None
+
+    def listar_perfiles(self, cursor=None, limite=LIMITE_MAX):
+        return self._pagina('user_profiles', self._seleccion('user_profiles', ["*"]), [], [],
+                            cursor, limite, ('created_at', 'id'), desc=False)
+
+    def guardar_perfil(self, perfil):
+        fila = self._preparar('user_profiles', perfil)
+        actualizar = [c for c in perfil if c in fila and c != 'id'] or ['email']
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO user_profiles ({', '.join(fila)}) VALUES ({', '.join('?' * len(fila))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in actualizar)}",
+                list(fila.values())
+            )
+        return self.obtener_perfil(fila['id'])
+
+    def actualizar_perfil(self, user_id, campos):
+        campos = {c: v for c, v in campos.items() if c in self._columnas['user_profiles']}
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE user_profiles SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?",
+                list(campos.values()) + [user_id]
+            )
+
+    def registrar_acceso(self, user_id):
+        self.actualizar_perfil(user_id, {'ultimo_acceso': _ahora()})
+
+    # --- pacientes ---
+
+    def crear_paciente(self, datos):
+        return self.insertar('pacientes', [datos])[0]
+
+    def obtener_paciente(self, paciente_id, columnas="*"):
+        columnas = [c.strip() for c in columnas.split(',')]
+        filas = self._consultar(
+            f"SELECT {self._seleccion('pacientes', columnas)} FROM pacientes WHERE id = ?", (paciente_id,)
+        )
+        return filas[0] if filas else None
+
+    def listar_pacientes(self, user_id=None, cursor=None, limite=100, columnas=("*",), desc=False,
+                         con_usuario=False):
+        seleccion = self._seleccion('pacientes', columnas)
+        union = ""
+        if con_usuario:
+            seleccion += ", u.email AS _email, u.nombre_completo AS _nombre_completo"
+            union = "LEFT JOIN user_profiles u ON u.id = pacientes.user_id"
+        donde, parametros = ([], []) if user_id is None else (["pacientes.user_id = ?"], [user_id])
+        filas, siguiente = self._pagina('pacientes', seleccion, donde, parametros,
+                                        cursor, limite, ('created_at', 'id'), desc, union)
+        if con_usuario:
+            for fila in filas:
+                email, nombre = fila.pop('_email'), fila.pop('_nombre_completo')
+                fila['user_profiles'] = {'email': email, 'nombre_completo': nombre} if email else None
+        return filas, siguiente
+
+    # --- diagnósticos y señales ---
+
+    def insertar(self, tabla, filas):
+        if tabla not in TABLAS:
+            raise ValueError(f"Tabla desconocida: {tabla}")
+        if not filas:
+            return []
+        preparadas = [self._preparar(tabla, fila) for fila in filas]
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for fila in preparadas:
+                    cur = self._conn.execute(
+                        f"INSERT INTO {tabla} ({', '.join(fila)}) VALUES ({', '.join('?' * len(fila))})",
+                        list(fila.values())
+                    )
+                    ids.append(fila.get('id', cur.lastrowid))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        marcas = ", ".join("?" * len(ids))
+        por_id = {f['id']: f for f in self._consultar(f"SELECT * FROM {tabla} WHERE id IN ({marcas})", ids)}
+        return [por_id[i] for i in ids]
+
+    def listar_diagnosticos(self, paciente_id, cursor=None, limite=10, columnas=("*",), desc=True):
+        return self._pagina('diagnosticos', self._seleccion('diagnosticos', columnas),
+                            ["diagnosticos.paciente_id = ?"], [paciente_id],
+                            cursor, limite, ('timestamp', 'id'), desc)
+
+    def alertas_criticas(self, limite=20):
+        filas = self._consultar(
+            f"SELECT {self._seleccion('diagnosticos', ['*'])}, p.nombre AS _nombre, p.identificacion AS _identificacion "
+            "FROM diagnosticos LEFT JOIN pacientes p ON p.id = diagnosticos.paciente_id "
+            "WHERE diagnosticos.alerta_critica = 1 ORDER BY diagnosticos.timestamp DESC LIMIT ?",
+            (limite,)
+        )
+        for fila in filas:
+            fila['pacientes'] = {'nombre': fila.pop('_nombre'), 'identificacion': fila.pop('_identificacion')}
+        return filas
+
+    def senales(self, diagnostico_ids):
+        if not diagnostico_ids:
+            return []
+        diagnostico_ids = list(diagnostico_ids)
+        return self._consultar(
+            "SELECT diagnostico_id, senal_comprimida, canal_x, canal_y, canal_z FROM senales_ecg "
+            f"WHERE diagnostico_id IN ({', '.join('?' * len(diagnostico_ids))})",
+            diagnostico_ids
+        )
+
+    # --- agregados ---
+
+    def estadisticas_paciente(self, paciente_id):
+        por_tipo = self._consultar(
+            "SELECT diagnostico, COUNT(*) AS n, SUM(alerta_critica) AS alertas "
+            "FROM diagnosticos WHERE paciente_id = ? GROUP BY diagnostico",
+            (paciente_id,)
+        )
+        if not por_tipo:
+            return None
+        ultimo = self._consultar(
+            "SELECT diagnostico, alerta_critica, timestamp FROM diagnosticos "
+            "WHERE paciente_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+            (paciente_id,)
+        )[0]
+        return {
+            'paciente_id': paciente_id,
+            'total': sum(f['n'] for f in por_tipo),
+            'por_tipo': {f['diagnostico']: f['n'] for f in por_tipo},
+            'alertas_criticas': sum(f['alertas'] or 0 for f in por_tipo),
+            'ultimo_diagnostico': ultimo['diagnostico'],
+            'ultimo_alerta_critica': ultimo['alerta_critica'],
+            'ultimo_timestamp': ultimo['timestamp']
+        }
+
+    def rollups(self, paciente_id, resolucion_seg, desde, limite):
+        filas = self._consultar(
+            """
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER) / :r * :r AS bucket,
+                   COUNT(*) AS n,
+                   COUNT(hr_bpm) AS n_hr,
+                   MIN(hr_bpm) AS hr_min,
+                   MAX(hr_bpm) AS hr_max,
+                   COALESCE(SUM(hr_bpm), 0) AS hr_suma,
+                   SUM(hrv_sdnn IS NOT NULL AND hrv_rmssd IS NOT NULL) AS n_hrv,
+                   COALESCE(SUM(CASE WHEN hrv_sdnn IS NOT NULL AND hrv_rmssd IS NOT NULL THEN hrv_sdnn END), 0) AS sdnn_suma,
+                   COALESCE(SUM(CASE WHEN hrv_sdnn IS NOT NULL AND hrv_rmssd IS NOT NULL THEN hrv_rmssd END), 0) AS rmssd_suma,
+                   SUM(alerta_critica) AS alertas
+            FROM diagnosticos
+            WHERE paciente_id = :p AND timestamp >= :desde
+            GROUP BY bucket ORDER BY bucket LIMIT :limite
+            """,
+            {'r': resolucion_seg, 'p': paciente_id, 'desde': _iso(desde), 'limite': limite}
+        )
+        for fila in filas:
+            fila['inicio'] = datetime.fromtimestamp(fila.pop('bucket'), timezone.utc).isoformat()
+        return filas
+
+    def estadisticas_usuario(self, user_id):
+        return self._consultar(
+            "SELECT COUNT(DISTINCT p.id) AS total_pacientes, COUNT(d.id) AS total_diagnosticos, "
+            "COALESCE(SUM(d.alerta_critica), 0) AS alertas_criticas "
+            "FROM pacientes p LEFT JOIN diagnosticos d ON d.paciente_id = p.id WHERE p.user_id = ?",
+            (user_id,)
+        )[0]
+
+    def estadisticas_usuarios(self):
+        return self._consultar(
+            "SELECT u.id AS user_id, u.email, u.nombre_completo, u.rol, "
+            "COUNT(DISTINCT p.id) AS num_pacientes, COUNT(d.id) AS num_diagnosticos, "
+            "COALESCE(SUM(d.alerta_critica), 0) AS alertas_criticas, "
+            "AVG(d.hr_bpm) AS hr_promedio, AVG(d.hrv_sdnn) AS hrv_sdnn_promedio "
+            "FROM user_profiles u "
+            "LEFT JOIN pacientes p ON p.user_id = u.id "
+            "LEFT JOIN diagnosticos d ON d.paciente_id = p.id "
+            "GROUP BY u.id ORDER BY u.created_at"
+        )
+
+
+def crear_repositorio(url=None, cliente=None):
+    """
+    Args:
+        url: "sqlite:///ruta.db" para la base local; None/vacío para Supabase
+        cliente: supabase.Client (requerido si no hay url)
+    """
+    if url:
+        if not url.startswith("sqlite:///"):
+            raise ValueError(f"URL de base de datos no soportada: {url}")
+        return RepositorioSQLite(url[len("sqlite:///"):])
+    return RepositorioSupabase(cliente)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    import time
+    import random
+    from datetime import timedelta
+
+    print("🗄️  Repositorio SQLite")
+    print("=" * 50)
+
+    repo = crear_repositorio("sqlite:///:memory:")
+    usuario = repo.guardar_perfil({'id': 'u1', 'email': 'ana@ejemplo.com', 'rol': 'usuario'})
+    assert usuario['activo'] is True
+    repo.actualizar_perfil('u1', {'rol': 'administrador'})
+    assert repo.obtener_perfil('u1', 'rol')['rol'] == 'administrador'
+
+    pacientes = [repo.crear_paciente({'nombre': f'Paciente {i}', 'user_id': 'u1'}) for i in range(3)]
+    pid = pacientes[0]['id']
+    filas, siguiente = repo.listar_pacientes('u1', limite=2, columnas=['id', 'nombre', 'created_at'],
+                                            con_usuario=True)
+    assert len(filas) == 2 and filas[0]['user_profiles']['email'] == 'ana@ejemplo.com'
+    filas, siguiente = repo.listar_pacientes('u1', cursor=siguiente, limite=2, columnas=['id', 'created_at'])
+    assert [f['id'] for f in filas] == [pacientes[2]['id']] and siguiente is None
+
+    # Un día de diagnósticos cada 10 s
+    inicio = datetime.now(timezone.utc) - timedelta(days=1)
+    lote = [{
+        'paciente_id': pid,
+        'timestamp': inicio + timedelta(seconds=10 * i),
+        'diagnostico': 'Taquicardia' if i % 100 == 0 else 'Normal',
+        'alerta_critica': i % 500 == 0,
+        'hr_bpm': random.uniform(60, 100),
+        'hrv_sdnn': 50.0,
+        'hrv_rmssd': 30.0
+    } for i in range(8640)]
+    t0 = time.perf_counter()
+    insertadas = repo.insertar('diagnosticos', lote)
+    print(f"  Insertar 8640 diagnósticos: {(time.perf_counter() - t0) * 1000:.0f} ms")
+    assert [f['id'] for f in insertadas] == list(range(1, 8641))
+    repo.insertar('senales_ecg', [{'diagnostico_id': 1, 'senal_comprimida': '\\x0102',
+                                   'canal_x': [1], 'canal_y': [2], 'canal_z': [3]}])
+    assert repo.senales([1])[0]['senal_comprimida'] == b'\x01\x02'
+    repo.insertar('senales_ecg', [{'diagnostico_id': 2, 'senal_comprimida_b64': 'AwQ='}])
+    assert repo.senales([2])[0]['senal_comprimida'] == b'\x03\x04'
+
+    # Paginación: recorrer todo sin repetir ni saltar
+    vistos, cursor = [], None
+    while True:
+        filas, cursor = repo.listar_diagnosticos(pid, cursor, limite=500, columnas=['id', 'timestamp'])
+        vistos.extend(f['id'] for f in filas)
+        if not cursor:
+            break
+    assert vistos == list(range(8640, 0, -1))
+
+    t0 = time.perf_counter()
+    stats = repo.estadisticas_paciente(pid)
+    alertas = repo.alertas_criticas(5)
+    rollups = repo.rollups(pid, 3600, inicio, 1000)
+    print(f"  Estadísticas + alertas + rollups: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    assert stats['total'] == 8640 and stats['por_tipo']['Taquicardia'] == 87 and stats['alertas_criticas'] == 18
+    assert alertas[0]['pacientes']['nombre'] == 'Paciente 0' and alertas[0]['alerta_critica'] is True
+    assert sum(r['n'] for r in rollups) == 8640 and rollups[1]['n_hrv'] == rollups[1]['n']
+    assert repo.estadisticas_usuario('u1') == {'total_pacientes': 3, 'total_diagnosticos': 8640,
+                                               'alertas_criticas': 18}
+    assert repo.estadisticas_usuarios()[0]['num_diagnosticos'] == 8640
+
+    plan = repo._consultar(
+        "EXPLAIN QUERY PLAN SELECT * FROM diagnosticos WHERE alerta_critica = 1 ORDER BY timestamp DESC LIMIT 5"
+    )
+    assert 'idx_diagnosticos_alerta_ts' in plan[0]['detail']
+    print(f"  Plan de alertas: {plan[0]['detail']}")
+
+    print("\n✅ Módulo funcionando correctamente!")
@@ -0,0 +1,273 @@
+# senales_compactas.py - Almacenamiento binario comprimido de señales ECG
+#
+# Sustituye las listas JSON de floats (canal_x/canal_y/canal_z) por un blob:
+#   cabecera | int16 cuantizado con escala por canal, deltas, bytes separados, comprimido
+# Una ventana de 10 s (5000 x 3) pasa de ~300 KB de JSON a unos pocos KB.
+
+import zlib
+import base64
+import struct
+import threading
+import numpy as np
+
+# zstd es opcional: si no está instalado se usa zlib (librería estándar)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Los (de)compresores zstd no son thread-safe y los usan a la vez el escritor,
+# los hilos de tpool y los de las peticiones: uno por hilo
+_zstd_hilo = threading.local()
+
+
+def _zstd():
+    """(compresor, descompresor) zstd del hilo actual"""
+    if not hasattr(_zstd_hilo, 'c'):
+        _zstd_hilo.c = zstandard.ZstdCompressor(level=3)
+        _zstd_hilo.d = zstandard.ZstdDecompressor()
+    return _zstd_hilo.c, _zstd_hilo.d
+
+MAGIC = b"DCS1"
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# magic, codec, n_canales, n_muestras, fs
+_CABECERA = struct.Struct("<4sBBIf")
+_MAX_INT16 = 32767
+
+
+def comprimir_senal(senal, frecuencia_muestreo=500):
+    """
+    Cuantiza y comprime una ventana ECG
+
+    Args:
+        senal: Array (N, C) o 1D con la señal (float)
+        frecuencia_muestreo: Hz de la señal
+
+    Returns:
+        bytes: Blob autocontenido (cabecera + escalas + datos comprimidos)
+    """
+    senal = np.asarray(senal, dtype=np.float32)
+    if senal.ndim == 1:
+        senal = senal[:, None]
+    n_muestras, n_canales = senal.shape
+
+    # Escala por canal: el máximo absoluto ocupa todo el rango int16
+    escalas = np.max(np.abs(senal), axis=0) / _MAX_INT16
+    escalas[escalas == 0] = 1.0
+    cuantizada = np.round(senal / escalas).astype(np.int16)
+
+    # Deltas por canal (aritmética int16 con desborde: se invierte exactamente con cumsum)
+    deltas = np.empty_like(cuantizada)
+    deltas[0] = cuantizada[0]
+    np.subtract(cuantizada[1:], cuantizada[:-1], out=deltas[1:])
+
+    # Canal por canal y con bytes separados (todos los bytes bajos, luego los
+    # altos, estilo blosc "shuffle"): los deltas pequeños dejan los altos casi constantes
+    crudo = np.ascontiguousarray(deltas.T).view(np.uint8).reshape(-1, 2).T.tobytes()
+    if zstandard is not None:
+        codec, datos = CODEC_ZSTD, _zstd()[0].compress(crudo)
+    else:
+        codec, datos = CODEC_ZLIB, zlib.compress(crudo, 6)
+
+    cabecera = _CABECERA.pack(MAGIC, codec, n_canales, n_muestras, frecuencia_muestreo)
+    return cabecera + escalas.astype(np.float32).tobytes() + datos
+
+
+def descomprimir_senal(blob, cuantizada=False):
+    """
+    Reconstruye la ventana desde un blob de comprimir_senal()
+
+    Los datos se leen con np.frombuffer sobre el buffer descomprimido (sin
+    conversión elemento a elemento como con listas JSON).
+
+    Args:
+        blob: bytes/memoryview devuelto por comprimir_senal (o leído de la BD)
+        cuantizada: Si True retorna el int16 cuantizado y las escalas en lugar de float32
+
+    Returns:
+        tuple: (senal (N, C) float32, fs) o ((N, C) int16, escalas, fs) si cuantizada=True
+    """
+    blob = memoryview(blob)
+    magic, codec, n_canales, n_muestras, fs = _CABECERA.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("Blob de señal no reconocido")
+
+    inicio = _CABECERA.size
+    escalas = np.frombuffer(blob, dtype=np.float32, count=n_canales, offset=inicio)
+    comprimido = blob[inicio + 4 * n_canales:]
+
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Señal comprimida con zstd: instala el paquete 'zstandard'")
+        crudo = _zstd()[1].decompress(comprimido, max_output_size=2 * n_muestras * n_canales)
+    else:
+        crudo = zlib.decompress(comprimido)
+
+    planos = np.frombuffer(crudo, dtype=np.uint8).reshape(2, -1)
+    deltas = np.ascontiguousarray(planos.T).view(np.int16).reshape(n_canales, n_muestras)
+    valores = np.cumsum(deltas, axis=1, dtype=np.int16).T
+
+    if cuantizada:
+        return valores, escalas, fs
+    return valores * escalas, fs
+
+
+# ============================================================================
+# FORMA DE ONDA PARA EL DASHBOARD (adjunto binario de socket.io)
+# ============================================================================
+
+def envolvente_minmax(senal, n_buckets):
+    """
+    Envolvente min/max por bucket: conserva los picos (QRS) que un
+    submuestreo senal[::k] puede saltarse, sin aliasing
+
+    Args:
+        senal: Array (N, C)
+        n_buckets: Número de buckets (≈ píxeles del gráfico)
+
+    Returns:
+        np.ndarray: (2 * n_buckets, C), min y max de cada bucket en orden temporal
+    """
+    senal = np.asarray(senal, dtype=np.float32)
+    n_canales = senal.shape[1]
+    k = len(senal) // n_buckets
+    bloques = senal[:k * n_buckets].reshape(n_buckets, k, n_canales)
+
+    i_min = bloques.argmin(axis=1)
+    i_max = bloques.argmax(axis=1)
+    v_min = np.take_along_axis(bloques, i_min[:, None, :], axis=1)[:, 0, :]
+    v_max = np.take_along_axis(bloques, i_max[:, None, :], axis=1)[:, 0, :]
+
+    # El que ocurre primero en el bucket va primero: el trazo sigue la forma real
+    min_primero = i_min <= i_max
+    salida = np.empty((n_buckets, 2, n_canales), dtype=np.float32)
+    salida[:, 0, :] = np.where(min_primero, v_min, v_max)
+    salida[:, 1, :] = np.where(min_primero, v_max, v_min)
+    return salida.reshape(2 * n_buckets, n_canales)
+
+
+def forma_onda_binaria(senal, frecuencia_muestreo=500, n_buckets=500):
+    """
+    Forma de onda lista para emitir por socket.io como adjunto binario
+
+    La envolvente se cuantiza a int16 con una escala por canal; el cliente
+    la lee con new Int16Array(datos) sin parsear texto.
+
+    Args:
+        senal: Array (N, C) de la ventana
+        frecuencia_muestreo: Hz de la señal
+        n_buckets: Buckets de la envolvente (cada uno aporta 2 puntos)
+
+    Returns:
+        dict: {'datos': bytes int16 intercalado (punto, canal), 'escalas': [...],
+               'puntos', 'canales', 'dt': segundos entre puntos}
+    """
+    senal = np.asarray(senal, dtype=np.float32)
+    envolvente = envolvente_minmax(senal, n_buckets)
+
+    escalas = np.max(np.abs(envolvente), axis=0) / _MAX_INT16
+    escalas[escalas == 0] = 1.0
+    cuantizada = np.round(envolvente / escalas).astype('<i2')
+
+    k = len(senal) // n_buckets
+    return {
+        'datos': cuantizada.tobytes(),
+        'escalas': [float(e) for e in escalas],
+        'puntos': len(envolvente),
+        'canales': envolvente.shape[1],
+        'dt': k / frecuencia_muestreo / 2
+    }
+
+
+# ============================================================================
+# CONVERSIÓN PARA COLUMNAS BYTEA
+# ============================================================================
+# Al insertar, el blob viaja en base64 por senal_comprimida_b64 (4/3 del
+# tamaño, frente al doble del literal hexadecimal) y el trigger
+# decodificar_senal_b64 lo guarda como bytea en senal_comprimida.
+# Al leer, PostgREST devuelve el bytea como texto hexadecimal '\x...'.
+
+def a_base64(blob):
+    """bytes → texto base64 para la columna senal_comprimida_b64"""
+    return base64.b64encode(bytes(blob)).decode('ascii')
+
+
+def desde_base64(valor):
+    """Texto base64 de senal_comprimida_b64 → bytes"""
+    return base64.b64decode(valor)
+
+
+def desde_bytea(valor):
+    """Literal bytea hexadecimal (como lo devuelve PostgREST) → bytes"""
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return bytes(valor)
+    if valor.startswith("\\x"):
+        valor = valor[2:]
+    return bytes.fromhex(valor)
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    print("🗜️  Señales ECG compactas")
+    print("=" * 50)
+
+    # Ventana simulada 5000 x 3 (misma forma que entrega receiver_udp)
+    fs = 500
+    t = np.arange(5000) / fs
+    latidos = sum(np.exp(-((t - c) / 0.012) ** 2) for c in np.arange(0.3, 10, 0.85))
+    senal = np.column_stack([
+        latidos + 0.1 * np.sin(2 * np.pi * 0.3 * t),
+        0.7 * latidos - 0.05 * np.sin(2 * np.pi * 1.1 * t),
+        -0.4 * latidos
+    ]) + 0.01 * np.random.randn(5000, 3)
+    senal /= np.max(np.abs(senal), axis=0)
+
+    json_bytes = len(json.dumps({
+        "canal_x": senal[:, 0].tolist(), "canal_y": senal[:, 1].tolist(), "canal_z": senal[:, 2].tolist()
+    }).encode())
+
+    inicio = time.perf_counter()
+    blob = comprimir_senal(senal, fs)
+    t_comp = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    reconstruida, fs_leida = descomprimir_senal(blob)
+    t_desc = time.perf_counter() - inicio
+
+    error = np.max(np.abs(reconstruida - senal))
+    envio = len(json.dumps({"senal_comprimida_b64": a_base64(blob)}).encode())
+    print(f"  JSON: {json_bytes / 1024:.1f} KB | Guardado en bytea ({'zstd' if zstandard else 'zlib'}): "
+          f"{len(blob) / 1024:.1f} KB → {json_bytes / len(blob):.1f}x")
+    print(f"  Inserción (base64): {envio / 1024:.1f} KB → {json_bytes / envio:.1f}x")
+
+    # Forma de onda para el dashboard vs. el JSON submuestreado [::10] anterior
+    json_dashboard = len(json.dumps({f"datos_{c}": senal[::10, i].tolist() for i, c in enumerate("xyz")}).encode())
+    onda = forma_onda_binaria(senal, fs)
+    pico_real = np.max(senal[:, 0])
+    pico_envolvente = np.max(np.frombuffer(onda['datos'], '<i2').reshape(-1, 3)[:, 0]) * onda['escalas'][0]
+    print(f"  Dashboard: JSON [::10] {json_dashboard / 1024:.1f} KB | envolvente int16 {len(onda['datos']) / 1024:.1f} KB")
+    assert abs(pico_envolvente - pico_real) < 1e-3
+    print(f"  Compresión: {t_comp * 1000:.2f} ms | Descompresión: {t_desc * 1000:.2f} ms")
+    print(f"  Error máximo de cuantización: {error:.2e}")
+
+    assert reconstruida.shape == (5000, 3) and fs_leida == fs
+    assert error < 1e-4
+    assert desde_base64(a_base64(blob)) == blob
+
+    # Varios hilos comprimiendo a la vez (escritor, tpool, peticiones)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(8) as pool:
+        blobs = list(pool.map(lambda _: comprimir_senal(senal, fs), range(64)))
+        for senal_hilo, _ in pool.map(descomprimir_senal, blobs):
+            assert np.max(np.abs(senal_hilo - senal)) < 1e-4
+    assert desde_bytea("\\x" + blob.hex()) == blob
+
+    print("\n✅ Módulo funcionando correctamente!")
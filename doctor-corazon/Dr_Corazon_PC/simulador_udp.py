@@ -0,0 +1,279 @@
+# simulador_udp.py - Fuente de ECG sin hardware (replay / simulación)
+#
+# Genera o reproduce flujos EASI y los envía por UDP a localhost en el
+# formato exacto del firmware ESP32 (main.c, wifi_tx_task):
+#   una línea "CH1 CH2 CH3 ALAB\n" por muestra, hasta 20 muestras por datagrama
+#
+# - ReproductorUDP: N dispositivos (un socket/puerto origen cada uno) a
+#   velocidad 1x-100x, con pérdida y reordenamiento de datagramas.
+# - fuente_en_proceso: los mismos datagramas sin socket, para pasar a
+#   receiver_udp.receive_packets(fuente=...) en benchmarks deterministas.
+#
+# Uso:
+#   python simulador_udp.py --dispositivos 4 --velocidad 10 --duracion 120
+#   python simulador_udp.py --sesion grabaciones/20250101_080000 --velocidad 50 --perdida 0.01
+
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+
+FS_EASI = 853.364
+MAX_MUESTRAS_POR_PAQUETE = 20   # MAX_SAMPLES_PER_PACKET en el firmware
+MAX_BYTES_PAQUETE = 1200        # UDP_PACKET_MAX_LEN en el firmware
+
+
+# ============================================================================
+# FUENTES DE MUESTRAS
+# ============================================================================
+
+def generar_easi(duracion_seg, fs=FS_EASI, hr_bpm=70, amplitud=20000, ruido=0.02, semilla=0):
+    """
+    Sintetiza muestras EASI crudas (mismo principio que el simulador de
+    hr_hrv_analyzer, con ondas P-QRS-T, variabilidad RR, deriva de línea
+    base y ruido de red de 60 Hz)
+
+    Args:
+        duracion_seg: Duración en segundos
+        fs: Frecuencia de muestreo (Hz)
+        hr_bpm: Frecuencia cardíaca media
+        amplitud: Amplitud del QRS en cuentas del ADC
+        ruido: Ruido blanco relativo a la amplitud
+        semilla: Semilla del generador (misma semilla → misma señal)
+
+    Returns:
+        np.ndarray: (N, 4) int32 con ES, AS, AI, ALAB
+    """
+    rng = np.random.default_rng(semilla)
+    n = int(duracion_seg * fs)
+    t = np.arange(n) / fs
+
+    # Instantes de latido con variabilidad RR (~3%)
+    rr_medio = 60.0 / hr_bpm
+    rr = rr_medio * (1 + 0.03 * rng.standard_normal(int(duracion_seg / rr_medio) + 2))
+    latidos = np.cumsum(rr) - rr[0] / 2
+
+    def onda(centro, ancho, altura):
+        return altura * np.exp(-((t[:, None] - centro[None, :]) / ancho) ** 2).sum(axis=1)
+
+    latidos = latidos[latidos < duracion_seg + 1]
+    p = onda(latidos - 0.16, 0.025, 0.12)
+    qrs = onda(latidos, 0.010, 1.0) - onda(latidos + 0.025, 0.012, 0.25)
+    tt = onda(latidos + 0.30, 0.050, 0.30)
+    ecg = p + qrs + tt
+
+    canales = []
+    for ganancia in (0.8, 1.0, -0.6):  # proyecciones distintas en ES, AS, AI
+        deriva = 0.15 * np.sin(2 * np.pi * 0.25 * t + rng.uniform(0, 2 * np.pi))
+        red = 0.05 * np.sin(2 * np.pi * 60.0 * t)
+        canal = ganancia * ecg + deriva + red + ruido * rng.standard_normal(n)
+        canales.append(canal * amplitud)
+
+    alab = np.zeros(n)
+    return np.column_stack(canales + [alab]).astype(np.int32)
+
+
+def muestras_sesion(directorio):
+    """
+    Muestras crudas de una sesión grabada (grabador_sesion.py)
+
+    Returns:
+        np.memmap: (N, 4) int32 con ES, AS, AI, ALAB
+    """
+    from grabador_sesion import LectorSesion
+    return LectorSesion(directorio).crudo
+
+
+# ============================================================================
+# EMPAQUETADO (formato del firmware)
+# ============================================================================
+
+def empaquetar(muestras):
+    """
+    Convierte muestras (N, 4) en datagramas de texto como wifi_tx_task
+
+    Returns:
+        list: Lista de bytes, cada uno un datagrama
+    """
+    datagramas = []
+    lineas = ["%d %d %d %d\n" % tuple(m) for m in np.asarray(muestras).tolist()]
+    paquete, tam = [], 0
+    for linea in lineas:
+        if tam + len(linea) > MAX_BYTES_PAQUETE and paquete:
+            datagramas.append("".join(paquete).encode())
+            paquete, tam = [], 0
+        paquete.append(linea)
+        tam += len(linea)
+        if len(paquete) >= MAX_MUESTRAS_POR_PAQUETE:
+            datagramas.append("".join(paquete).encode())
+            paquete, tam = [], 0
+    if paquete:
+        datagramas.append("".join(paquete).encode())
+    return datagramas
+
+
+def _alterar(datagramas, perdida, reordenar, rng):
+    """
+    Aplica pérdida y reordenamiento (intercambio con el siguiente datagrama)
+
+    Yields:
+        bytes: Datagramas en el orden de envío
+    """
+    retenido = None
+    for d in datagramas:
+        if perdida and rng.random() < perdida:
+            continue
+        if retenido is not None:
+            yield d
+            yield retenido
+            retenido = None
+        elif reordenar and rng.random() < reordenar:
+            retenido = d
+        else:
+            yield d
+    if retenido is not None:
+        yield retenido
+
+
+# ============================================================================
+# FUENTE EN PROCESO (sin socket)
+# ============================================================================
+
+def fuente_en_proceso(muestras, perdida=0.0, reordenar=0.0, semilla=0,
+                      addr=("127.0.0.1", 40000)):
+    """
+    Datagramas (data, addr) listos para receiver_udp.receive_packets(fuente=...)
+    Sin socket ni esperas: el resultado es determinista para una semilla dada.
+
+    Args:
+        muestras: (N, 4) int con ES, AS, AI, ALAB (generar_easi o muestras_sesion)
+        perdida: Probabilidad de descartar cada datagrama
+        reordenar: Probabilidad de intercambiar un datagrama con el siguiente
+        semilla: Semilla para pérdida/reordenamiento
+        addr: Dirección origen simulada del dispositivo
+
+    Yields:
+        tuple: (bytes, addr)
+    """
+    rng = np.random.default_rng(semilla)
+    for d in _alterar(empaquetar(muestras), perdida, reordenar, rng):
+        yield d, addr
+
+
+# ============================================================================
+# REPRODUCTOR UDP
+# ============================================================================
+
+class ReproductorUDP:
+    """
+    Envía flujos EASI por UDP simulando N dispositivos ESP32
+    """
+
+    def __init__(self, fuentes, destino=("127.0.0.1", 5005), velocidad=1.0,
+                 perdida=0.0, reordenar=0.0, fs=FS_EASI, semilla=0):
+        """
+        Args:
+            fuentes: Lista de arrays (N, 4), uno por dispositivo
+            destino: (ip, puerto) del servidor
+            velocidad: Multiplicador de tiempo real (1.0 a 100.0)
+            perdida: Probabilidad de perder cada datagrama
+            reordenar: Probabilidad de intercambiar un datagrama con el siguiente
+            fs: Frecuencia de muestreo de las fuentes
+            semilla: Semilla base (cada dispositivo usa semilla + i)
+        """
+        self.fuentes = fuentes
+        self.destino = destino
+        self.velocidad = velocidad
+        self.perdida = perdida
+        self.reordenar = reordenar
+        self.fs = fs
+        self.semilla = semilla
+
+        self._parar = threading.Event()
+        self._hilos = []
+        self.enviados = [0] * len(fuentes)
+
+    def _enviar(self, i, muestras):
+        """Hilo de un dispositivo: un socket propio (IP/puerto origen distinto)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.destino[0].startswith("127."):
+            # El servidor identifica cada dispositivo por IP: una IP de loopback por dispositivo
+            try:
+                sock.bind((f"127.0.0.{i + 1}", 0))
+            except OSError:
+                print(f"⚠️  No se pudo usar 127.0.0.{i + 1}: los dispositivos compartirán IP")
+        rng = np.random.default_rng(self.semilla + i)
+        datagramas = empaquetar(muestras)
+
+        # Ritmo: cada datagrama equivale a MAX_MUESTRAS_POR_PAQUETE / fs segundos
+        periodo = MAX_MUESTRAS_POR_PAQUETE / self.fs / self.velocidad
+        siguiente = time.monotonic()
+        for d in _alterar(datagramas, self.perdida, self.reordenar, rng):
+            if self._parar.is_set():
+                break
+            siguiente += periodo
+            espera = siguiente - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            sock.sendto(d, self.destino)
+            self.enviados[i] += 1
+        sock.close()
+
+    def iniciar(self):
+        self._parar.clear()
+        for i, muestras in enumerate(self.fuentes):
+            hilo = threading.Thread(target=self._enviar, args=(i, muestras),
+                                    name=f"simulador_esp32_{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def esperar(self):
+        for hilo in self._hilos:
+            hilo.join()
+
+    def detener(self):
+        self._parar.set()
+        self.esperar()
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador de dispositivos ESP32 (EASI por UDP)")
+    parser.add_argument("--dispositivos", type=int, default=1, help="Número de dispositivos simulados")
+    parser.add_argument("--velocidad", type=float, default=1.0, help="Multiplicador de tiempo real (1-100)")
+    parser.add_argument("--duracion", type=float, default=60.0, help="Segundos de señal por dispositivo")
+    parser.add_argument("--sesion", help="Reproducir una sesión grabada en lugar de sintetizar")
+    parser.add_argument("--hr", type=float, default=70.0, help="HR media de la señal sintética")
+    parser.add_argument("--perdida", type=float, default=0.0, help="Probabilidad de pérdida por datagrama")
+    parser.add_argument("--reordenar", type=float, default=0.0, help="Probabilidad de reordenamiento")
+    parser.add_argument("--ip", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=5005)
+    args = parser.parse_args()
+
+    if args.sesion:
+        fuentes = [np.asarray(muestras_sesion(args.sesion))] * args.dispositivos
+    else:
+        fuentes = [generar_easi(args.duracion, hr_bpm=args.hr + 5 * i, semilla=i)
+                   for i in range(args.dispositivos)]
+
+    print("\n" + "=" * 60)
+    print("📡 Dr Corazón - Simulador ESP32")
+    print("=" * 60)
+    print(f"   Destino: {args.ip}:{args.puerto}")
+    print(f"   Dispositivos: {args.dispositivos} | Velocidad: {args.velocidad}x")
+    print(f"   Pérdida: {args.perdida:.1%} | Reordenamiento: {args.reordenar:.1%}\n")
+
+    reproductor = ReproductorUDP(fuentes, (args.ip, args.puerto), velocidad=args.velocidad,
+                                 perdida=args.perdida, reordenar=args.reordenar)
+    inicio = time.time()
+    reproductor.iniciar()
+    try:
+        reproductor.esperar()
+    except KeyboardInterrupt:
+        reproductor.detener()
+
+    print(f"\n✅ {sum(reproductor.enviados)} datagramas enviados en {time.time() - inicio:.1f}s")
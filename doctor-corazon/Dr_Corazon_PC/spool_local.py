@@ -0,0 +1,522 @@
+# spool_local.py - Spool local durable (SQLite en modo WAL)
+#
+# Todo diagnóstico (y su señal opcional) se escribe primero en disco local.
+# Un replicador en background lo envía a la BD remota en lotes grandes y
+# solo lo borra del spool cuando la inserción remota fue confirmada.
+# Si Supabase está lento o caído los datos se acumulan aquí y se envían
+# al recuperarse la conexión (también tras reiniciar el servidor).
+# Las filas que la BD rechaza (restricción, RLS) se aíslan del lote y, tras
+# `max_intentos` rechazos, pasan a la tabla spool_rechazados sin bloquear
+# a las demás.
+
+import json
+import time
+import sqlite3
+import threading
+
+from metricas import metricas
+from concurrencia import ejecutar_bloqueante, crear_lock
+
+
+class SpoolLocal:
+    """
+    Cola persistente append-only sobre SQLite (WAL).
+    Un commit (fsync) por lote agregado, no por registro.
+    """
+
+    def __init__(self, ruta="spool_dr_corazon.db", max_registros=100000):
+        """
+        Args:
+            ruta: Archivo SQLite del spool
+            max_registros: Límite de registros pendientes; al superarlo se
+                descartan los más antiguos (disco acotado)
+        """
+        self.ruta = ruta
+        self.max_registros = max_registros
+        self._lock = crear_lock()  # Se usa desde tpool (agregar_lote, leer_lote...)
+
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tabla TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                senal TEXT,
+                creado REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_tabla ON spool (tabla, id)")
+        columnas = {c[1] for c in self._conn.execute("PRAGMA table_info(spool)")}
+        if 'intentos' not in columnas:  # Spools creados antes de contar rechazos
+            self._conn.execute("ALTER TABLE spool ADD COLUMN intentos INTEGER NOT NULL DEFAULT 0")
+        # Filas rechazadas por la BD remota: se revisan a mano, no se reintentan
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool_rechazados (
+                id INTEGER PRIMARY KEY,
+                tabla TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                senal TEXT,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL,
+                error TEXT,
+                rechazado REAL NOT NULL
+            )
+        """)
+
+        # Recuperación: los pendientes de una ejecución anterior siguen en disco
+        self._pendientes = self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        self._rechazados = self._conn.execute("SELECT COUNT(*) FROM spool_rechazados").fetchone()[0]
+        self._descartados = 0
+        if self._pendientes:
+            print(f"💾 Spool recuperado: {self._pendientes} registros pendientes de replicar")
+
+    def agregar_lote(self, tabla: str, filas: list, senales: list = None):
+        """
+        Agrega filas al spool en una sola transacción (un fsync)
+
+        Args:
+            tabla: Tabla remota destino (ej. "diagnosticos")
+            filas: Lista de dicts
+            senales: Lista paralela opcional con la señal de cada fila
+                (dict con canal_x/canal_y/canal_z/...) o None
+        """
+        if not filas:
+            return
+        senales = senales or [None] * len(filas)
+        ahora = time.time()
+        registros = [
+            (tabla, json.dumps(fila), json.dumps(senal) if senal is not None else None, ahora)
+            for fila, senal in zip(filas, senales)
+        ]
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO spool (tabla, datos, senal, creado) VALUES (?, ?, ?, ?)", registros
+            )
+            self._pendientes += len(registros)
+            exceso = self._pendientes - self.max_registros
+            if exceso > 0:
+                self._conn.execute(
+                    "DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (exceso,)
+                )
+                self._pendientes -= exceso
+                self._descartados += exceso
+            self._conn.execute("COMMIT")
+
+        if exceso > 0:
+            print(f"⚠️  Spool lleno: descartados {exceso} registros antiguos")
+
+    def agregar(self, tabla: str, fila: dict, senal: dict = None):
+        """Agrega un único registro (ver agregar_lote)"""
+        self.agregar_lote(tabla, [fila], [senal])
+
+    def leer_lote(self, limite=500):
+        """
+        Lee los registros más antiguos de una misma tabla
+
+        Returns:
+            tuple: (tabla, [(id, fila, senal), ...]) o (None, [])
+        """
+        with self._lock:
+            primero = self._conn.execute("SELECT tabla FROM spool ORDER BY id LIMIT 1").fetchone()
+            if not primero:
+                return None, []
+            tabla = primero[0]
+            filas = self._conn.execute(
+                "SELECT id, datos, senal FROM spool WHERE tabla = ? ORDER BY id LIMIT ?",
+                (tabla, limite)
+            ).fetchall()
+
+        return tabla, [
+            (id_, json.loads(datos), json.loads(senal) if senal else None)
+            for id_, datos, senal in filas
+        ]
+
+    def confirmar(self, ids: list, reencolar: tuple = None):
+        """
+        Borra del spool los registros ya replicados
+
+        Args:
+            ids: IDs replicados
+            reencolar: (tabla, filas) que quedan pendientes en su lugar, en la
+                misma transacción (ej. señales cuyo diagnóstico ya se replicó)
+        """
+        if not ids and not (reencolar and reencolar[1]):
+            return
+        with self._lock:
+            # Algunos ids pueden haber sido descartados por el límite mientras tanto
+            antes = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+            self._pendientes -= self._conn.total_changes - antes
+            if reencolar and reencolar[1]:
+                tabla, filas = reencolar
+                ahora = time.time()
+                self._conn.executemany(
+                    "INSERT INTO spool (tabla, datos, senal, creado) VALUES (?, ?, NULL, ?)",
+                    [(tabla, json.dumps(fila), ahora) for fila in filas]
+                )
+                self._pendientes += len(filas)
+            self._conn.execute("COMMIT")
+            if self._pendientes == 0:
+                # Spool vacío: devolver el WAL al tamaño mínimo
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def registrar_rechazos(self, rechazos: list, max_intentos: int):
+        """
+        Cuenta un rechazo de la BD remota por registro; los que llegan a
+        `max_intentos` pasan a spool_rechazados (dejan de bloquear el spool)
+
+        Args:
+            rechazos: Lista de (id, mensaje de error)
+            max_intentos: Rechazos tras los que un registro se aparta
+
+        Returns:
+            int: Registros apartados a spool_rechazados
+        """
+        if not rechazos:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE spool SET intentos = intentos + 1 WHERE id = ?", [(i,) for i, _ in rechazos]
+            )
+            apartados = 0
+            for id_, error in rechazos:
+                movidos = self._conn.execute(
+                    "INSERT INTO spool_rechazados (id, tabla, datos, senal, creado, intentos, error, rechazado) "
+                    "SELECT id, tabla, datos, senal, creado, intentos, ?, ? FROM spool WHERE id = ? AND intentos >= ?",
+                    (error, time.time(), id_, max_intentos)
+                ).rowcount
+                if movidos:
+                    self._conn.execute("DELETE FROM spool WHERE id = ?", (id_,))
+                    apartados += 1
+            self._pendientes -= apartados
+            self._rechazados += apartados
+            self._conn.execute("COMMIT")
+        return apartados
+
+    def rechazados(self, limite=100):
+        """
+        Returns:
+            list: Filas apartadas (dicts con tabla, datos, intentos, error, ...), más recientes primero
+        """
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT id, tabla, datos, senal, intentos, error, rechazado FROM spool_rechazados "
+                "ORDER BY rechazado DESC LIMIT ?", (limite,)
+            ).fetchall()
+        return [
+            {'id': id_, 'tabla': tabla, 'datos': json.loads(datos),
+             'senal': json.loads(senal) if senal else None,
+             'intentos': intentos, 'error': error, 'rechazado': rechazado}
+            for id_, tabla, datos, senal, intentos, error, rechazado in filas
+        ]
+
+    def pendientes(self):
+        """Número de registros aún no replicados"""
+        with self._lock:
+            return self._pendientes
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Pendientes, descartados por límite, apartados por rechazo
+                y antigüedad del más viejo (s)
+        """
+        with self._lock:
+            mas_viejo = self._conn.execute("SELECT MIN(creado) FROM spool").fetchone()[0]
+            return {
+                'pendientes': self._pendientes,
+                'descartados': self._descartados,
+                'rechazados': self._rechazados,
+                'antiguedad_max_seg': round(time.time() - mas_viejo, 1) if mas_viejo else 0
+            }
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+# SQLSTATE transitorios: conexión (08), recursos (53), operador (57), serialización (40)
+_CLASES_TRANSITORIAS = ('08', '40', '53', '57')
+
+
+def es_rechazo_permanente(error):
+    """
+    Distingue un rechazo de la BD (la fila nunca entrará: restricción, RLS,
+    columna inexistente) de un fallo transitorio (red, timeout, BD caída),
+    que se reintenta con backoff sin contar como rechazo
+
+    Returns:
+        bool: True si reintentar la misma fila no tiene sentido
+    """
+    if isinstance(error, sqlite3.IntegrityError):
+        return True
+    codigo = getattr(error, 'code', None)  # postgrest.APIError: SQLSTATE, PGRST... o estado HTTP
+    if isinstance(codigo, str) and codigo.isdigit() and len(codigo) == 3:
+        codigo = int(codigo)
+    if isinstance(codigo, int):
+        return 400 <= codigo < 500 and codigo not in (408, 429)
+    if isinstance(codigo, str) and codigo:
+        return not codigo.startswith(_CLASES_TRANSITORIAS)
+    return False
+
+
+class ReplicadorSpool:
+    """
+    Hilo que vacía el spool hacia la BD remota en lotes grandes
+    """
+
+    def __init__(self, spool: SpoolLocal, funcion_insertar, tam_lote=500,
+                 intervalo=1.0, backoff_base=1.0, backoff_max=60.0,
+                 max_intentos=3, es_rechazo=es_rechazo_permanente):
+        """
+        Args:
+            spool: SpoolLocal a vaciar
+            funcion_insertar: Callable(tabla, filas) -> filas insertadas con 'id'
+                en el mismo orden (ej. supabase_config.insertar_lote)
+            tam_lote: Registros por petición remota
+            intervalo: Espera cuando el spool está vacío (s)
+            backoff_base: Espera inicial tras un fallo (se duplica)
+            backoff_max: Espera máxima tras fallos consecutivos
+            max_intentos: Rechazos de la BD tras los que una fila se aparta
+                a spool_rechazados
+            es_rechazo: Callable(error) -> True si el error es un rechazo
+                permanente de la fila (y no un fallo transitorio)
+        """
+        self.spool = spool
+        self.funcion_insertar = funcion_insertar
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_intentos = max_intentos
+        self.es_rechazo = es_rechazo
+
+        self._evento_parar = threading.Event()
+        self._hilo = None
+        self.replicados = 0
+        self.fallos = 0
+        self.rechazos = 0
+
+    def iniciar(self):
+        self._evento_parar.clear()
+        self._hilo = threading.Thread(target=self._ciclo, name="replicador_spool", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10.0):
+        self._evento_parar.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def replicar_lote(self):
+        """
+        Envía un lote del spool a la BD remota. Si la BD rechaza el lote, lo
+        divide por mitades hasta aislar las filas rechazadas: las demás se
+        replican y las rechazadas cuentan un intento.
+
+        Returns:
+            int: Registros replicados (0 si el spool está vacío)
+
+        Raises:
+            Exception: Si falla la conexión con la BD remota (lo no replicado
+                sigue en el spool)
+        """
+        # SQLite en el pool de hilos (con eventlet); la inserción remota es E/S de red y cede sola
+        tabla, registros = ejecutar_bloqueante(self.spool.leer_lote, self.tam_lote)
+        if not registros:
+            return 0
+
+        replicados, rechazados = [], []
+        try:
+            with metricas.temporizador('replicacion'):
+                self._insertar_aislando(tabla, registros, replicados, rechazados)
+        finally:
+            # Lo ya insertado se confirma aunque el resto falle: no se duplica al reintentar
+            self._cerrar_lote(replicados, rechazados)
+        return len(replicados)
+
+    def _insertar_aislando(self, tabla, registros, replicados, rechazados):
+        """Inserta registros; ante un rechazo divide el lote (acumula en las listas)"""
+        try:
+            insertadas = self.funcion_insertar(tabla, [r[1] for r in registros])
+        except Exception as e:
+            if not self.es_rechazo(e):
+                raise
+            if len(registros) == 1:
+                rechazados.append((registros[0][0], str(e)))
+                return
+            mitad = len(registros) // 2
+            self._insertar_aislando(tabla, registros[:mitad], replicados, rechazados)
+            self._insertar_aislando(tabla, registros[mitad:], replicados, rechazados)
+            return
+        replicados.extend(zip(registros, insertadas))
+
+    def _cerrar_lote(self, replicados, rechazados):
+        # Señales asociadas: necesitan el ID remoto del diagnóstico. Si no entran,
+        # quedan en el spool como filas de senales_ecg (el diagnóstico no se repite)
+        senales = [dict(senal, diagnostico_id=fila['id'])
+                   for (_, _, senal), fila in replicados if senal is not None]
+        if senales:
+            try:
+                self.funcion_insertar("senales_ecg", senales)
+                senales = []
+            except Exception as e:
+                print(f"⚠️  Diagnósticos replicados pero {len(senales)} señales no (quedan en spool): {e}")
+
+        ids = [registro[0] for registro, _ in replicados]
+        ejecutar_bloqueante(self.spool.confirmar, ids, ("senales_ecg", senales))
+        self.replicados += len(ids)
+
+        if rechazados:
+            self.rechazos += len(rechazados)
+            apartados = ejecutar_bloqueante(self.spool.registrar_rechazos, rechazados, self.max_intentos)
+            print(f"⚠️  BD remota rechazó {len(rechazados)} registros ({apartados} a spool_rechazados): "
+                  f"{rechazados[0][1]}")
+
+    def _ciclo(self):
+        espera = self.backoff_base
+        while not self._evento_parar.is_set():
+            try:
+                n = self.replicar_lote()
+                espera = self.backoff_base
+                if n < self.tam_lote:
+                    self._evento_parar.wait(self.intervalo)
+            except Exception as e:
+                self.fallos += 1
+                print(f"⚠️  BD remota no disponible, {ejecutar_bloqueante(self.spool.pendientes)} en spool. Reintento en {espera:.0f}s: {e}")
+                self._evento_parar.wait(espera)
+                espera = min(espera * 2, self.backoff_max)
+
+    def metricas(self):
+        # En tpool: el lock del spool puede estar tomado durante un commit (fsync)
+        datos = ejecutar_bloqueante(self.spool.metricas)
+        datos.update({'replicados': self.replicados, 'fallos_remotos': self.fallos,
+                      'rechazos_remotos': self.rechazos})
+        return datos
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO (contra un destino local que simula la BD remota)
+# ============================================================================
+
+class RechazoSimulado(Exception):
+    """Error como el de postgrest.APIError para una restricción violada"""
+    code = '23514'
+
+
+class DestinoMemoria:
+    """
+    Sustituto local de la BD remota: guarda en listas y puede simular caídas
+    (de toda la BD o de una tabla) y rechazar filas con 'rechazar'
+    """
+
+    def __init__(self):
+        self.tablas = {}
+        self.caido = False
+        self.tablas_caidas = set()
+        self._siguiente_id = 1
+
+    def insertar(self, tabla, filas):
+        if self.caido or tabla in self.tablas_caidas:
+            raise ConnectionError("BD remota no disponible (simulado)")
+        if any(fila.get('rechazar') for fila in filas):
+            raise RechazoSimulado("new row violates check constraint (simulado)")
+        insertadas = []
+        for fila in filas:
+            insertadas.append(dict(fila, id=self._siguiente_id))
+            self._siguiente_id += 1
+        self.tablas.setdefault(tabla, []).extend(insertadas)
+        return insertadas
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    print("💾 Spool local Dr Corazón")
+    print("=" * 50)
+
+    ruta = os.path.join(tempfile.mkdtemp(), "spool_prueba.db")
+    destino = DestinoMemoria()
+
+    # 1) BD caída: 20.000 diagnósticos se acumulan en el spool
+    spool = SpoolLocal(ruta, max_registros=50000)
+    replicador = ReplicadorSpool(spool, destino.insertar, tam_lote=1000)
+    destino.caido = True
+
+    inicio = time.time()
+    for lote in range(200):
+        filas = [{"paciente_id": "p1", "diagnostico": "NORM", "hr_bpm": 70 + i % 5} for i in range(100)]
+        senales = [{"canal_x": [0.0, 0.1], "canal_y": [0.0], "canal_z": [0.0]} if i == 0 else None
+                   for i in range(100)]
+        spool.agregar_lote("diagnosticos", filas, senales)
+    print(f"  20000 registros en spool en {time.time() - inicio:.2f}s")
+
+    try:
+        replicador.replicar_lote()
+        raise AssertionError("debía fallar con la BD caída")
+    except ConnectionError:
+        pass
+    assert spool.pendientes() == 20000
+
+    # 2) Reinicio: el spool se recupera desde disco
+    spool.cerrar()
+    spool = SpoolLocal(ruta, max_registros=50000)
+    replicador = ReplicadorSpool(spool, destino.insertar, tam_lote=1000)
+    assert spool.pendientes() == 20000
+
+    # 3) BD disponible: el replicador vacía el spool en lotes
+    destino.caido = False
+    inicio = time.time()
+    while replicador.replicar_lote():
+        pass
+    print(f"  20000 registros replicados en {time.time() - inicio:.2f}s")
+
+    assert spool.pendientes() == 0
+    assert len(destino.tablas["diagnosticos"]) == 20000
+    assert len(destino.tablas["senales_ecg"]) == 200
+    assert all("diagnostico_id" in s for s in destino.tablas["senales_ecg"])
+
+    # 4) Disco acotado: se descartan los más antiguos
+    pequeño = SpoolLocal(os.path.join(os.path.dirname(ruta), "spool_acotado.db"), max_registros=100)
+    pequeño.agregar_lote("diagnosticos", [{"n": i} for i in range(150)])
+    assert pequeño.pendientes() == 100
+    assert pequeño.leer_lote(1)[1][0][1] == {"n": 50}
+
+    # 5) Filas rechazadas: no bloquean a las demás y acaban en spool_rechazados
+    spool = SpoolLocal(os.path.join(os.path.dirname(ruta), "spool_rechazos.db"))
+    destino = DestinoMemoria()
+    replicador = ReplicadorSpool(spool, destino.insertar, tam_lote=100, max_intentos=3)
+    spool.agregar_lote("diagnosticos", [{"n": i, "rechazar": i in (3, 70)} for i in range(200)])
+    # Las rechazadas siguen al frente hasta agotar sus intentos; el resto avanza
+    assert [replicador.replicar_lote() for _ in range(4)] == [98, 98, 2, 0]
+    assert spool.pendientes() == 0
+    assert len(destino.tablas["diagnosticos"]) == 198
+    assert sorted(r['datos']['n'] for r in spool.rechazados()) == [3, 70]
+    assert all(r['intentos'] == 3 for r in spool.rechazados())
+    assert replicador.metricas()['rechazados'] == 2
+
+    # 6) Señales que no entran: quedan en el spool hasta insertarse (sin repetir el diagnóstico)
+    destino.tablas_caidas.add("senales_ecg")
+    spool.agregar_lote("diagnosticos", [{"n": 1}], [{"canal_x": [0.5]}])
+    assert replicador.replicar_lote() == 1
+    assert spool.pendientes() == 1
+    try:
+        replicador.replicar_lote()
+        raise AssertionError("debía fallar con senales_ecg caída")
+    except ConnectionError:
+        pass
+    destino.tablas_caidas.clear()
+    assert replicador.replicar_lote() == 1
+    assert spool.pendientes() == 0
+    assert len(destino.tablas["diagnosticos"]) == 199
+    assert destino.tablas["senales_ecg"][0] == {"canal_x": [0.5], "diagnostico_id": destino.tablas["diagnosticos"][-1]["id"],
+                                                "id": destino.tablas["senales_ecg"][0]["id"]}
+    print(f"  Rechazos aislados: {spool.metricas()['rechazados']} en spool_rechazados, señales sin perder")
+
+    print("\n✅ Spool funcionando correctamente!")
@@ -1,8 +1,27 @@
-# supabase_config.py - Configuración de Supabase
+# supabase_config.py - Configuración de Supabase y de la base de datos
+#
+# Las funciones de este módulo leen y escriben a través de `repositorio`
+# (repositorio.py): Supabase por defecto, o una base SQLite local si
+# DR_CORAZON_BD=sqlite:///ruta.db (sin credenciales de Supabase: `supabase`
+# queda en None y solo funciona lo que no necesita Supabase Auth).
+#
+# Con Supabase, las tablas se consultan por el pool compartido de
+# pool_supabase.py (HTTP/2 keep-alive, token por petición, límite de
+# concurrencia); el Client `supabase` se usa solo para Supabase Auth.
+# DR_CORAZON_BD_POOL=0 vuelve a consultar por el Client (para comparar).
+#
+# Los trabajos del servidor sin usuario (replicador del spool, exportaciones
+# del admin, re-análisis) usan `repositorio_servicio`, con la clave
+# service_role (SUPABASE_SERVICE_KEY) y nunca con la anon: sin esa clave
+# fallan con un error explícito en lugar de escribir/leer nada bajo RLS.
 
 import os
+import time
+from datetime import datetime, timezone
+import numpy as np
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from senales_compactas import comprimir_senal, descomprimir_senal, a_base64, desde_bytea
+from repositorio import crear_repositorio
 
 # Cargar variables de entorno
 load_dotenv()
@@ -10,12 +29,90 @@ load_dotenv()
 # Configuración desde .env
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")  # Verificar tokens HS256 sin llamar a Auth
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # service_role: trabajos del servidor sin usuario
+URL_BD = os.getenv("DR_CORAZON_BD")  # sqlite:///dr_corazon_local.db = base local
 
-# Verificar que existen
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Faltan credenciales de Supabase en .env")
+BD_CONEXIONES = int(os.getenv("DR_CORAZON_BD_CONEXIONES", "16"))  # Peticiones simultáneas a PostgREST
+BD_TIMEOUT = float(os.getenv("DR_CORAZON_BD_TIMEOUT", "10"))     # Segundos por petición
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+pool = None
+verificador_jwt = None
+cliente_servicio = None  # Pool o Client con la clave service_role
+if URL_BD:
+    supabase = None
+else:
+    from supabase import create_client, Client
+    from supabase.lib.client_options import ClientOptions
+    from pool_supabase import PoolSupabase
+    from verificador_jwt import VerificadorJWT
+    
+    # Verificar que existen
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("Faltan credenciales de Supabase en .env")
+    
+    # Sin sesión guardada ni refresco en segundo plano: cada login devuelve su
+    # sesión y el token viaja en la sesión de Flask de cada usuario
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+        persist_session=False,
+        auto_refresh_token=False,
+        postgrest_client_timeout=BD_TIMEOUT
+    ))
+    
+    if os.getenv("DR_CORAZON_BD_POOL", "1") != "0":
+        pool = PoolSupabase(
+            SUPABASE_URL, SUPABASE_KEY,
+            max_concurrentes=BD_CONEXIONES,
+            timeout=BD_TIMEOUT,
+            http2=os.getenv("DR_CORAZON_BD_HTTP2", "1") != "0"
+        )
+    
+    if not SUPABASE_SERVICE_KEY:
+        print("⚠️  Sin SUPABASE_SERVICE_KEY: el spool, las exportaciones del admin y el re-análisis no podrán acceder a la BD")
+    elif pool:
+        cliente_servicio = PoolSupabase(
+            SUPABASE_URL, SUPABASE_KEY,
+            clave_servicio=SUPABASE_SERVICE_KEY,
+            max_concurrentes=BD_CONEXIONES,
+            timeout=BD_TIMEOUT,
+            http2=pool.http2
+        )
+    else:
+        cliente_servicio = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY, options=ClientOptions(
+            persist_session=False,
+            auto_refresh_token=False,
+            postgrest_client_timeout=BD_TIMEOUT
+        ))
+    
+    # Sesión verificada localmente: secreto (HS256) o claves públicas del JWKS
+    verificador_jwt = VerificadorJWT(SUPABASE_URL, secreto=SUPABASE_JWT_SECRET)
+
+repositorio = crear_repositorio(URL_BD, pool or supabase)
+# Con SQLite no hay RLS: la misma base
+repositorio_servicio = repositorio if URL_BD else (
+    crear_repositorio(None, cliente_servicio) if cliente_servicio else None
+)
+
+# Resoluciones de rollup_paciente (las mantiene el trigger acumular_diagnostico)
+RESOLUCIONES_ROLLUP = (60, 900, 3600)
+MAX_BUCKETS_ROLLUP = 1000  # Filas por consulta (límite por defecto de PostgREST)
+
+# Oyentes de diagnósticos guardados (ej. invalidar cachés de estadísticas)
+_oyentes_diagnosticos = []
+
+def al_guardar_diagnosticos(callback):
+    """
+    Registra un Callable(filas) que se llama tras cada inserción confirmada
+    en diagnosticos (guardar_diagnostico e insertar_lote), con las filas insertadas
+    """
+    _oyentes_diagnosticos.append(callback)
+
+def _notificar_diagnosticos(filas):
+    for callback in _oyentes_diagnosticos:
+        try:
+            callback(filas)
+        except Exception as e:
+            print(f"⚠️  Error en oyente de diagnósticos: {e}")
 
 # ============ FUNCIONES DE BASE DE DATOS ============
 
@@ -34,9 +131,9 @@ def crear_paciente(nombre: str, edad: int = None, genero: str = None, identifica
             "identificacion": identificacion
         }
         
-        response = supabase.table("pacientes").insert(data).execute()
-        print(f"✅ Paciente creado: {nombre} (ID: {response.data[0]['id']})")
-        return response.data[0]
+        paciente = repositorio.crear_paciente(data)
+        print(f"✅ Paciente creado: {nombre} (ID: {paciente['id']})")
+        return paciente
     except Exception as e:
         print(f"❌ Error al crear paciente: {e}")
         return None
@@ -74,30 +171,107 @@ def guardar_diagnostico(
         dict: Datos del diagnóstico guardado
     """
     try:
-        data = {
-            "paciente_id": paciente_id,
-            "diagnostico": diagnostico,
-            "probabilidad_normal": probabilidades.get("Normal", 0),
-            "probabilidad_infarto": probabilidades.get("Infarto", 0),
-            "probabilidad_bradicardia": probabilidades.get("Bradicardia", 0),
-            "probabilidad_taquicardia": probabilidades.get("Taquicardia", 0),
-            "tiempo_analisis": tiempo_analisis,
-            "alerta_critica": alerta_critica,
-            "notas": notas,
-            "hr_bpm": hr_bpm,
-            "hrv_sdnn": hrv_sdnn,
-            "hrv_rmssd": hrv_rmssd,
-            "hrv_pnn50": hrv_pnn50,
-            "num_picos_r": num_picos_r
-        }
+        data = fila_diagnostico(
+            paciente_id, diagnostico, probabilidades, tiempo_analisis,
+            alerta_critica=alerta_critica, notas=notas, hr_bpm=hr_bpm,
+            hrv_sdnn=hrv_sdnn, hrv_rmssd=hrv_rmssd, hrv_pnn50=hrv_pnn50,
+            num_picos_r=num_picos_r
+        )
         
-        response = supabase.table("diagnosticos").insert(data).execute()
-        print(f"✅ Diagnóstico guardado: {diagnostico} | HR: {hr_bpm} BPM (ID: {response.data[0]['id']})")
-        return response.data[0]
+        fila = insertar_lote("diagnosticos", [data])[0]
+        print(f"✅ Diagnóstico guardado: {diagnostico} | HR: {hr_bpm} BPM (ID: {fila['id']})")
+        return fila
     except Exception as e:
         print(f"❌ Error al guardar diagnóstico: {e}")
         return None
 
+def fila_diagnostico(
+    paciente_id: str,
+    diagnostico: str,
+    probabilidades: dict,
+    tiempo_analisis: float,
+    alerta_critica: bool = False,
+    notas: str = None,
+    hr_bpm: float = None,
+    hrv_sdnn: float = None,
+    hrv_rmssd: float = None,
+    hrv_pnn50: float = None,
+    num_picos_r: int = None,
+    timestamp: float = None
+):
+    """
+    Construye la fila de la tabla diagnosticos (mismos argumentos que guardar_diagnostico)
+    
+    Args:
+        timestamp: Momento de captura de la ventana (epoch en segundos); por
+            defecto, ahora. Va en la fila para que las filas guardadas tarde
+            (cola de escritura, spool tras una caída) conserven su hora real
+            y no la del NOW() de la inserción.
+    
+    Returns:
+        dict: Fila lista para insertar
+    """
+    return {
+        "paciente_id": paciente_id,
+        "timestamp": datetime.fromtimestamp(
+            time.time() if timestamp is None else timestamp, timezone.utc
+        ).isoformat(timespec='microseconds'),
+        "diagnostico": diagnostico,
+        "probabilidad_normal": probabilidades.get("Normal", 0),
+        "probabilidad_infarto": probabilidades.get("Infarto", 0),
+        "probabilidad_bradicardia": probabilidades.get("Bradicardia", 0),
+        "probabilidad_taquicardia": probabilidades.get("Taquicardia", 0),
+        "tiempo_analisis": tiempo_analisis,
+        "alerta_critica": alerta_critica,
+        "notas": notas,
+        "hr_bpm": hr_bpm,
+        "hrv_sdnn": hrv_sdnn,
+        "hrv_rmssd": hrv_rmssd,
+        "hrv_pnn50": hrv_pnn50,
+        "num_picos_r": num_picos_r
+    }
+
+def guardar_diagnosticos_lote(filas: list):
+    """
+    Inserta varios diagnósticos en una sola petición
+    
+    Args:
+        filas: Lista de dicts construidos con fila_diagnostico()
+    
+    Returns:
+        list: Filas insertadas
+    
+    Raises:
+        Exception: Si falla la inserción (el llamador decide si reintenta)
+    """
+    return insertar_lote("diagnosticos", filas)
+
+def insertar_lote(tabla: str, filas: list, servicio: bool = False):
+    """
+    Inserta varias filas en una tabla con una sola petición
+    
+    Args:
+        tabla: Nombre de la tabla (ej. "diagnosticos", "senales_ecg")
+        filas: Lista de dicts
+        servicio: Insertar con la clave service_role (trabajos del servidor sin
+            usuario: spool, re-análisis); si no, con el token de la petición
+    
+    Returns:
+        list: Filas insertadas (con ID), en el mismo orden
+    
+    Raises:
+        ValueError: servicio=True sin SUPABASE_SERVICE_KEY
+        Exception: Si falla la inserción (el llamador decide si reintenta)
+    """
+    if not filas:
+        return []
+    if servicio and repositorio_servicio is None:
+        raise ValueError("Falta SUPABASE_SERVICE_KEY en .env (clave service_role para los trabajos del servidor)")
+    insertadas = (repositorio_servicio if servicio else repositorio).insertar(tabla, filas)
+    if tabla == "diagnosticos":
+        _notificar_diagnosticos(insertadas)
+    return insertadas
+
 def guardar_senales_ecg(
     diagnostico_id: int,
     canal_x: list,
@@ -107,31 +281,78 @@ def guardar_senales_ecg(
     duracion_segundos: int = 10
 ):
     """
-    Guarda las señales ECG raw (opcional, consume espacio)
+    Guarda las señales ECG raw comprimidas (int16 + deltas + zstd/zlib)
     
     Args:
         diagnostico_id: ID del diagnóstico asociado
-        canal_x, canal_y, canal_z: Listas con los valores de cada canal
+        canal_x, canal_y, canal_z: Listas o arrays con los valores de cada canal
         frecuencia_muestreo: Hz (default 500)
         duracion_segundos: Duración de la captura (default 10)
     """
     try:
-        data = {
-            "diagnostico_id": diagnostico_id,
-            "canal_x": canal_x,
-            "canal_y": canal_y,
-            "canal_z": canal_z,
-            "frecuencia_muestreo": frecuencia_muestreo,
-            "duracion_segundos": duracion_segundos
-        }
+        data = fila_senales_ecg(
+            diagnostico_id,
+            np.column_stack([canal_x, canal_y, canal_z]),
+            frecuencia_muestreo,
+            duracion_segundos
+        )
         
-        response = supabase.table("senales_ecg").insert(data).execute()
-        print(f"✅ Señales ECG guardadas (ID: {response.data[0]['id']})")
-        return response.data[0]
+        fila = repositorio.insertar("senales_ecg", [data])[0]
+        print(f"✅ Señales ECG guardadas (ID: {fila['id']})")
+        return fila
     except Exception as e:
         print(f"❌ Error al guardar señales: {e}")
         return None
 
+def fila_senales_ecg(
+    diagnostico_id,
+    senal,
+    frecuencia_muestreo: int = 500,
+    duracion_segundos: int = 10
+):
+    """
+    Construye la fila de senales_ecg con la señal comprimida en base64
+    (el trigger decodificar_senal_b64 la guarda como bytea en senal_comprimida)
+    
+    Args:
+        diagnostico_id: ID del diagnóstico asociado (None si aún no se conoce)
+        senal: Array (N, 3) con X, Y, Z
+    
+    Returns:
+        dict: Fila lista para insertar
+    """
+    fila = {
+        "senal_comprimida_b64": a_base64(comprimir_senal(senal, frecuencia_muestreo)),
+        "frecuencia_muestreo": frecuencia_muestreo,
+        "duracion_segundos": duracion_segundos
+    }
+    if diagnostico_id is not None:
+        fila["diagnostico_id"] = diagnostico_id
+    return fila
+
+def obtener_senales_ecg(diagnostico_id: int):
+    """
+    Obtiene la señal ECG de un diagnóstico
+    
+    Returns:
+        np.ndarray: Array (N, 3) float32 con X, Y, Z, o None si no existe
+    """
+    try:
+        filas = repositorio.senales([diagnostico_id])
+        if not filas:
+            return None
+        fila = filas[0]
+        
+        if fila.get("senal_comprimida"):
+            senal, _ = descomprimir_senal(desde_bytea(fila["senal_comprimida"]))
+            return senal
+        
+        # Filas antiguas guardadas como listas JSON
+        return np.column_stack([fila["canal_x"], fila["canal_y"], fila["canal_z"]]).astype(np.float32)
+    except Exception as e:
+        print(f"❌ Error al obtener señales: {e}")
+        return None
+
 def obtener_diagnosticos_paciente(paciente_id: str, limite: int = 10):
     """
     Obtiene los últimos diagnósticos de un paciente
@@ -144,14 +365,8 @@ def obtener_diagnosticos_paciente(paciente_id: str, limite: int = 10):
         list: Lista de diagnósticos
     """
     try:
-        response = supabase.table("diagnosticos")\
-            .select("*")\
-            .eq("paciente_id", paciente_id)\
-            .order("timestamp", desc=True)\
-            .limit(limite)\
-            .execute()
-        
-        return response.data
+        filas, _ = repositorio.listar_diagnosticos(paciente_id, limite=limite)
+        return filas
     except Exception as e:
         print(f"❌ Error al obtener diagnósticos: {e}")
         return []
@@ -164,61 +379,160 @@ def obtener_alertas_criticas(limite: int = 20):
         list: Lista de diagnósticos con alerta crítica
     """
     try:
-        response = supabase.table("diagnosticos")\
-            .select("*, pacientes(nombre, identificacion)")\
-            .eq("alerta_critica", True)\
-            .order("timestamp", desc=True)\
-            .limit(limite)\
-            .execute()
-        
-        return response.data
+        return repositorio.alertas_criticas(limite)
     except Exception as e:
         print(f"❌ Error al obtener alertas: {e}")
         return []
 
-def obtener_estadisticas_paciente(paciente_id: str):
+def obtener_estadisticas_paciente(paciente_id: str, horas: int = 24):
     """
-    Calcula estadísticas de diagnósticos de un paciente
+    Estadísticas de diagnósticos de un paciente, leídas de los agregados que
+    mantiene el trigger de diagnosticos (tabla estadisticas_paciente y
+    rollups horarios en rollup_paciente): no recorre los diagnósticos
+    
+    Args:
+        paciente_id: UUID del paciente
+        horas: Horas de rollups HR/HRV a incluir
     
     Returns:
-        dict: Estadísticas (total, por tipo, últimos 7 días, etc.)
+        dict: Estadísticas (total, por tipo, alertas, último, por hora)
     """
     try:
-        # Obtener todos los diagnósticos
-        response = supabase.table("diagnosticos")\
-            .select("diagnostico, alerta_critica, timestamp")\
-            .eq("paciente_id", paciente_id)\
-            .execute()
-        
-        diagnosticos = response.data
-        
-        if not diagnosticos:
+        fila = repositorio.estadisticas_paciente(paciente_id)
+        if not fila:
             return {"total": 0, "mensaje": "Sin diagnósticos"}
         
-        # Contar por tipo
-        from collections import Counter
-        conteo = Counter([d["diagnostico"] for d in diagnosticos])
-        
-        # Alertas críticas
-        alertas = sum(1 for d in diagnosticos if d["alerta_critica"])
-        
         return {
-            "total": len(diagnosticos),
-            "por_tipo": dict(conteo),
-            "alertas_criticas": alertas,
-            "ultimo": diagnosticos[0] if diagnosticos else None
+            "total": fila["total"],
+            "por_tipo": fila["por_tipo"],
+            "alertas_criticas": fila["alertas_criticas"],
+            "ultimo": {
+                "diagnostico": fila["ultimo_diagnostico"],
+                "alerta_critica": fila["ultimo_alerta_critica"],
+                "timestamp": fila["ultimo_timestamp"]
+            },
+            "por_hora": obtener_rollups_paciente(paciente_id, 3600, horas * 3600)
         }
     except Exception as e:
         print(f"❌ Error al calcular estadísticas: {e}")
         return {}
 
+def _punto_rollup(fila: dict):
+    """Bucket de rollup_paciente → medias y extremos listos para graficar"""
+    def media(suma, n):
+        return round(suma / n, 2) if n else None
+    
+    return {
+        "inicio": fila["inicio"],
+        "diagnosticos": fila["n"],
+        "hr_min": fila["hr_min"],
+        "hr_media": media(fila["hr_suma"], fila["n_hr"]),
+        "hr_max": fila["hr_max"],
+        "sdnn_media": media(fila["sdnn_suma"], fila["n_hrv"]),
+        "rmssd_media": media(fila["rmssd_suma"], fila["n_hrv"]),
+        "alertas": fila["alertas"]
+    }
+
+def _leer_rollups(paciente_id: str, resolucion_seg: int, desde):
+    return repositorio.rollups(paciente_id, resolucion_seg, desde, MAX_BUCKETS_ROLLUP)
+
+def obtener_rollups_paciente(paciente_id: str, resolucion_seg: int, segundos: int):
+    """
+    Buckets de HR/HRV de un paciente en los últimos `segundos`
+    
+    Args:
+        paciente_id: UUID del paciente
+        resolucion_seg: Tamaño del bucket (60, 900 o 3600)
+        segundos: Ventana de tiempo hacia atrás desde ahora
+    
+    Returns:
+        list: Puntos en orden temporal (ver _punto_rollup)
+    """
+    from datetime import datetime, timedelta, timezone
+    
+    desde = datetime.now(timezone.utc) - timedelta(seconds=segundos)
+    return [_punto_rollup(f) for f in _leer_rollups(paciente_id, resolucion_seg, desde)]
+
+def resolucion_tendencia(segundos: float):
+    """
+    Returns:
+        int: Resolución más fina cuyo número de buckets en el rango cabe en una consulta
+    """
+    for resolucion in RESOLUCIONES_ROLLUP:
+        if segundos / resolucion <= MAX_BUCKETS_ROLLUP:
+            return resolucion
+    return RESOLUCIONES_ROLLUP[-1]
+
+def agrupar_rollups(filas: list, desde, segundos: float, puntos: int):
+    """
+    Reagrupa buckets de rollup en `puntos` intervalos iguales desde `desde`
+    (sumas, conteos, mínimos y máximos se combinan; los intervalos sin datos
+    quedan con diagnosticos=0 y valores None)
+    
+    Returns:
+        list: `puntos` puntos en orden temporal (ver _punto_rollup)
+    """
+    from datetime import datetime, timedelta
+    
+    ancho = segundos / puntos
+    grupos = [
+        {"inicio": (desde + timedelta(seconds=i * ancho)).isoformat(), "n": 0, "n_hr": 0,
+         "hr_min": None, "hr_max": None, "hr_suma": 0.0, "n_hrv": 0,
+         "sdnn_suma": 0.0, "rmssd_suma": 0.0, "alertas": 0}
+        for i in range(puntos)
+    ]
+    for fila in filas:
+        inicio = datetime.fromisoformat(fila["inicio"])
+        i = min(max(int((inicio - desde).total_seconds() // ancho), 0), puntos - 1)
+        g = grupos[i]
+        for campo in ("n", "n_hr", "hr_suma", "n_hrv", "sdnn_suma", "rmssd_suma", "alertas"):
+            g[campo] += fila[campo] or 0
+        if fila["hr_min"] is not None:
+            g["hr_min"] = fila["hr_min"] if g["hr_min"] is None else min(g["hr_min"], fila["hr_min"])
+        if fila["hr_max"] is not None:
+            g["hr_max"] = fila["hr_max"] if g["hr_max"] is None else max(g["hr_max"], fila["hr_max"])
+    return [_punto_rollup(g) for g in grupos]
+
+def obtener_tendencia_paciente(paciente_id: str, segundos: float, puntos: int = 120):
+    """
+    Tendencia de HR/HRV con un número fijo de puntos sea cual sea el rango:
+    elige la resolución de rollup según el rango y reagrupa los buckets
+    
+    Args:
+        paciente_id: UUID del paciente
+        segundos: Rango hacia atrás desde ahora
+        puntos: Puntos pedidos (menos si el rango tiene menos buckets de 1 min)
+    
+    Returns:
+        dict: {'resolucion_seg', 'desde', 'hasta', 'ancho_seg', 'puntos': [...]}
+    """
+    import math
+    from datetime import datetime, timedelta, timezone
+    
+    hasta = datetime.now(timezone.utc)
+    resolucion = resolucion_tendencia(segundos)
+    # Alinear al bucket: el primer intervalo no empieza a mitad de un bucket
+    desde_seg = math.floor((hasta.timestamp() - segundos) / resolucion) * resolucion
+    desde = datetime.fromtimestamp(desde_seg, timezone.utc)
+    segundos = hasta.timestamp() - desde_seg
+    puntos = max(1, min(puntos, math.ceil(segundos / resolucion)))
+    
+    filas = _leer_rollups(paciente_id, resolucion, desde)
+    return {
+        "resolucion_seg": resolucion,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "ancho_seg": round(segundos / puntos, 3),
+        "puntos": agrupar_rollups(filas, desde, segundos, puntos)
+    }
+
 # ============ FUNCIONES DE TEST ============
 
 def test_conexion():
-    """Prueba la conexión a Supabase"""
+    """Prueba la conexión a la base de datos"""
     try:
-        response = supabase.table("pacientes").select("count").execute()
-        print(f"✅ Conexión exitosa a Supabase")
+        (repositorio_servicio or repositorio).listar_pacientes(limite=1, columnas=["id", "created_at"])
+        print(f"✅ Conexión exitosa a {'la base local' if URL_BD else 'Supabase'}")
         return True
     except Exception as e:
         print(f"❌ Error de conexión: {e}")
@@ -226,5 +540,5 @@ def test_conexion():
 
 if __name__ == "__main__":
     # Test básico
-    print("🔍 Probando conexión a Supabase...")
+    print("🔍 Probando conexión a la base de datos...")
     test_conexion()
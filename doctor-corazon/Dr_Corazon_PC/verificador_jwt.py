@@ -0,0 +1,205 @@
+# verificador_jwt.py - Verificación local de los JWT de Supabase Auth
+#
+# En lugar de preguntar a Supabase Auth en cada petición quién es el usuario
+# (auth.get_user: una ida y vuelta por página y por llamada a la API), se
+# verifica la firma y la expiración del access_token de la sesión aquí:
+#   - HS256 (proyectos con JWT secret): con SUPABASE_JWT_SECRET
+#   - RS256/ES256 (claves asimétricas): con las claves públicas del JWKS
+#     del proyecto, en caché; solo se vuelven a pedir al expirar la caché
+#     o si aparece un `kid` desconocido (rotación de claves)
+#
+# Requiere PyJWT (pip install "PyJWT[crypto]"); sin él, o sin clave para el
+# algoritmo del token, se lanza VerificacionNoDisponible y el llamador
+# consulta a Supabase Auth como antes.
+#
+# Uso:
+#   verificador = VerificadorJWT(SUPABASE_URL, secreto=os.getenv("SUPABASE_JWT_SECRET"))
+#   claims = verificador.verificar(session['access_token'])
+#   usuario = usuario_desde_claims(claims)   # usuario.id, usuario.email
+
+from types import SimpleNamespace
+
+# PyJWT es opcional: sin él se usa la verificación remota (auth.get_user)
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+ALGORITMOS_ASIMETRICOS = ("RS256", "ES256")
+
+
+class TokenInvalido(ValueError):
+    """Firma, emisor o audiencia no válidos"""
+
+
+class TokenExpirado(TokenInvalido):
+    """Token bien firmado pero expirado (se puede refrescar)"""
+
+
+class VerificacionNoDisponible(RuntimeError):
+    """No hay con qué verificar el token localmente"""
+
+
+def usuario_desde_claims(claims):
+    """
+    Returns:
+        SimpleNamespace: id, email, rol (de Auth), metadata y expira, como el
+            User de supabase-py en lo que usa la aplicación
+    """
+    return SimpleNamespace(
+        id=claims['sub'],
+        email=claims.get('email'),
+        role=claims.get('role'),
+        user_metadata=claims.get('user_metadata', {}),
+        expira=claims.get('exp')
+    )
+
+
+class VerificadorJWT:
+    """
+    Verifica access tokens de Supabase Auth sin llamadas remotas (salvo
+    para refrescar la caché de claves públicas)
+    """
+
+    def __init__(self, url_supabase, secreto=None, claves=None, ttl_claves=600.0,
+                 audiencia="authenticated", margen=10.0):
+        """
+        Args:
+            url_supabase: SUPABASE_URL (emisor esperado y URL del JWKS)
+            secreto: JWT secret del proyecto (tokens HS256)
+            claves: JWKS fijo (dict con 'keys'); None = descargarlo del proyecto
+            ttl_claves: Segundos que se reutiliza el JWKS descargado
+            audiencia: Claim 'aud' esperado
+            margen: Segundos de tolerancia en exp/iat (relojes desfasados)
+        """
+        self.emisor = f"{url_supabase.rstrip('/')}/auth/v1"
+        self.secreto = secreto
+        self.audiencia = audiencia
+        self.margen = margen
+        self._jwks = None
+        self._claves_fijas = None
+        if jwt is None:
+            print("⚠️  PyJWT no instalado: el usuario se verifica con Supabase Auth en cada petición")
+        elif claves is not None:
+            self._claves_fijas = {c.key_id: c for c in jwt.PyJWKSet.from_dict(claves).keys} if claves.get('keys') else {}
+        else:
+            self._jwks = jwt.PyJWKClient(
+                f"{self.emisor}/.well-known/jwks.json",
+                cache_jwk_set=True,
+                lifespan=ttl_claves,
+                timeout=5
+            )
+
+    def _clave(self, token, algoritmo):
+        if algoritmo == "HS256":
+            if not self.secreto:
+                raise VerificacionNoDisponible("Token HS256 sin SUPABASE_JWT_SECRET")
+            return self.secreto
+        if algoritmo not in ALGORITMOS_ASIMETRICOS:
+            raise TokenInvalido(f"Algoritmo no permitido: {algoritmo}")
+
+        if self._claves_fijas is not None:
+            kid = jwt.get_unverified_header(token).get('kid')
+            if kid not in self._claves_fijas:
+                raise TokenInvalido(f"Clave desconocida: {kid}")
+            return self._claves_fijas[kid].key
+        try:
+            return self._jwks.get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientConnectionError as e:
+            raise VerificacionNoDisponible(f"JWKS no disponible: {e}")
+        except jwt.PyJWKClientError as e:
+            raise TokenInvalido(str(e))
+
+    def verificar(self, token):
+        """
+        Args:
+            token: access_token de Supabase Auth
+
+        Returns:
+            dict: Claims verificados (sub, email, role, exp, ...)
+
+        Raises:
+            TokenExpirado: Si expiró (firma válida)
+            TokenInvalido: Si la firma, el emisor o la audiencia no son válidos
+            VerificacionNoDisponible: Si no se puede verificar localmente
+        """
+        if jwt is None:
+            raise VerificacionNoDisponible("PyJWT no instalado")
+        try:
+            algoritmo = jwt.get_unverified_header(token).get('alg')
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalido(str(e))
+
+        clave = self._clave(token, algoritmo)
+        try:
+            return jwt.decode(
+                token, clave,
+                algorithms=[algoritmo],
+                audience=self.audiencia,
+                issuer=self.emisor,
+                leeway=self.margen,
+                options={'require': ['exp', 'sub']}
+            )
+        except jwt.ExpiredSignatureError as e:
+            raise TokenExpirado(str(e))
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalido(str(e))
+
+
+# ============================================================================
+# PRUEBA DEL MÓDULO
+# ============================================================================
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    print("🔑 Verificación local de JWT")
+    print("=" * 50)
+
+    if jwt is None:
+        print("  PyJWT no instalado (pip install 'PyJWT[crypto]')")
+        raise SystemExit(0)
+
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    url = "https://proyecto.supabase.co"
+    ahora = int(time.time())
+    claims = {'sub': 'u1', 'email': 'ana@ejemplo.com', 'role': 'authenticated',
+              'aud': 'authenticated', 'iss': f"{url}/auth/v1", 'iat': ahora, 'exp': ahora + 3600}
+
+    # HS256 con el JWT secret
+    verificador = VerificadorJWT(url, secreto="secreto-de-prueba-de-32-bytes-o-mas", claves={'keys': []})
+    token = jwt.encode(claims, "secreto-de-prueba-de-32-bytes-o-mas", algorithm="HS256")
+    assert usuario_desde_claims(verificador.verificar(token)).id == 'u1'
+
+    for malo, error in [
+        (jwt.encode({**claims, 'exp': ahora - 60}, "secreto-de-prueba-de-32-bytes-o-mas", algorithm="HS256"), TokenExpirado),
+        (jwt.encode(claims, "otro-secreto-de-32-bytes-o-mas-xx", algorithm="HS256"), TokenInvalido),
+        (jwt.encode({**claims, 'aud': 'anon'}, "secreto-de-prueba-de-32-bytes-o-mas", algorithm="HS256"), TokenInvalido),
+        ("no.es.un.jwt", TokenInvalido),
+    ]:
+        try:
+            verificador.verificar(malo)
+            raise AssertionError("Debió fallar")
+        except error:
+            pass
+
+    # ES256 con JWKS (claves asimétricas)
+    privada = ec.generate_private_key(ec.SECP256R1())
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(privada.public_key()))
+    verificador = VerificadorJWT(url, claves={'keys': [{**jwk, 'kid': 'k1', 'alg': 'ES256', 'use': 'sig'}]})
+    token = jwt.encode(claims, privada, algorithm="ES256", headers={'kid': 'k1'})
+    assert verificador.verificar(token)['email'] == 'ana@ejemplo.com'
+    try:
+        verificador.verificar(jwt.encode(claims, privada, algorithm="ES256", headers={'kid': 'k2'}))
+        raise AssertionError("Debió fallar")
+    except TokenInvalido:
+        pass
+
+    inicio = time.perf_counter()
+    for _ in range(1000):
+        verificador.verificar(token)
+    print(f"  Verificación ES256: {(time.perf_counter() - inicio):.2f} ms por token (sin red)")
+
+    print("\n✅ Módulo funcionando correctamente!")